@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of utils.LRUCache against the list-based implementation it
+replaced, plus a check that concurrent misses share a single load.
+
+    python scripts/benchmark_cache.py
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from typing import Any
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "discord-cluster-manager"))
+
+from utils import LRUCache  # noqa: E402
+
+
+class ListLRUCache:
+    """The previous utils.LRUCache, O(n) per hit because of list.remove / pop(0)"""
+
+    def __init__(self, max_size: int):
+        self._cache = {}
+        self._max_size = max_size
+        self._q = []
+
+    def __getitem__(self, key: Any, default: Any = None) -> Any | None:
+        if key not in self._cache:
+            return default
+
+        self._q.remove(key)
+        self._q.append(key)
+        return self._cache[key]
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        if key in self._cache:
+            self._q.remove(key)
+            self._q.append(key)
+            self._cache[key] = value
+            return
+
+        if len(self._cache) >= self._max_size:
+            self._cache.pop(self._q.pop(0))
+
+        self._cache[key] = value
+        self._q.append(key)
+
+
+def bench_operations(cache, keys: list[int]) -> float:
+    """Read-through access pattern, returns ns per operation"""
+    start = time.perf_counter_ns()
+    for key in keys:
+        if cache[key] is None:
+            cache[key] = key
+    return (time.perf_counter_ns() - start) / len(keys)
+
+
+async def bench_single_flight(concurrency: int) -> int:
+    cache = LRUCache(max_size=16)
+    loads = 0
+
+    async def loader():
+        nonlocal loads
+        loads += 1
+        await asyncio.sleep(0.05)  # A database round trip
+        return "value"
+
+    await asyncio.gather(*(cache.get_or_load("key", loader) for _ in range(concurrency)))
+    return loads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--operations", type=int, default=200_000)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 512, 4096])
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    for size in args.sizes:
+        # Mostly hits on a working set slightly larger than the cache
+        keys = [int(rng.paretovariate(1.2) * size / 4) for _ in range(args.operations)]
+        results = []
+        for label, cache in (("list", ListLRUCache(size)), ("ordered dict", LRUCache(size))):
+            results.append(f"{label} {bench_operations(cache, keys):8.0f} ns/op")
+        stats = cache.stats
+        hit_rate = stats["hits"] / (stats["hits"] + stats["misses"])
+        print(f"max_size {size:>5}: " + "   ".join(results) + f"   hit rate {hit_rate:.0%}")
+
+    loads = asyncio.run(bench_single_flight(args.concurrency))
+    print(f"{args.concurrency} concurrent misses on one key -> {loads} load(s)")
+
+
+if __name__ == "__main__":
+    main()
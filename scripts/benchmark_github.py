@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""
+Latency and API usage of the GitHub calls behind a run, against scripts/fake_github.py:
+the shared aiohttp GitHubClient versus the previous pattern of a new PyGithub client
+and repository lookup per call, made from the event loop.
+
+    python scripts/benchmark_github.py
+    python scripts/benchmark_github.py polling --runs 20 --polls 10 --latency 0.05
+    python scripts/benchmark_github.py artifacts --log-mb 500
+
+"Billed" requests are the ones that count against the rate limit, 304s don't.
+The dispatch benchmark triggers `--dispatches` runs at once and checks that each
+is matched to its own run, by correlation ID versus by creation time as before.
+The completion benchmark measures how long after a run completes the monitor
+notices, with webhooks and with the shared poller alone. The artifacts benchmark
+downloads `--downloads` logs at once, and the memory used for one large log. The
+progress benchmark measures how soon each step of a run is shown in its thread,
+while GitHub doesn't serve the job's log until the run is done. The scheduler
+benchmark compares how long users wait for a runner behind one user's burst of
+runs, first come first served versus with RunnerScheduler.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "discord-cluster-manager"))
+
+from cogs.github_cog import GitHubCog  # noqa: E402
+from consts import GPUType  # noqa: E402
+from discord import app_commands  # noqa: E402
+from fake_github import STEPS, FakeGitHub  # noqa: E402
+from github_client import GitHubClient  # noqa: E402
+from job_queue import LocalJobQueue  # noqa: E402
+from runner_scheduler import RunnerScheduler  # noqa: E402
+from status_board import LiveLog  # noqa: E402
+from workflow_monitor import WorkflowMonitor, webhook_app  # noqa: E402
+
+TOKEN = "benchmark"
+
+
+def snapshot(fake: FakeGitHub) -> tuple[int, int]:
+    return fake.stats.requests, fake.stats.billed
+
+
+def report(name: str, fake: FakeGitHub, before: tuple[int, int], seconds: float, calls: int):
+    requests = fake.stats.requests - before[0]
+    billed = fake.stats.billed - before[1]
+    print(
+        f"{name:<28} {seconds * 1000:8.1f} ms total   {seconds / calls * 1000:7.2f} ms/call"
+        f"   {requests:5d} requests   {billed:5d} billed"
+    )
+
+
+async def poll_pygithub(base_url: str, repo: str, run_ids: list[int], polls: int):
+    """Each poll as before: new client, get_repo, get_workflow_run, on the event loop"""
+    from github import Auth, Github
+
+    for _ in range(polls):
+        for run_id in run_ids:
+            client = Github(auth=Auth.Token(TOKEN), base_url=base_url)
+            client.get_repo(repo).get_workflow_run(run_id)
+            # Yield like the per-run monitoring tasks did between their blocking calls
+            await asyncio.sleep(0)
+
+
+async def poll_client(client: GitHubClient, run_ids: list[int], polls: int):
+    async def poll(run_id: int):
+        for _ in range(polls):
+            await client.get_workflow_run(run_id)
+
+    await asyncio.gather(*(poll(run_id) for run_id in run_ids))
+
+
+async def single_call_latency(client: GitHubClient, run_id: int, samples: int) -> float:
+    times = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        await client.get_workflow_run(run_id)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+async def dispatch_by_time(client: GitHubClient, workflow_file: str) -> int | None:
+    """The previous lookup: the newest run created after the dispatch"""
+    trigger_time = datetime.now(timezone.utc).replace(microsecond=0)
+    await client.dispatch_workflow(workflow_file, "main", {})
+    await asyncio.sleep(2)
+    for run in await client.list_workflow_runs(workflow_file):
+        if datetime.fromisoformat(run["created_at"]) >= trigger_time:
+            return run["id"]
+    return None
+
+
+async def bench_dispatch(dispatches: int):
+    print(f"{dispatches} concurrent dispatches, runs appear 1.5 s after")
+    fake = FakeGitHub(queue_delay=3600, latency=0.02, dispatch_delay=1.5)
+    cog = make_cog(fake.start_in_thread(), fake)
+
+    before = snapshot(fake)
+    start = time.perf_counter()
+    run_ids = await asyncio.gather(
+        *(dispatch_by_time(cog.github, "nvidia_workflow.yml") for _ in range(dispatches))
+    )
+    correct = len(set(run_ids) - {None})
+    report("By creation time", fake, before, time.perf_counter() - start, dispatches)
+    print(f"    {correct} of {dispatches} dispatches matched to a distinct run")
+
+    before = snapshot(fake)
+    start = time.perf_counter()
+    run_ids = await asyncio.gather(
+        *(
+            cog.trigger_github_action(f"print({i})", "train.py", GPUType.NVIDIA)
+            for i in range(dispatches)
+        )
+    )
+    correct = sum(
+        run_id is not None and fake.runs[run_id].inputs["script_content"] == f"print({i})"
+        for i, run_id in enumerate(run_ids)
+    )
+    report("By correlation ID", fake, before, time.perf_counter() - start, dispatches)
+    print(f"    {correct} of {dispatches} dispatches matched to their own run")
+    await cog.github.close()
+
+
+async def bench_completion(runs: int, duration: float):
+    print(f"{runs} runs of {duration:.0f} s, previously polled every 60 s each")
+    for webhooks in (True, False):
+        await completion_lag(runs, duration, webhooks)
+
+
+async def completion_lag(runs: int, duration: float, webhooks: bool):
+    """Lag between each run's completion and the monitor returning it"""
+    receiver = None
+    fake = FakeGitHub(queue_delay=1.0, run_duration=duration, latency=0.02)
+    base_url = fake.start_in_thread()
+    client = GitHubClient(TOKEN, fake.repo, api_url=base_url)
+    monitor = WorkflowMonitor(client, min_interval=1.0, max_interval=30.0)
+
+    if webhooks:
+
+        async def on_event(event: str, payload: dict):
+            # The bot passes events on through Postgres, this applies them in place
+            monitor.handle_event(event, payload)
+
+        receiver = web.AppRunner(webhook_app(on_event, "secret"))
+        await receiver.setup()
+        site = web.TCPSite(receiver, "127.0.0.1", 0)
+        await site.start()
+        port = receiver.addresses[0][1]
+        fake.webhook_url = f"http://127.0.0.1:{port}/github/webhook"
+        fake.webhook_secret = "secret"
+
+    lags = []
+
+    async def monitor_run(run_id: int):
+        run = await monitor.wait(run_id, timeout=120)
+        fake_run = fake.runs[run["id"]]
+        lags.append(time.time() - (fake_run.created + fake.queue_delay + fake.run_duration))
+
+    # Spread over a few seconds, like submissions coming in
+    tasks = []
+    for i in range(runs):
+        await client.dispatch_workflow("nvidia_workflow.yml", "main", {"correlation_id": str(i)})
+        await asyncio.sleep(0.2)
+        tasks.append(asyncio.create_task(monitor_run(max(fake.runs))))
+    before = snapshot(fake)
+    await asyncio.gather(*tasks)
+
+    requests = fake.stats.requests - before[0]
+    billed = fake.stats.billed - before[1]
+    name = "Webhooks" if webhooks else "Shared poller"
+    print(
+        f"{name:<28} lag median {statistics.median(lags):5.2f} s, max {max(lags):5.2f} s"
+        f"   {requests:4d} requests   {billed:4d} billed   {fake.stats.webhooks} webhooks"
+    )
+    monitor.close()
+    await client.close()
+    if receiver is not None:
+        await receiver.cleanup()
+
+
+async def bench_polling(args):
+    # Its own thread, since the PyGithub client blocks the benchmark's loop
+    fake = FakeGitHub(queue_delay=3600, latency=args.latency, dispatch_delay=1.5)
+    base_url = fake.start_in_thread()
+
+    client = GitHubClient(TOKEN, fake.repo, api_url=base_url)
+    for _ in range(args.runs):
+        await client.dispatch_workflow("nvidia_workflow.yml", "main", {})
+    await asyncio.sleep(fake.dispatch_delay)
+    run_ids = list(fake.runs)
+    calls = args.runs * args.polls
+
+    print(f"{args.runs} runs x {args.polls} status polls, {args.latency * 1000:.0f} ms latency")
+    try:
+        import github  # noqa: F401
+    except ImportError:
+        print("PyGithub is not installed, skipping the previous client")
+    else:
+        before = snapshot(fake)
+        start = time.perf_counter()
+        await poll_pygithub(base_url, fake.repo, run_ids, args.polls)
+        report("PyGithub, client per call", fake, before, time.perf_counter() - start, calls)
+
+    before = snapshot(fake)
+    start = time.perf_counter()
+    await poll_client(client, run_ids, args.polls)
+    report("GitHubClient, shared", fake, before, time.perf_counter() - start, calls)
+    print(f"    {client.not_modified} of {client.requests} responses were 304 Not Modified")
+
+    # Per-call latency once warm, against a new session (and handshake) per call
+    warm = await single_call_latency(client, run_ids[0], 20)
+    cold = []
+    for _ in range(20):
+        fresh = GitHubClient(TOKEN, fake.repo, api_url=base_url)
+        cold.append(await single_call_latency(fresh, run_ids[0], 1))
+        await fresh.close()
+    print(
+        f"get_workflow_run latency: {warm * 1000:.2f} ms on a kept-alive connection, "
+        f"{statistics.median(cold) * 1000:.2f} ms on a new session"
+    )
+    await client.close()
+
+
+def make_cog(base_url: str, fake: FakeGitHub) -> GitHubCog:
+    bot = SimpleNamespace(run_group=app_commands.Group(name="run", description="run"))
+    bot.jobs = LocalJobQueue()
+    cog = GitHubCog(bot)
+    cog.github = GitHubClient(TOKEN, fake.repo, api_url=base_url)
+    cog.monitor = WorkflowMonitor(cog.github)
+    return cog
+
+
+async def download_whole(client: GitHubClient, run_id: int, directory: str) -> str:
+    """The previous download: whole archive in memory, then a fixed file name"""
+    (artifact,) = await client.list_artifacts(run_id)
+    async with client.session.get(artifact["archive_download_url"]) as response:
+        content = await response.read()
+    path = os.path.join(directory, "training.log.zip")
+    with open(path, "wb") as f:
+        f.write(content)
+    with zipfile.ZipFile(path) as z:
+        with z.open("training.log") as f:
+            logs = f.read().decode("utf-8")
+    os.remove(path)
+    return logs
+
+
+async def bench_artifacts(args):
+    size = int(args.log_mb * 2**20)
+
+    def log(run) -> str:
+        line = f"run {run.id}: step output of a training log\n"
+        return line * (size // len(line) if run.id == large_run else 100)
+
+    fake = FakeGitHub(queue_delay=0, run_duration=0, log=log)
+    base_url = fake.start_in_thread()
+    cog = make_cog(base_url, fake)
+    for _ in range(args.downloads + 1):
+        await cog.github.dispatch_workflow("nvidia_workflow.yml", "main", {})
+    large_run, *small_runs = fake.runs
+    # Built by the fake before measuring
+    for run in fake.runs.values():
+        fake._artifact_zip(run)
+
+    start = time.perf_counter()
+    logs = await asyncio.gather(*(cog.download_artifact(run_id) for run_id in small_runs))
+    correct = sum(
+        log.startswith(f"run {run_id}:") for run_id, log in zip(small_runs, logs, strict=True)
+    )
+    print(
+        f"{args.downloads} concurrent downloads: {correct} got their own log, "
+        f"{(time.perf_counter() - start) * 1000:.0f} ms"
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, download in (
+            (
+                "Whole archive + fixed file",
+                lambda: download_whole(cog.github, large_run, directory),
+            ),
+            ("Streamed, capped", lambda: cog.download_artifact(large_run)),
+        ):
+            tracemalloc.start()
+            start = time.perf_counter()
+            result = await download()
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(
+                f"{name:<28} {seconds * 1000:8.1f} ms   peak {peak / 2**20:7.1f} MiB"
+                f"   log kept {len(result) / 2**20:6.1f} MiB"
+            )
+    await cog.github.close()
+
+
+class FakeMessage:
+    def __init__(self, content: str):
+        self.content = content
+        self.edits = 0
+
+    async def edit(self, content: str):
+        self.content = content
+        self.edits += 1
+
+
+class FakeMessages:
+    """Stands in for the MessageScheduler, keeping what LiveLog posts"""
+
+    def __init__(self):
+        self.sent: list[FakeMessage] = []
+
+    def send(self, channel, content: str, *args, **kwargs) -> asyncio.Future:
+        self.sent.append(FakeMessage(content))
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(self.sent[-1])
+        return future
+
+
+async def bench_progress(args):
+    fake = FakeGitHub(queue_delay=1, run_duration=args.duration)
+    cog = make_cog(fake.start_in_thread(), fake)
+    messages = FakeMessages()
+    progress = LiveLog(messages, channel=None, title="Progress")
+    shown: dict[str, float] = {}
+
+    def on_progress(text: str):
+        progress.append(text)
+        for line in text.splitlines():
+            shown.setdefault(line, time.time())
+
+    async def job_log_status(run_id: int) -> int:
+        await asyncio.sleep(fake.queue_delay + fake.run_duration / 2)
+        async with cog.github.session.get(
+            cog.github._url(f"actions/jobs/{run_id}/logs"), allow_redirects=False
+        ) as response:
+            return response.status
+
+    await cog.github.dispatch_workflow("nvidia_workflow.yml", "main", {})
+    (run,) = fake.runs.values()
+    started = run.created + fake.queue_delay
+    billed = fake.stats.billed
+    mid_run = asyncio.create_task(job_log_status(run.id))
+    await cog.check_workflow_status(run.id, lambda *_: None, on_progress)
+    returned = time.time() - started
+    await progress.close()
+    mid_run_status = await mid_run
+    await cog.github.close()
+
+    # Each line against the time its step started or finished in the fake
+    step = fake.run_duration / len(STEPS)
+    lags = []
+    for line, at in shown.items():
+        number = next(i for i, name in enumerate(STEPS, start=1) if f"› {name}" in line)
+        happened = started + (number - (1 if line.endswith("...") else 0)) * step
+        lags.append(at - happened)
+
+    print(f"Run of {args.duration:.0f} s in {len(STEPS)} steps")
+    print(f"Job log while running    HTTP {mid_run_status}")
+    print(
+        f"Steps shown live         lag median {statistics.median(lags):4.1f} s, "
+        f"max {max(lags):4.1f} s"
+    )
+    print(f"Log shown from artifact  {returned:5.1f} s after the start")
+    print(
+        f"{len(shown)} step updates in {messages.sent[0].edits + 1} message updates, "
+        f"{fake.stats.billed - billed} billed requests"
+    )
+
+
+async def queue_waits(args, slot) -> dict[str, list[float]]:
+    """Seconds each user waited for a runner, with `slot(user, deadline)` holding one"""
+    waits: dict[str, list[float]] = {}
+    soon = datetime.now(timezone.utc) + timedelta(hours=1)
+
+    async def run(user: str, deadline: datetime | None):
+        queued = time.perf_counter()
+        async with slot(user, deadline):
+            waits.setdefault(user, []).append(time.perf_counter() - queued)
+            await asyncio.sleep(args.run_seconds)
+
+    # One user submits a burst, then others a few runs each, one of them for a
+    # leaderboard that ends within the hour
+    runs = [run("heavy", None) for _ in range(args.burst)]
+    runs += [run(f"user {i}", None) for i in range(args.users) for _ in range(2)]
+    runs += [run("deadline", soon) for _ in range(2)]
+    await asyncio.gather(*runs)
+    return waits
+
+
+async def bench_scheduler(args):
+    print(
+        f"{args.capacity} runners, one user submits {args.burst} runs, then "
+        f"{args.users} users 2 each and one 2 for a leaderboard ending within the hour"
+    )
+    semaphore = asyncio.Semaphore(args.capacity)
+
+    @asynccontextmanager
+    async def fifo(user, deadline):
+        async with semaphore:
+            yield
+
+    scheduler = RunnerScheduler({"NVIDIA": args.capacity})
+
+    def fair(user, deadline):
+        return scheduler.slot("NVIDIA", hash(user), deadline)
+
+    for name, slot in (("First come first served", fifo), ("RunnerScheduler", fair)):
+        waits = await queue_waits(args, slot)
+        others = [
+            wait for user, times in waits.items() if user.startswith("user") for wait in times
+        ]
+        print(
+            f"{name:<24} wait: heavy user {statistics.mean(waits['heavy']):5.2f} s, "
+            f"others {statistics.mean(others):5.2f} s, deadline {max(waits['deadline']):5.2f} s"
+        )
+
+
+SECTIONS = {
+    "polling": bench_polling,
+    "dispatch": lambda args: bench_dispatch(args.dispatches),
+    "completion": lambda args: bench_completion(args.runs, args.duration),
+    "artifacts": bench_artifacts,
+    "progress": bench_progress,
+    "scheduler": bench_scheduler,
+}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("sections", nargs="*", help=f"Any of {', '.join(SECTIONS)}, default all")
+    parser.add_argument("--runs", type=int, default=10, help="Runs monitored at once")
+    parser.add_argument("--polls", type=int, default=5, help="Status polls per run")
+    parser.add_argument("--latency", type=float, default=0.02, help="Server latency (s)")
+    parser.add_argument("--dispatches", type=int, default=10, help="Concurrent dispatches")
+    parser.add_argument("--duration", type=float, default=20, help="Run duration (s)")
+    parser.add_argument("--downloads", type=int, default=20, help="Concurrent downloads")
+    parser.add_argument("--log-mb", type=float, default=200, help="Size of the large log")
+    parser.add_argument("--capacity", type=int, default=4, help="Runners of the GPU type")
+    parser.add_argument("--burst", type=int, default=40, help="Runs of the heavy user")
+    parser.add_argument("--users", type=int, default=5, help="Other users")
+    parser.add_argument("--run-seconds", type=float, default=0.1, help="Duration of runs")
+    args = parser.parse_args()
+
+    for section in args.sections or SECTIONS:
+        print(f"--- {section}")
+        await SECTIONS[section](args)
+        print()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
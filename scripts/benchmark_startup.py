@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Cold start cost of the bot process: import time (from python -X importtime) and
+peak memory of importing bot.py and the cogs of the enabled schedulers.
+
+    python scripts/benchmark_startup.py
+    python scripts/benchmark_startup.py --schedulers github,modal github ""
+
+Each configuration runs in fresh interpreters, nothing is connected or logged in.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+SRC_DIR = os.path.join(os.path.dirname(__file__), "..", "src", "discord-cluster-manager")
+
+CHILD = """
+import json, resource, time
+start = time.perf_counter()
+import bot
+cogs = bot.enabled_cogs()
+print(json.dumps({
+    "seconds": time.perf_counter() - start,
+    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "cogs": [cog.__name__ for cog in cogs],
+}))
+"""
+
+
+def run_once(schedulers: str) -> tuple[dict, dict[str, int]]:
+    """Returns the child's report and the self import time per top-level package (us)"""
+    env = {
+        "DISCORD_TOKEN": "benchmark",
+        "GITHUB_TOKEN": "benchmark",
+        "GITHUB_REPO": "benchmark/benchmark",
+        **os.environ,
+        "ENABLED_SCHEDULERS": schedulers,
+    }
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD],
+        cwd=SRC_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    packages = defaultdict(int)
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:") :].split("|")
+        packages[name.strip().split(".")[0]] += int(self_us)
+    return json.loads(result.stdout.splitlines()[-1]), packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--schedulers",
+        nargs="+",
+        default=["github,modal", "github", "modal", ""],
+        help="ENABLED_SCHEDULERS values to compare",
+    )
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8)
+    args = parser.parse_args()
+
+    for schedulers in args.schedulers:
+        runs = [run_once(schedulers) for _ in range(args.rounds)]
+        reports = [report for report, _ in runs]
+        import_ms = statistics.median(sum(packages.values()) for _, packages in runs) / 1000
+        wall_ms = statistics.median(report["seconds"] for report in reports) * 1000
+        rss_mib = statistics.median(report["max_rss_kb"] for report in reports) / 1024
+
+        print(
+            f"ENABLED_SCHEDULERS={schedulers!r:<16} imports {import_ms:7.1f} ms"
+            f"   wall {wall_ms:7.1f} ms   peak RSS {rss_mib:6.1f} MiB"
+            f"   cogs: {', '.join(reports[0]['cogs'])}"
+        )
+        packages = runs[len(runs) // 2][1]
+        slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[: args.top]
+        print("    " + "  ".join(f"{name} {us / 1000:.0f}ms" for name, us in slowest))
+
+
+if __name__ == "__main__":
+    main()
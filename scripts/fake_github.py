@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+"""
+A fake of the GitHub REST endpoints the bot uses, to run the bot and the
+benchmarks without a repository, runners or rate limit.
+
+    python scripts/fake_github.py --port 8765 --run-duration 20
+    GITHUB_API_URL=http://127.0.0.1:8765 python src/discord-cluster-manager/bot.py
+
+Dispatched runs show up after `--dispatch-delay` seconds, named like the
+workflows' run-name. They are queued for `--queue-delay` seconds, then in progress for
+`--run-duration` seconds, then succeed with a training-artifacts artifact holding
+a training.log. Like on GitHub, the steps of their job are listed with their
+status as they run, but the job's log is only served once it is completed. GETs
+answer with an ETag and a 304 to a matching If-None-Match, which doesn't count
+against the (fake) rate limit. Artifact and log downloads redirect to another
+origin that rejects requests still carrying the token, like blob storage.
+With `--webhook-url`, workflow_run and workflow_job events are delivered there as
+runs change, signed with `--webhook-secret`.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import hmac
+import io
+import itertools
+import json
+import threading
+import time
+import zipfile
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+import aiohttp
+from aiohttp import web
+
+DEFAULT_LOG = "Running training...\nscore: 0.123456789\nDone\n"
+
+# Steps of the job of every run, taking equal parts of the run duration
+STEPS = (
+    "Set up job",
+    "Setup Python",
+    "Install dependencies",
+    "Run script",
+    "Upload training artifacts",
+    "Complete job",
+)
+
+
+@dataclass
+class FakeRun:
+    id: int
+    workflow_id: int
+    inputs: dict
+    ref: str
+    created: float
+    cancelled: bool = False
+
+
+@dataclass
+class FakeGitHubStats:
+    requests: int = 0
+    not_modified: int = 0
+    webhooks: int = 0
+    # Requests that count against the rate limit
+    billed: int = 0
+    by_route: dict = field(default_factory=dict)
+
+
+def _timestamp(seconds: float) -> str:
+    return datetime.fromtimestamp(int(seconds), timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class FakeGitHub:
+    def __init__(
+        self,
+        repo: str = "fake/repo",
+        queue_delay: float = 1.0,
+        run_duration: float = 5.0,
+        latency: float = 0.0,
+        log: str | Callable[[FakeRun], str] = DEFAULT_LOG,
+        dispatch_delay: float = 0.0,
+        webhook_url: Optional[str] = None,
+        webhook_secret: Optional[str] = None,
+    ):
+        self.repo = repo
+        self.dispatch_delay = dispatch_delay
+        self.webhook_url = webhook_url
+        self.webhook_secret = webhook_secret
+        self._webhook_session: Optional[aiohttp.ClientSession] = None
+        self._event_tasks: set[asyncio.Task] = set()
+        self.queue_delay = queue_delay
+        self.run_duration = run_duration
+        self.latency = latency
+        # training.log of every run, or a function of the run
+        self.log = log
+        self._zips: dict[int, bytes] = {}
+
+        self.workflows = {"nvidia_workflow.yml": 1, "amd_workflow.yml": 2}
+        self.workflow_names = {1: "NVIDIA PyTorch/CUDA Job", 2: "AMD PyTorch Job"}
+        self.runs: dict[int, FakeRun] = {}
+        self.stats = FakeGitHubStats()
+        self._run_ids = itertools.count(1000)
+        self.base_url: Optional[str] = None
+        self.blob_url: Optional[str] = None
+
+        self.app = web.Application(middlewares=[self._middleware])
+        prefix = f"/repos/{repo}"
+        self.app.add_routes(
+            [
+                web.get(prefix, self.get_repo),
+                web.get(prefix + "/actions/workflows/{workflow}", self.get_workflow),
+                web.post(prefix + "/actions/workflows/{workflow}/dispatches", self.dispatch),
+                web.get(prefix + "/actions/workflows/{workflow}/runs", self.list_runs),
+                web.get(prefix + "/actions/runs", self.list_repository_runs),
+                web.get(prefix + "/actions/runs/{run_id}", self.get_run),
+                web.post(prefix + "/actions/runs/{run_id}/cancel", self.cancel_run),
+                web.get(prefix + "/actions/runs/{run_id}/artifacts", self.list_artifacts),
+                web.get(prefix + "/actions/artifacts/{run_id}/zip", self.download_artifact),
+                web.get(prefix + "/actions/runs/{run_id}/jobs", self.list_jobs),
+                web.get(prefix + "/actions/jobs/{run_id}/logs", self.download_job_log),
+                web.get("/blob/{run_id}", self.blob),
+                web.get("/job-logs/{run_id}", self.job_log_blob),
+                web.get("/_stats", self.get_stats),
+            ]
+        )
+
+    # Serving
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Serve on the running loop, returns the API URL"""
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.base_url = f"http://{host}:{port}"
+        # Same server, but a different origin than the API
+        self.blob_url = f"http://localhost:{port}"
+        return self.base_url
+
+    async def stop(self):
+        for task in self._event_tasks:
+            task.cancel()
+        if self._webhook_session is not None:
+            await self._webhook_session.close()
+        await self._runner.cleanup()
+
+    def start_in_thread(self) -> str:
+        """Serve from a thread with its own loop, for clients that block"""
+        ready = threading.Event()
+        loop = asyncio.new_event_loop()
+
+        def serve():
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start())
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=serve, daemon=True).start()
+        ready.wait()
+        return self.base_url
+
+    # Helpers
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        self.stats.requests += 1
+        route = request.match_info.route.resource
+        name = route.canonical if route else request.path
+        self.stats.by_route[name] = self.stats.by_route.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if request.path.startswith("/repos/") and "Authorization" not in request.headers:
+            return web.json_response({"message": "Requires authentication"}, status=401)
+
+        response = await handler(request)
+        # Blob storage is not the API
+        if response.status != 304 and request.path.startswith("/repos/"):
+            self.stats.billed += 1
+        response.headers["X-RateLimit-Remaining"] = str(max(5000 - self.stats.billed, 0))
+        return response
+
+    def _json(self, request: web.Request, body) -> web.Response:
+        """JSON response with an ETag, or a 304 if the client has it already"""
+        data = json.dumps(body, sort_keys=True).encode()
+        etag = f'"{hashlib.sha1(data).hexdigest()}"'
+        if request.headers.get("If-None-Match") == etag:
+            self.stats.not_modified += 1
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(body=data, content_type="application/json", headers={"ETag": etag})
+
+    def _api(self, path: str) -> str:
+        return f"{self.base_url}/repos/{self.repo}/{path}"
+
+    def _workflow_id(self, request: web.Request) -> int:
+        workflow = request.match_info["workflow"]
+        if workflow.isdigit() and int(workflow) in self.workflows.values():
+            return int(workflow)
+        if workflow in self.workflows:
+            return self.workflows[workflow]
+        raise web.HTTPNotFound()
+
+    def _run(self, request: web.Request) -> FakeRun:
+        run = self.runs.get(int(request.match_info["run_id"]))
+        if run is None or run.created > time.time():
+            raise web.HTTPNotFound()
+        return run
+
+    def run_status(self, run: FakeRun) -> tuple[str, Optional[str]]:
+        elapsed = time.time() - run.created
+        if run.cancelled:
+            return "completed", "cancelled"
+        if elapsed < self.queue_delay:
+            return "queued", None
+        if elapsed < self.queue_delay + self.run_duration:
+            return "in_progress", None
+        return "completed", "success"
+
+    def run_json(self, run: FakeRun) -> dict:
+        status, conclusion = self.run_status(run)
+        created = datetime.fromtimestamp(int(run.created), timezone.utc)
+        # run-name: ${{ github.workflow }} ${{ inputs.correlation_id }}
+        name = f"{self.workflow_names[run.workflow_id]} {run.inputs.get('correlation_id', '')}"
+        return {
+            "id": run.id,
+            "name": name.strip(),
+            "workflow_id": run.workflow_id,
+            "status": status,
+            "conclusion": conclusion,
+            "event": "workflow_dispatch",
+            "head_branch": run.ref,
+            "created_at": created.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "url": self._api(f"actions/runs/{run.id}"),
+            "html_url": f"https://github.com/{self.repo}/actions/runs/{run.id}",
+        }
+
+    async def _send_webhook(self, event: str, payload: dict):
+        if self._webhook_session is None:
+            self._webhook_session = aiohttp.ClientSession()
+        body = json.dumps(payload).encode()
+        headers = {"X-GitHub-Event": event, "Content-Type": "application/json"}
+        if self.webhook_secret:
+            digest = hmac.new(self.webhook_secret.encode(), body, hashlib.sha256).hexdigest()
+            headers["X-Hub-Signature-256"] = f"sha256={digest}"
+        try:
+            async with self._webhook_session.post(self.webhook_url, data=body, headers=headers):
+                self.stats.webhooks += 1
+        except aiohttp.ClientError as e:
+            print(f"Webhook delivery failed: {e}")
+
+    async def _emit_events(self, run: FakeRun):
+        """Deliver the events of a run when it is created, starts and completes"""
+
+        def job(status: str, conclusion: Optional[str] = None) -> dict:
+            return {
+                "id": run.id,
+                "run_id": run.id,
+                "status": status,
+                "conclusion": conclusion,
+                "html_url": f"https://github.com/{self.repo}/actions/runs/{run.id}/job/1",
+            }
+
+        await asyncio.sleep(self.dispatch_delay)
+        await self._send_webhook(
+            "workflow_run", {"action": "requested", "workflow_run": self.run_json(run)}
+        )
+        await asyncio.sleep(self.queue_delay)
+        if run.cancelled:
+            return
+        await self._send_webhook(
+            "workflow_job", {"action": "in_progress", "workflow_job": job("in_progress")}
+        )
+        await self._send_webhook(
+            "workflow_run", {"action": "in_progress", "workflow_run": self.run_json(run)}
+        )
+        await asyncio.sleep(self.run_duration)
+        if run.cancelled:
+            return
+        await self._send_webhook(
+            "workflow_job", {"action": "completed", "workflow_job": job("completed", "success")}
+        )
+        await self._send_webhook(
+            "workflow_run", {"action": "completed", "workflow_run": self.run_json(run)}
+        )
+
+    def _emit(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._event_tasks.add(task)
+        task.add_done_callback(self._event_tasks.discard)
+
+    def _artifact_zip(self, run: FakeRun) -> bytes:
+        if run.id not in self._zips:
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+                archive.writestr("training.log", self.log(run) if callable(self.log) else self.log)
+            self._zips[run.id] = buffer.getvalue()
+        return self._zips[run.id]
+
+    def job_log(self, run: FakeRun) -> bytes:
+        """The log of a run's job, as GitHub serves it once the job is completed"""
+        log = self.log(run) if callable(self.log) else self.log
+        lines = ["##[group]Run python train.py", "##[endgroup]", *log.splitlines()]
+        start = run.created + self.queue_delay
+        return "".join(
+            datetime.fromtimestamp(start + i * 0.001, timezone.utc).strftime(
+                "%Y-%m-%dT%H:%M:%S.%f0Z "
+            )
+            + line
+            + "\n"
+            for i, line in enumerate(lines)
+        ).encode()
+
+    def steps_json(self, run: FakeRun) -> list[dict]:
+        status, _ = self.run_status(run)
+        start = run.created + self.queue_delay
+        length = self.run_duration / len(STEPS)
+        steps = []
+        for number, name in enumerate(STEPS, start=1):
+            started, completed = start + (number - 1) * length, start + number * length
+            step = {
+                "number": number,
+                "name": name,
+                "status": "queued",
+                "conclusion": None,
+                "started_at": None,
+                "completed_at": None,
+            }
+            if status == "completed" and run.cancelled and time.time() < completed:
+                step.update(status="completed", conclusion="cancelled")
+            elif time.time() >= completed:
+                step.update(
+                    status="completed",
+                    conclusion="success",
+                    started_at=_timestamp(started),
+                    completed_at=_timestamp(completed),
+                )
+            elif time.time() >= started:
+                step.update(status="in_progress", started_at=_timestamp(started))
+            steps.append(step)
+        return steps
+
+    def _check_blob_request(self, request: web.Request):
+        if "Authorization" in request.headers:
+            raise web.HTTPBadRequest(text="Unexpected Authorization header")
+
+    # Routes
+
+    async def get_repo(self, request: web.Request) -> web.Response:
+        return self._json(
+            request,
+            {"id": 1, "full_name": self.repo, "url": f"{self.base_url}/repos/{self.repo}"},
+        )
+
+    async def get_workflow(self, request: web.Request) -> web.Response:
+        workflow_id = self._workflow_id(request)
+        path = next(name for name, id in self.workflows.items() if id == workflow_id)
+        return self._json(
+            request,
+            {
+                "id": workflow_id,
+                "name": self.workflow_names[workflow_id],
+                "path": f".github/workflows/{path}",
+                "state": "active",
+                "url": self._api(f"actions/workflows/{workflow_id}"),
+            },
+        )
+
+    async def dispatch(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        run = FakeRun(
+            id=next(self._run_ids),
+            workflow_id=self._workflow_id(request),
+            inputs=body.get("inputs", {}),
+            ref=body["ref"],
+            # GitHub creates the run a moment after answering the dispatch
+            created=time.time() + self.dispatch_delay,
+        )
+        self.runs[run.id] = run
+        if self.webhook_url:
+            self._emit(self._emit_events(run))
+        return web.Response(status=204)
+
+    async def list_runs(self, request: web.Request) -> web.Response:
+        workflow_id = self._workflow_id(request)
+        query = request.query
+        since = 0.0
+        if query.get("created", "").startswith(">="):
+            since = datetime.fromisoformat(query["created"][2:]).timestamp()
+        runs = [
+            self.run_json(run)
+            for run in sorted(self.runs.values(), key=lambda run: run.id, reverse=True)
+            if run.workflow_id == workflow_id
+            and since <= run.created <= time.time()
+            and query.get("branch", run.ref) == run.ref
+            and query.get("event", "workflow_dispatch") == "workflow_dispatch"
+        ]
+        per_page = int(request.query.get("per_page", 30))
+        return self._json(request, {"total_count": len(runs), "workflow_runs": runs[:per_page]})
+
+    async def list_repository_runs(self, request: web.Request) -> web.Response:
+        runs = [
+            self.run_json(run)
+            for run in sorted(self.runs.values(), key=lambda run: run.id, reverse=True)
+            if run.created <= time.time()
+        ]
+        per_page = int(request.query.get("per_page", 30))
+        return self._json(request, {"total_count": len(runs), "workflow_runs": runs[:per_page]})
+
+    async def get_run(self, request: web.Request) -> web.Response:
+        return self._json(request, self.run_json(self._run(request)))
+
+    async def cancel_run(self, request: web.Request) -> web.Response:
+        run = self._run(request)
+        run.cancelled = True
+        if self.webhook_url:
+            self._emit(
+                self._send_webhook(
+                    "workflow_run", {"action": "completed", "workflow_run": self.run_json(run)}
+                )
+            )
+        return web.Response(status=202)
+
+    async def list_artifacts(self, request: web.Request) -> web.Response:
+        run = self._run(request)
+        status, conclusion = self.run_status(run)
+        artifacts = []
+        if conclusion == "success":
+            artifacts.append(
+                {
+                    "id": run.id,
+                    "name": "training-artifacts",
+                    "size_in_bytes": len(self._artifact_zip(run)),
+                    "archive_download_url": self._api(f"actions/artifacts/{run.id}/zip"),
+                }
+            )
+        return self._json(request, {"total_count": len(artifacts), "artifacts": artifacts})
+
+    async def download_artifact(self, request: web.Request) -> web.Response:
+        run = self._run(request)
+        raise web.HTTPFound(f"{self.blob_url}/blob/{run.id}")
+
+    async def list_jobs(self, request: web.Request) -> web.Response:
+        run = self._run(request)
+        status, conclusion = self.run_status(run)
+        job = {
+            # One job per run, with the ID of the run
+            "id": run.id,
+            "run_id": run.id,
+            "name": "train",
+            "status": status,
+            "conclusion": conclusion,
+            "html_url": f"https://github.com/{self.repo}/actions/runs/{run.id}/job/{run.id}",
+            "steps": self.steps_json(run) if status != "queued" else [],
+        }
+        return self._json(request, {"total_count": 1, "jobs": [job]})
+
+    async def download_job_log(self, request: web.Request) -> web.Response:
+        run = self._run(request)
+        if self.run_status(run)[0] != "completed":
+            raise web.HTTPNotFound()
+        raise web.HTTPFound(f"{self.blob_url}/job-logs/{run.id}")
+
+    async def job_log_blob(self, request: web.Request) -> web.Response:
+        self._check_blob_request(request)
+        return web.Response(body=self.job_log(self._run(request)), content_type="text/plain")
+
+    async def blob(self, request: web.Request) -> web.Response:
+        self._check_blob_request(request)
+        return web.Response(
+            body=self._artifact_zip(self._run(request)), content_type="application/zip"
+        )
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats.__dict__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--repo", default="fake/repo")
+    parser.add_argument("--dispatch-delay", type=float, default=2.0)
+    parser.add_argument("--queue-delay", type=float, default=1.0)
+    parser.add_argument("--run-duration", type=float, default=5.0)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to requests")
+    parser.add_argument("--webhook-url", help="e.g. http://127.0.0.1:8080/github/webhook")
+    parser.add_argument("--webhook-secret")
+    args = parser.parse_args()
+
+    fake = FakeGitHub(
+        args.repo,
+        args.queue_delay,
+        args.run_duration,
+        args.latency,
+        dispatch_delay=args.dispatch_delay,
+        webhook_url=args.webhook_url,
+        webhook_secret=args.webhook_secret,
+    )
+
+    async def serve():
+        print(f"Fake GitHub API for {args.repo} at {await fake.start(args.host, args.port)}")
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,95 @@
 import argparse
+import asyncio
+import gzip
+import hashlib
+import importlib
+import io
+import json
+import time
+from contextlib import contextmanager
 from datetime import datetime
+from typing import Optional
 
 import discord
-from cogs.github_cog import GitHubCog
-from cogs.leaderboard_cog import LeaderboardCog
-from cogs.misc_cog import BotManagerCog
-from cogs.modal_cog import ModalCog
-from cogs.verify_run_cog import VerifyRunCog
 from consts import (
     DISCORD_CLUSTER_STAGING_ID,
     DISCORD_DEBUG_CLUSTER_STAGING_ID,
     DISCORD_DEBUG_TOKEN,
+    DISCORD_SHARD_COUNT,
+    DISCORD_SHARD_IDS,
     DISCORD_TOKEN,
+    ENABLED_SCHEDULERS,
+    LOG_ATTACHMENT_THRESHOLD,
+    LOG_COMPRESSION_THRESHOLD,
     POSTGRES_DATABASE,
     POSTGRES_HOST,
     POSTGRES_PASSWORD,
     POSTGRES_PORT,
     POSTGRES_USER,
+    SchedulerType,
     init_environment,
 )
 from discord import app_commands
 from discord.ext import commands
+from job_queue import LocalJobQueue, PostgresJobQueue
 from leaderboard_db import LeaderboardDB
-from utils import setup_logging
+from message_scheduler import MessagePriority, MessageScheduler
+from submission_writer import SubmissionWriter
+from utils import UserNameResolver, log_preview, setup_logging, split_message
 
 logger = setup_logging()
 
+PROCESS_START = time.perf_counter()
 
-class ClusterBot(commands.Bot):
-    def __init__(self, debug_mode=False):
+
+# Process roles: "all" answers interactions and runs the jobs they start in the same
+# process. "gateway" only answers interactions and queues the jobs in Postgres for
+# "worker" processes, which have no gateway connection and talk to Discord over HTTP.
+ROLES = ("all", "gateway", "worker")
+
+# Cogs as (module, class, schedulers they need). Modules are imported only for the
+# enabled schedulers, so a bot without Modal never loads the modal package.
+COGS = [
+    ("cogs.modal_cog", "ModalCog", {SchedulerType.MODAL}),
+    ("cogs.github_cog", "GitHubCog", {SchedulerType.GITHUB}),
+    ("cogs.misc_cog", "BotManagerCog", set()),
+    ("cogs.leaderboard_cog", "LeaderboardCog", set()),
+    ("cogs.verify_run_cog", "VerifyRunCog", {SchedulerType.GITHUB, SchedulerType.MODAL}),
+]
+
+# Verification reads the messages of a run once it is done, so it needs the run to
+# happen in the same process
+IN_PROCESS_COGS = {"VerifyRunCog"}
+
+
+def enabled_cogs(role: str = "all") -> list[type[commands.Cog]]:
+    return [
+        getattr(importlib.import_module(module), name)
+        for module, name, schedulers in COGS
+        if schedulers <= ENABLED_SCHEDULERS and (role == "all" or name not in IN_PROCESS_COGS)
+    ]
+
+
+@contextmanager
+def startup_phase(name: str):
+    start = time.perf_counter()
+    yield
+    logger.info(f"Startup: {name} took {(time.perf_counter() - start) * 1000:.0f} ms")
+
+
+class ClusterBot(commands.AutoShardedBot):
+    def __init__(self, debug_mode=False, role: str = "all"):
         intents = discord.Intents.default()
         intents.members = True
         intents.message_content = True
-        super().__init__(intents=intents, command_prefix="!")
+        super().__init__(
+            intents=intents,
+            command_prefix="!",
+            shard_count=DISCORD_SHARD_COUNT,
+            shard_ids=DISCORD_SHARD_IDS,
+        )
         self.debug_mode = debug_mode
+        self.role = role
 
         # Create the run group
         self.run_group = app_commands.Group(
@@ -53,16 +109,29 @@ class ClusterBot(commands.Bot):
             POSTGRES_PASSWORD,
             POSTGRES_PORT,
         )
+        self.submission_writer = SubmissionWriter(self.leaderboard_db)
+        self.user_names = UserNameResolver(self)
+        self.messages = MessageScheduler()
+        # Cogs register their job handlers here, see job_queue
+        self.jobs = LocalJobQueue() if role == "all" else PostgresJobQueue(self.leaderboard_db)
+        # Started in setup_hook, which a failed login never reaches
+        self.leaderboard_changes_task: Optional[asyncio.Task] = None
 
     async def setup_hook(self):
+        with startup_phase("background tasks"):
+            self.submission_writer.start()
+            self.leaderboard_changes_task = asyncio.create_task(self.leaderboard_db.listen())
+
         logger.info(f"Syncing commands for staging guild {DISCORD_CLUSTER_STAGING_ID}")
         try:
             # Load cogs
-            await self.add_cog(ModalCog(self))
-            await self.add_cog(GitHubCog(self))
-            await self.add_cog(BotManagerCog(self))
-            await self.add_cog(LeaderboardCog(self))
-            await self.add_cog(VerifyRunCog(self))
+            with startup_phase("load cogs"):
+                for cog in enabled_cogs(self.role):
+                    await self.add_cog(cog(self))
+
+            if self.role == "worker":
+                # Commands belong to the gateway
+                return
 
             guild_id = (
                 DISCORD_CLUSTER_STAGING_ID
@@ -71,18 +140,72 @@ class ClusterBot(commands.Bot):
             )
 
             if guild_id:
-                guild = discord.Object(id=int(guild_id))
-                self.tree.clear_commands(guild=guild)
-                logger.info("Cleared existing commands")
-                self.tree.copy_global_to(guild=guild)
-                await self.tree.sync(guild=guild)
-                commands = await self.tree.fetch_commands(guild=guild)
-                logger.info(f"Synced commands: {[cmd.name for cmd in commands]}")
+                with startup_phase("command sync"):
+                    await self.sync_commands(guild_id)
         except Exception as e:
             logger.error(f"Failed to sync commands: {e}")
 
+    def command_tree_hash(self, guild: discord.abc.Snowflake) -> str:
+        """Stable hash of the commands as they would be sent to Discord for a guild"""
+        payload = sorted(
+            (command.to_dict(self.tree) for command in self.tree.get_commands(guild=guild)),
+            key=lambda command: (command["type"], command["name"]),
+        )
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    async def sync_commands(self, guild_id: str):
+        """
+        Sync the command tree to a guild, unless the tree synced last time is the same.
+        Syncing is slow and tightly rate limited, which adds up over rolling restarts.
+        """
+        guild = discord.Object(id=int(guild_id))
+        self.tree.clear_commands(guild=guild)
+        self.tree.copy_global_to(guild=guild)
+        tree_hash = self.command_tree_hash(guild)
+
+        try:
+            async with self.leaderboard_db as db:
+                synced_hash = await db.get_command_tree_hash(guild_id)
+        except Exception as e:
+            logger.warning(f"Could not read the last command sync, syncing anyway: {e}")
+            synced_hash = None
+
+        if synced_hash == tree_hash:
+            logger.info(f"Command tree unchanged ({tree_hash[:12]}), skipping sync")
+            return
+
+        await self.tree.sync(guild=guild)
+        commands = await self.tree.fetch_commands(guild=guild)
+        logger.info(f"Synced commands: {[cmd.name for cmd in commands]}")
+
+        try:
+            async with self.leaderboard_db as db:
+                await db.set_command_tree_hash(guild_id, tree_hash)
+        except Exception as e:
+            logger.warning(f"Could not record the command sync: {e}")
+
+    async def run_worker(self, token: str):
+        """Run queued jobs until interrupted, without connecting to the gateway"""
+        async with self:
+            await self.login(token)
+            await self.jobs.run_worker()
+
+    def get_messageable(self, channel_id: int) -> discord.abc.Messageable:
+        """A channel or thread to send to, also in processes without a gateway cache"""
+        return self.get_channel(channel_id) or self.get_partial_messageable(channel_id)
+
+    async def close(self):
+        await self.messages.close()
+        await super().close()
+        if self.leaderboard_changes_task is not None:
+            self.leaderboard_changes_task.cancel()
+        await self.submission_writer.close()
+        self.leaderboard_db.disconnect()
+
     async def on_ready(self):
-        logger.info(f"Logged in as {self.user}")
+        logger.info(
+            f"Logged in as {self.user}, {time.perf_counter() - PROCESS_START:.2f}s after start"
+        )
         for guild in self.guilds:
             try:
                 if self.debug_mode:
@@ -102,23 +225,57 @@ class ClusterBot(commands.Bot):
         )
         return thread
 
-    async def send_chunked_message(self, channel, content: str, code_block: bool = True):
+    async def send_chunked_message(
+        self, channel, content: str, code_block: bool = True, title: str = "Output"
+    ):
         """
-        Send a long message in chunks to avoid Discord's message length limit
+        Send a long message in chunks to avoid Discord's message length limit. Content
+        over LOG_ATTACHMENT_THRESHOLD is sent as a single file with a preview instead.
 
         Args:
             channel: The discord channel/thread to send to
             content: The content to send
             code_block: Whether to wrap the content in code blocks
+            title: Heading of each code block
         """
-        chunk_size = 1900  # Leave room for code block syntax
-        chunks = [content[i : i + chunk_size] for i in range(0, len(content), chunk_size)]
+        if len(content) > LOG_ATTACHMENT_THRESHOLD:
+            await self.send_log_file(channel, content, title=title)
+            return
+
+        if code_block:
+            # Fences in the content would end the wrapping block early
+            content = content.replace("```", "`\u200b``")
+        chunks = split_message(content, 1900)  # Leave room for code block syntax
 
-        for i, chunk in enumerate(chunks):
-            if code_block:
-                await channel.send(f"```\nOutput (part {i + 1}/{len(chunks)}):\n{chunk}\n```")
-            else:
-                await channel.send(chunk)
+        if code_block:
+            chunks = [
+                f"```\n{title} (part {i + 1}/{len(chunks)}):\n{chunk}\n```"
+                for i, chunk in enumerate(chunks)
+            ]
+
+        # Queued together so the scheduler paces them instead of hitting the rate limit
+        await asyncio.gather(
+            *(self.messages.send(channel, chunk, MessagePriority.RESULT) for chunk in chunks)
+        )
+
+    async def send_log_file(
+        self, channel, content: str, filename: str = "output.log", title: str = "Logs"
+    ):
+        """Send a log as one attachment, gzipped if large, with its head and tail inline"""
+        data = content.encode("utf-8")
+        size_kb = len(data) / 1024
+        if len(data) > LOG_COMPRESSION_THRESHOLD:
+            data = gzip.compress(data)
+            filename += ".gz"
+
+        line_count = content.count("\n") + 1
+        await self.messages.send(
+            channel,
+            f"```\n{title} ({line_count} lines, {size_kb:.1f} KB, "
+            f"full log attached):\n{log_preview(content)}\n```",
+            MessagePriority.RESULT,
+            file=discord.File(io.BytesIO(data), filename=filename),
+        )
 
 
 def main():
@@ -126,6 +283,12 @@ def main():
 
     parser = argparse.ArgumentParser(description="Run the Discord Cluster Bot")
     parser.add_argument("--debug", action="store_true", help="Run in debug/staging mode")
+    parser.add_argument(
+        "--role",
+        choices=ROLES,
+        default="all",
+        help="Answer interactions (gateway), run jobs (worker) or both (all)",
+    )
     args = parser.parse_args()
 
     logger.info("Starting bot...")
@@ -134,8 +297,16 @@ def main():
     if args.debug and not token:
         raise ValueError("DISCORD_DEBUG_TOKEN not found")
 
-    client = ClusterBot(debug_mode=args.debug)
-    client.run(token)
+    with startup_phase("create client"):
+        client = ClusterBot(debug_mode=args.debug, role=args.role)
+
+    if args.role == "worker":
+        try:
+            asyncio.run(client.run_worker(token))
+        except KeyboardInterrupt:
+            pass
+    else:
+        client.run(token)
 
 
 if __name__ == "__main__":
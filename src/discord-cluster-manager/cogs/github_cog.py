@@ -1,19 +1,45 @@
 import asyncio
-import os
+import tempfile
+import uuid
 import zipfile
 from datetime import datetime, timedelta, timezone
+from typing import BinaryIO, Callable, Optional
 
 import discord
-import requests
-from consts import GITHUB_REPO, GITHUB_TOKEN, GPUType
+from aiohttp import web
+from consts import (
+    ARTIFACT_MAX_BYTES,
+    ARTIFACT_SPOOL_SIZE,
+    GITHUB_REPO,
+    GITHUB_TOKEN,
+    GITHUB_WEBHOOK_PORT,
+    GITHUB_WEBHOOK_SECRET,
+    LOG_MAX_BYTES,
+    RUN_PROGRESS_INTERVAL,
+    GPUType,
+)
 from discord import app_commands
 from discord.ext import commands
-from github import Github
+from github_client import GitHubClient, GitHubError, WorkflowRun
+from job_queue import Job, PostgresJobQueue
 from leaderboard_eval import cu_eval, py_eval
-from utils import get_github_branch_name, send_discord_message, setup_logging
+from message_scheduler import MessagePriority
+from runner_scheduler import RunnerScheduler
+from status_board import LiveLog
+from utils import (
+    LeaderboardChange,
+    get_github_branch_name,
+    read_head_tail,
+    send_discord_message,
+    setup_logging,
+)
+from workflow_monitor import WorkflowMonitor, webhook_app
 
 logger = setup_logging()
 
+# Seconds to wait before each lookup of a dispatched run, about 20s in total
+RUN_LOOKUP_DELAYS = (1, 1, 2, 2, 4, 4, 6)
+
 
 class GitHubCog(commands.Cog):
     def __init__(self, bot):
@@ -21,6 +47,15 @@ class GitHubCog(commands.Cog):
         self.run_github = bot.run_group.command(
             name="github", description="Run a script using GitHub Actions"
         )(self.run_github)
+        bot.jobs.register("github_run", self.run_github_job)
+        self.github = GitHubClient(GITHUB_TOKEN, GITHUB_REPO)
+        self.monitor = WorkflowMonitor(self.github)
+        # Shared by all GitHub runs of this process, also leaderboard submissions.
+        # Runners are leased in Postgres when other processes may run jobs too.
+        self.scheduler = RunnerScheduler(
+            db=bot.jobs.db if isinstance(bot.jobs, PostgresJobQueue) else None
+        )
+        self.webhook_runner: Optional[web.AppRunner] = None
 
     @app_commands.describe(
         script="The Python script file to run",
@@ -50,59 +85,174 @@ class GitHubCog(commands.Cog):
         message = f"Created thread {thread.mention} for your GitHub job"
 
         await send_discord_message(interaction, message)
-        await thread.send(f"Processing `{script.filename}` with {gpu_type.name}...")
+        self.bot.messages.send(thread, f"Processing `{script.filename}` with {gpu_type.name}...")
 
         try:
             script_content = (await script.read()).decode("utf-8")
-            selected_gpu = GPUType.AMD if gpu_type.value == "amd" else GPUType.NVIDIA
-            filename = "train.py" if script.filename.endswith(".py") else "train.cu"
-
+            reference_content = None
             if reference_script is not None or reference_code is not None:
                 reference_content = (
                     reference_code
                     if reference_code is not None
                     else (await reference_script.read()).decode("utf-8")
                 )
-                eval_code = py_eval if script.filename.endswith(".py") else cu_eval
-
-                run_id = await self.trigger_github_action(
-                    script_content,
-                    filename,
-                    selected_gpu,
-                    reference_content,
-                    eval_code,
-                )
-            else:
-                run_id = await self.trigger_github_action(script_content, filename, selected_gpu)
+        except Exception as e:
+            logger.error(f"Error processing request: {str(e)}", exc_info=True)
+            await self.bot.messages.send(
+                thread, f"Error processing request: {str(e)}", MessagePriority.RESULT
+            )
+            raise
 
-            if run_id:
-                await thread.send(
-                    f"GitHub Action triggered! Run ID: {run_id}\nMonitoring progress..."
-                )
-                status, logs, url = await self.check_workflow_status(run_id, thread)
+        await self.bot.jobs.submit(
+            "github_run",
+            {
+                "thread_id": thread.id,
+                "script_filename": script.filename,
+                "script_content": script_content,
+                "gpu_type": "AMD" if gpu_type.value == "amd" else "NVIDIA",
+                "reference_content": reference_content,
+                "user_id": interaction.user.id,
+            },
+        )
+        return thread
+
+    async def run_github_job(self, payload: dict, job: Job):
+        """
+        Handler of github_run jobs. The run ID is checkpointed once the workflow is
+        triggered, so a retry goes back to monitoring it rather than starting another.
+        """
+        thread = self.bot.get_messageable(payload["thread_id"])
+        try:
+            script_filename = payload["script_filename"]
+            selected_gpu = GPUType[payload["gpu_type"]]
+            filename = "train.py" if script_filename.endswith(".py") else "train.cu"
+
+            run_id = job.state.get("run_id")
 
-                await thread.send(f"Training completed with status: {status}")
+            def post_position(position: int):
+                self.bot.messages.send(
+                    thread,
+                    f"Waiting for a {selected_gpu.name} runner, #{position} in line",
+                    key="queue-position",
+                )
 
-                if len(logs) > 1900:
-                    await self.bot.send_chunked_message(thread, logs, code_block=True)
+            # A resumed run holds a runner already
+            async with self.scheduler.slot(
+                selected_gpu.name,
+                payload.get("user_id", 0),
+                on_position=post_position,
+                wait=run_id is None,
+                job_id=job.id,
+            ):
+                if run_id is None and payload["reference_content"] is not None:
+                    eval_code = py_eval if script_filename.endswith(".py") else cu_eval
+
+                    run_id = await self.trigger_github_action(
+                        payload["script_content"],
+                        filename,
+                        selected_gpu,
+                        payload["reference_content"],
+                        eval_code,
+                    )
+                elif run_id is None:
+                    run_id = await self.trigger_github_action(
+                        payload["script_content"], filename, selected_gpu
+                    )
                 else:
-                    await thread.send(f"```\nLogs:\n{logs}\n```")
+                    self.bot.messages.send(thread, f"Resuming monitoring of run {run_id}...")
+
+                if not run_id:
+                    await self.bot.messages.send(
+                        thread,
+                        "Failed to trigger GitHub Action. Please check the configuration.",
+                        MessagePriority.RESULT,
+                    )
+                    return
+
+                if "run_id" not in job.state:
+                    job.state["run_id"] = run_id
+                    await job.checkpoint()
+                    self.bot.messages.send(
+                        thread, f"GitHub Action triggered! Run ID: {run_id}\nMonitoring progress..."
+                    )
+
+                def post_status(run, elapsed_time: timedelta):
+                    # Replaces the previous update if that one is still queued
+                    self.bot.messages.send(
+                        thread,
+                        f"Workflow: {run['status']} running for "
+                        f"{elapsed_time.total_seconds():.2f} seconds\n"
+                        f"Live view: <{run['html_url']}>",
+                        key="workflow-status",
+                    )
+
+                progress = LiveLog(self.bot.messages, thread, title="Progress")
+                try:
+                    status, logs, url = await self.check_workflow_status(
+                        run_id, post_status, progress.append
+                    )
+                finally:
+                    await progress.close()
+
+            self.bot.messages.send(
+                thread, f"Training completed with status: {status}", MessagePriority.RESULT
+            )
 
-                if url:
-                    await thread.send(f"View the full run at: <{url}>")
+            if len(logs) > 1900:
+                await self.bot.send_chunked_message(thread, logs, code_block=True)
             else:
-                await thread.send(
-                    "Failed to trigger GitHub Action. Please check the configuration."
+                await self.bot.messages.send(
+                    thread, f"```\nLogs:\n{logs}\n```", MessagePriority.RESULT
                 )
 
-            return thread
+            if url:
+                await self.bot.messages.send(
+                    thread, f"View the full run at: <{url}>", MessagePriority.RESULT
+                )
 
         except Exception as e:
             logger.error(f"Error processing request: {str(e)}", exc_info=True)
-            if thread:
-                await thread.send(f"Error processing request: {str(e)}")
+            await self.bot.messages.send(
+                thread, f"Error processing request: {str(e)}", MessagePriority.RESULT
+            )
             raise
 
+    async def cog_load(self):
+        # Every process waits on runs, whichever one receives their webhooks
+        self.bot.leaderboard_db.add_change_listener(self.on_leaderboard_change)
+        # Workers don't serve the webhook, so that a host of several bot processes has
+        # one listening on the port
+        if GITHUB_WEBHOOK_PORT is None or self.bot.role == "worker":
+            return
+        if not GITHUB_WEBHOOK_SECRET:
+            logger.error("GITHUB_WEBHOOK_SECRET is not set, not serving GitHub webhooks")
+            return
+
+        runner = web.AppRunner(
+            webhook_app(self.bot.leaderboard_db.publish_github_event, GITHUB_WEBHOOK_SECRET),
+            access_log=None,
+        )
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, port=GITHUB_WEBHOOK_PORT).start()
+        except OSError as e:
+            # Runs are still polled, failing here would keep the later cogs from loading
+            logger.error(f"Could not serve GitHub webhooks on port {GITHUB_WEBHOOK_PORT}: {e}")
+            await runner.cleanup()
+            return
+        self.webhook_runner = runner
+        logger.info(f"Receiving GitHub webhooks on port {GITHUB_WEBHOOK_PORT}")
+
+    def on_leaderboard_change(self, change: LeaderboardChange):
+        if change["table"] == "github_event":
+            self.monitor.handle_event(change["op"], change["event"])
+
+    async def cog_unload(self):
+        self.monitor.close()
+        if self.webhook_runner is not None:
+            await self.webhook_runner.cleanup()
+        await self.github.close()
+
     async def trigger_github_action(
         self,
         script_content,
@@ -112,130 +262,144 @@ class GitHubCog(commands.Cog):
         eval_content=None,
     ):
         logger.info(f"Attempting to trigger GitHub action for {gpu_type.name} GPU")
-        gh = Github(GITHUB_TOKEN)
-        repo = gh.get_repo(GITHUB_REPO)
 
         try:
-            trigger_time = datetime.now(timezone.utc)
             workflow_file = gpu_type.value
-            workflow = repo.get_workflow(workflow_file)
+            correlation_id = uuid.uuid4().hex
+            branch = get_github_branch_name()
 
             if reference_content is not None:
                 eval_filename = "eval.py" if filename.endswith(".py") else "eval.cu"
                 reference_filename = "reference.py" if filename.endswith(".py") else "reference.cuh"
                 filename = "train.py" if filename.endswith(".py") else "train.cuh"
-                success = workflow.create_dispatch(
-                    get_github_branch_name(),
-                    {
-                        "script_content": script_content,
-                        "filename": filename,
-                        "reference_content": reference_content,
-                        "reference_filename": reference_filename,
-                        "eval_content": eval_content,
-                        "eval_filename": eval_filename,
-                    },
-                )
+                inputs = {
+                    "script_content": script_content,
+                    "filename": filename,
+                    "reference_content": reference_content,
+                    "reference_filename": reference_filename,
+                    "eval_content": eval_content,
+                    "eval_filename": eval_filename,
+                }
             else:
-                success = workflow.create_dispatch(
-                    get_github_branch_name(),
-                    {"script_content": script_content, "filename": filename},
-                )
+                inputs = {"script_content": script_content, "filename": filename}
+            inputs["correlation_id"] = correlation_id
 
-            if success:
-                await asyncio.sleep(2)
-                runs = list(workflow.get_runs())
-
-                for run in runs:
-                    if run.created_at.replace(tzinfo=timezone.utc) > trigger_time:
-                        return run.id
-            return None
+            dispatch_time = datetime.now(timezone.utc)
+            await self.github.dispatch_workflow(workflow_file, branch, inputs)
+            return await self.find_dispatched_run(
+                workflow_file, branch, correlation_id, dispatch_time
+            )
 
         except Exception as e:
             logger.error(f"Error in trigger_github_action: {str(e)}", exc_info=True)
             return None
 
-    async def check_workflow_status(self, run_id, thread):
+    async def find_dispatched_run(
+        self, workflow_file: str, branch: str, correlation_id: str, dispatch_time: datetime
+    ) -> Optional[int]:
+        """
+        ID of the run whose name carries `correlation_id`. Runs show up a few seconds
+        after their dispatch, so the lookup is retried RUN_LOOKUP_DELAYS times, each
+        with one request for the recent dispatches of this branch only.
+        """
+        # Margin for the clock difference with GitHub
+        since = (dispatch_time - timedelta(minutes=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        for delay in RUN_LOOKUP_DELAYS:
+            await asyncio.sleep(delay)
+            runs = await self.github.list_workflow_runs(
+                workflow_file,
+                event="workflow_dispatch",
+                branch=branch,
+                created=f">={since}",
+                per_page=100,
+            )
+            for run in runs:
+                if correlation_id in run["name"]:
+                    return run["id"]
+
+        logger.warning(f"No run of {workflow_file} found for dispatch {correlation_id}")
+        return None
+
+    async def check_workflow_status(
+        self,
+        run_id,
+        on_update: Callable[[WorkflowRun, timedelta], None],
+        on_progress: Optional[Callable[[str], None]] = None,
+    ) -> tuple[str, str, str | None]:
+        """
+        Wait for a workflow run to finish, calling `on_update` with the run and the time
+        elapsed whenever its status changes, and `on_progress` with a line for each of
+        its steps that starts or finishes. Returns the conclusion, the logs and the URL
+        of the run.
+        """
         logger.info(f"Starting to monitor workflow status for run {run_id}")
-        gh = Github(GITHUB_TOKEN)
-        repo = gh.get_repo(GITHUB_REPO)
         start_time = datetime.now(timezone.utc)
         timeout_minutes = 5
         timeout = timedelta(minutes=timeout_minutes)
 
-        while True:
+        def update(run: WorkflowRun):
+            on_update(run, datetime.now(timezone.utc) - start_time)
+
+        steps = None
+        if on_progress is not None and RUN_PROGRESS_INTERVAL > 0:
+            steps = asyncio.create_task(self.monitor.follow_steps(run_id, on_progress))
+        try:
+            run = await self.monitor.wait(run_id, update, timeout.total_seconds())
+        except TimeoutError:
+            html_url = None
             try:
-                run = repo.get_workflow_run(run_id)
-                elapsed_time = datetime.now(timezone.utc) - start_time
-
-                if elapsed_time > timeout:
-                    try:
-                        run.cancel()
-                        # Wait briefly to ensure cancellation is processed
-                        # And Verify the run was actually cancelled
-                        await asyncio.sleep(5)
-                        run = repo.get_workflow_run(run_id)
-                        if run.status != "completed":
-                            logger.warning(f"Failed to cancel workflow run {run_id}")
-                    except Exception as e:
-                        logger.error(f"Error cancelling workflow: {str(e)}")
-
-                    await thread.send(
-                        f"Workflow cancelled - exceeded {timeout_minutes} minute timeout"
-                    )
-                    return (
-                        "cancelled",
-                        f"Workflow exceeded {timeout_minutes} minute timeout",
-                        run.html_url,
-                    )
+                await self.github.cancel_workflow_run(run_id)
+                # Wait briefly to ensure cancellation is processed
+                # And Verify the run was actually cancelled
+                await asyncio.sleep(5)
+                run = await self.github.get_workflow_run(run_id)
+                html_url = run["html_url"]
+                if run["status"] != "completed":
+                    logger.warning(f"Failed to cancel workflow run {run_id}")
+            except Exception as e:
+                logger.error(f"Error cancelling workflow: {str(e)}")
 
-                if run.status == "completed":
-                    logs = await self.download_artifact(run_id)
-                    return run.conclusion, logs, run.html_url
+            return (
+                "cancelled",
+                f"Workflow exceeded {timeout_minutes} minute timeout",
+                html_url,
+            )
+        except Exception as e:
+            return "error", str(e), None
+        finally:
+            if steps is not None:
+                steps.cancel()
 
-                await thread.send(
-                    f"Workflow: {run.status} running for "
-                    f"{elapsed_time.total_seconds():.2f} seconds\n"
-                    f"Live view: <{run.html_url}>"
-                )
-                await asyncio.sleep(60)
-            except Exception as e:
-                return "error", str(e), None
+        logs = await self.download_artifact(run_id)
+        return run["conclusion"], logs, run["html_url"]
 
     async def download_artifact(self, run_id):
         logger.info(f"Attempting to download artifacts for run {run_id}")
-        gh = Github(GITHUB_TOKEN)
-        repo = gh.get_repo(GITHUB_REPO)
 
         try:
-            run = repo.get_workflow_run(run_id)
-            artifacts = run.get_artifacts()
-
-            for artifact in artifacts:
-                if artifact.name == "training-artifacts":
-                    url = artifact.archive_download_url
-                    headers = {"Authorization": f"token {GITHUB_TOKEN}"}
-                    response = requests.get(url, headers=headers)
-
-                    if response.status_code == 200:
-                        with open("training.log.zip", "wb") as f:
-                            f.write(response.content)
-
-                        with zipfile.ZipFile("training.log.zip") as z:
-                            log_file = next(
-                                (f for f in z.namelist() if f.endswith("training.log")),
-                                None,
-                            )
-                            if log_file:
-                                with z.open(log_file) as f:
-                                    logs = f.read().decode("utf-8")
-                            else:
-                                logs = "training.log file not found in artifact"
-
-                        os.remove("training.log.zip")
-                        return logs
-                    else:
-                        return f"Failed to download artifact. Status code: {response.status_code}"
-
-            return "No training artifacts found"
+            artifacts = await self.github.list_artifacts(run_id)
+            artifact = next((a for a in artifacts if a["name"] == "training-artifacts"), None)
+            if artifact is None:
+                return "No training artifacts found"
+
+            # In memory unless it is large, a file of its own otherwise, so that any
+            # number of downloads can run at once
+            with tempfile.SpooledTemporaryFile(max_size=ARTIFACT_SPOOL_SIZE) as archive:
+                try:
+                    await self.github.download_artifact(artifact, archive, ARTIFACT_MAX_BYTES)
+                except GitHubError as e:
+                    return f"Failed to download artifact. Status code: {e.status}"
+                # Decompressing is CPU bound, keep it off the event loop
+                return await asyncio.to_thread(read_training_log, archive)
         except Exception as e:
             return f"Error downloading artifacts: {str(e)}"
+
+
+def read_training_log(archive: BinaryIO) -> str:
+    """training.log of an artifact archive, cut to LOG_MAX_BYTES keeping head and tail"""
+    with zipfile.ZipFile(archive) as z:
+        log_file = next((f for f in z.namelist() if f.endswith("training.log")), None)
+        if log_file is None:
+            return "training.log file not found in artifact"
+        with z.open(log_file) as f:
+            return read_head_tail(f, LOG_MAX_BYTES)
@@ -1,15 +1,23 @@
 import asyncio
+import dataclasses
 import random
 import textwrap
+from collections import defaultdict
 from datetime import datetime
+from typing import Optional, TypedDict
 
 import discord
-from consts import GitHubGPU, ModalGPU
+from consts import GitHubGPU, GPUType, ModalGPU
 from discord import Interaction, SelectOption, app_commands, ui
 from discord.ext import commands
+from job_queue import Job
 from leaderboard_db import leaderboard_name_autocomplete
+from leaderboard_eval import cu_eval, py_eval
+from runner_scheduler import parse_deadline
+from status_board import GPUStatus, LiveLog, StatusBoard
 from utils import (
-    display_lb_submissions,
+    LeaderboardChange,
+    LRUCache,
     extract_score,
     send_discord_message,
     setup_logging,
@@ -17,65 +25,123 @@ from utils import (
 
 logger = setup_logging()
 
+# Rows per /leaderboard show page, well under Discord's 25 fields per embed
+LEADERBOARD_PAGE_SIZE = 10
+
+
+class LeaderboardPage(TypedDict):
+    embed: discord.Embed
+    first: tuple[float, int]  # (submission_score, submission_id) keyset cursors
+    last: tuple[float, int]
+    first_rank: int
+    last_rank: int
+    has_prev: bool
+    has_next: bool
+
 
 async def async_submit_github_job(
-    interaction: discord.Interaction,
-    leaderboard_name: str,
-    script: discord.Attachment,
-    github_command,
-    reference_code,
     bot,
-    submission_content,
     github_cog: commands.Cog,
+    board: StatusBoard,
+    thread: discord.abc.Messageable,
+    job: Job,
     gpu: str,
 ):
+    """Run a submission on one GPU, reporting on its row of the status board"""
     try:
-        github_thread = await github_command.callback(
-            github_cog,
-            interaction,
-            script,
-            app_commands.Choice(
-                name=gpu,
-                value=GitHubGPU[gpu].value,
-            ),
-            reference_code=reference_code,
-        )
-    except discord.errors.NotFound as e:
-        print(f"Webhook not found: {e}")
-        await send_discord_message(interaction, "❌ The webhook was not found.")
+        await _run_github_job(bot, github_cog, board, thread, job, gpu)
+    except Exception as e:
+        logger.error(f"Error running submission on {gpu}: {e}", exc_info=True)
+        board.update(gpu, status="error")
+    await _checkpoint_gpu(board, job, gpu)
 
-    message_contents = [msg.content async for msg in github_thread.history(limit=None)]
 
-    # Compute eval or submission score, call runner here.
-    # TODO: Make this more robust later
-    score = extract_score("".join(message_contents))
-
-    with bot.leaderboard_db as db:
-        db.create_submission(
-            {
-                "submission_name": script.filename,
-                "submission_time": datetime.now(),
-                "leaderboard_name": leaderboard_name,
-                "code": submission_content,
-                "user_id": interaction.user.id,
-                "submission_score": score,
-                "gpu_type": gpu,
-            }
-        )
+async def _checkpoint_gpu(board: StatusBoard, job: Job, gpu: str):
+    """Save the board row of a GPU, a retried job skips the GPUs that are done"""
+    row = dataclasses.asdict(board.rows[gpu])
+    del row["gpu"]
+    job.state.setdefault("rows", {})[gpu] = row
+    await job.checkpoint()
 
-    user_id = (
-        interaction.user.global_name if interaction.user.nick is None else interaction.user.nick
-    )
 
-    await send_discord_message(
-        interaction,
-        f"Successfully ran on {gpu} using GitHub runners!\n"
-        + f"Leaderboard '{leaderboard_name}'.\n"
-        + f"Submission title: {script.filename}.\n"
-        + f"Submission user: {user_id}.\n"
-        + f"Runtime: {score:.9f} seconds.",
-        ephemeral=True,
+async def _run_github_job(
+    bot,
+    github_cog: commands.Cog,
+    board: StatusBoard,
+    thread: discord.abc.Messageable,
+    job: Job,
+    gpu: str,
+):
+    payload = job.payload
+    submission_name = payload["submission_name"]
+    filename = "train.py" if submission_name.endswith(".py") else "train.cu"
+    eval_code = py_eval if submission_name.endswith(".py") else cu_eval
+
+    run_id = job.state.get("run_ids", {}).get(gpu)
+    # A resumed run holds a runner already
+    async with github_cog.scheduler.slot(
+        gpu,
+        payload["user_id"],
+        parse_deadline(payload.get("deadline")),
+        on_position=lambda position: board.update(gpu, position=position),
+        wait=run_id is None,
+        job_id=job.id,
+    ):
+        board.update(gpu, position=None)
+        if run_id is None:
+            run_id = await github_cog.trigger_github_action(
+                payload["submission_content"],
+                filename,
+                GPUType[gpu],
+                payload["reference_code"],
+                eval_code,
+            )
+            if not run_id:
+                board.update(gpu, status="error")
+                return
+            # A retry monitors this run instead of triggering another
+            job.state.setdefault("run_ids", {})[gpu] = run_id
+            await job.checkpoint()
+
+        def on_update(run, elapsed_time):
+            board.update(
+                gpu,
+                status="running" if run["status"] == "in_progress" else "queued",
+                url=run["html_url"],
+            )
+
+        progress = LiveLog(bot.messages, thread, title=f"{gpu} progress")
+        try:
+            status, logs, url = await github_cog.check_workflow_status(
+                run_id, on_update, progress.append
+            )
+        finally:
+            await progress.close()
+
+    # Compute eval or submission score, call runner here.
+    # TODO: Make this more robust later
+    score = extract_score(logs)
+    board.update(gpu, status=status, score=score, url=url)
+
+    await bot.send_chunked_message(thread, logs, code_block=True, title=f"{gpu} logs")
+
+    if score is None:
+        return
+
+    await bot.submission_writer.submit(
+        {
+            "submission_name": submission_name,
+            "submission_time": datetime.now(),
+            "leaderboard_name": payload["leaderboard_name"],
+            "code": payload["submission_content"],
+            "user_id": payload["user_id"],
+            "submission_score": score,
+            "gpu_type": gpu,
+        }
     )
+    # The GPU is checkpointed as done and the job finished right after this, so the
+    # score must be stored (or spilled) by then, not just queued
+    await bot.submission_writer.flush()
 
 
 class LeaderboardSubmitCog(app_commands.Group):
@@ -132,18 +198,17 @@ class LeaderboardSubmitCog(app_commands.Group):
             # Compute eval or submission score, call runner here.
             score = random.random()
 
-            with self.bot.leaderboard_db as db:
-                db.create_submission(
-                    {
-                        "submission_name": script.filename,
-                        "submission_time": datetime.now(),
-                        "leaderboard_name": leaderboard_name,
-                        "code": submission_content,
-                        "user_id": interaction.user.id,
-                        "submission_score": score,
-                        "gpu_type": gpu_type.name,
-                    }
-                )
+            await self.bot.submission_writer.submit(
+                {
+                    "submission_name": script.filename,
+                    "submission_time": datetime.now(),
+                    "leaderboard_name": leaderboard_name,
+                    "code": submission_content.decode("utf-8"),
+                    "user_id": interaction.user.id,
+                    "submission_score": score,
+                    "gpu_type": gpu_type.name,
+                }
+            )
 
             await send_discord_message(
                 interaction,
@@ -182,9 +247,9 @@ class LeaderboardSubmitCog(app_commands.Group):
         try:
             # Read and convert reference code
             reference_code = None
-            with self.bot.leaderboard_db as db:
+            async with self.bot.leaderboard_db as db:
                 # TODO: query that gets reference code given leaderboard name
-                leaderboard_item = db.get_leaderboard(leaderboard_name)
+                leaderboard_item = await db.get_leaderboard(leaderboard_name)
                 if not leaderboard_item:
                     await send_discord_message(
                         interaction,
@@ -193,7 +258,7 @@ class LeaderboardSubmitCog(app_commands.Group):
                     )
                     return
                 reference_code = leaderboard_item["reference_code"]
-                gpus = db.get_leaderboard_gpu_types(leaderboard_name)
+                gpus = leaderboard_item["gpu_types"]
 
             if not interaction.response.is_done():
                 await interaction.response.defer()
@@ -216,23 +281,28 @@ class LeaderboardSubmitCog(app_commands.Group):
 
             await view.wait()
 
-            github_command = github_cog.run_github
-
-            tasks = [
-                async_submit_github_job(
-                    interaction,
-                    leaderboard_name,
-                    script,
-                    github_command,
-                    reference_code,
-                    self.bot,
-                    reference_code,
-                    github_cog,
-                    gpu,
-                )
-                for gpu in view.selected_gpus
-            ]
-            await asyncio.gather(*tasks)
+            # One thread and one status message for the whole submission, however many
+            # GPUs it runs on
+            thread = await self.bot.create_thread(
+                interaction, ", ".join(view.selected_gpus), "Leaderboard Submission"
+            )
+            await send_discord_message(
+                interaction, f"Created thread {thread.mention} for your submission"
+            )
+            await self.bot.jobs.submit(
+                "leaderboard_submission",
+                {
+                    "thread_id": thread.id,
+                    "leaderboard_name": leaderboard_name,
+                    "submission_name": script.filename,
+                    "submission_content": submission_content,
+                    "reference_code": reference_code,
+                    "gpus": view.selected_gpus,
+                    "deadline": leaderboard_item["deadline"].isoformat(),
+                    "user_id": interaction.user.id,
+                    "user_mention": interaction.user.mention,
+                },
+            )
 
         except ValueError:
             await send_discord_message(
@@ -276,6 +346,116 @@ class GPUSelectionView(ui.View):
         self.stop()
 
 
+class LeaderboardPageView(ui.View):
+    """
+    Navigation over the ranking of a leaderboard on one GPU. Pages are fetched on
+    demand with keyset cursors, so only the page on screen is held in memory.
+
+    Ranks are counted from the page the view started at, or from the user's row
+    after "jump to me". Pages stay consistent with their cursors, but submissions
+    made while browsing shift the real ranks of later pages, so the numbers shown
+    there can be off by the number of rows that moved ahead since. Jumping or
+    running the command again counts them afresh.
+    """
+
+    def __init__(
+        self,
+        cog: "LeaderboardCog",
+        original_user: discord.User,
+        leaderboard_name: str,
+        gpu: str,
+        page: LeaderboardPage,
+    ):
+        super().__init__(timeout=300)
+        self.cog = cog
+        self.original_user = original_user
+        self.leaderboard_name = leaderboard_name
+        self.gpu = gpu
+        self.page = page
+        self.message: Optional[discord.WebhookMessage] = None
+        self._update_buttons()
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user != self.original_user:
+            await interaction.response.send_message(
+                f"These buttons are only for {self.original_user.name}!", ephemeral=True
+            )
+            return False
+        return True
+
+    async def on_timeout(self):
+        for item in self.children:
+            item.disabled = True
+        if self.message is not None:
+            try:
+                await self.message.edit(view=self)
+            except discord.HTTPException:
+                pass
+
+    def _update_buttons(self):
+        self.prev_page.disabled = not self.page["has_prev"]
+        self.next_page.disabled = not self.page["has_next"]
+
+    async def _show(self, interaction: discord.Interaction, page: LeaderboardPage | None):
+        if page is None:
+            # The rows around the cursor were deleted since this page was rendered
+            await send_discord_message(
+                interaction, "This page is no longer available.", ephemeral=True
+            )
+            return
+        self.page = page
+        self._update_buttons()
+        await interaction.response.edit_message(embed=page["embed"], view=self)
+
+    @ui.button(label="Prev", emoji="◀️", style=discord.ButtonStyle.secondary)
+    async def prev_page(self, interaction: discord.Interaction, button: ui.Button):
+        page = await self.cog.get_submissions_page(
+            interaction.guild,
+            self.leaderboard_name,
+            self.gpu,
+            self.page["first_rank"],
+            before=self.page["first"],
+        )
+        await self._show(interaction, page)
+
+    @ui.button(label="Next", emoji="▶️", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: ui.Button):
+        page = await self.cog.get_submissions_page(
+            interaction.guild,
+            self.leaderboard_name,
+            self.gpu,
+            self.page["last_rank"] + 1,
+            after=self.page["last"],
+        )
+        await self._show(interaction, page)
+
+    @ui.button(label="Jump to me", style=discord.ButtonStyle.primary)
+    async def jump_to_me(self, interaction: discord.Interaction, button: ui.Button):
+        async with self.cog.bot.leaderboard_db as db:
+            user_rank = await db.get_leaderboard_user_rank(
+                self.leaderboard_name, self.gpu, interaction.user.id
+            )
+        if user_rank is None:
+            await send_discord_message(
+                interaction,
+                f"You have no submission on {self.gpu} for this leaderboard.",
+                ephemeral=True,
+            )
+            return
+
+        # Start the page at the user's own row. Ids are integers, so nothing sorts
+        # between (score, id - 1) and (score, id).
+        rank, score, submission_id = user_rank
+        page = await self.cog.get_submissions_page(
+            interaction.guild,
+            self.leaderboard_name,
+            self.gpu,
+            rank,
+            after=(score, submission_id - 1),
+        )
+        await self._show(interaction, page)
+
+
 class DeleteConfirmationModal(ui.Modal, title="Confirm Deletion"):
     def __init__(self, leaderboard_name: str, db):
         super().__init__()
@@ -290,8 +470,8 @@ class DeleteConfirmationModal(ui.Modal, title="Confirm Deletion"):
 
     async def on_submit(self, interaction: discord.Interaction):
         if self.confirmation.value == self.leaderboard_name:
-            with self.db as db:
-                err = db.delete_leaderboard(self.leaderboard_name)
+            async with self.db as db:
+                err = await db.delete_leaderboard(self.leaderboard_name)
                 if err:
                     await send_discord_message(
                         interaction,
@@ -323,24 +503,86 @@ class LeaderboardCog(commands.Cog):
         bot.leaderboard_group.add_command(LeaderboardSubmitCog(bot))
 
         self.get_leaderboard_submissions = bot.leaderboard_group.command(
-            name="show", description="Get all submissions for a leaderboard"
+            name="show", description="Get the best submission of each user for a leaderboard"
         )(self.get_leaderboard_submissions)
 
         self.delete_leaderboard = bot.leaderboard_group.command(
             name="delete", description="Delete a leaderboard"
         )(self.delete_leaderboard)
 
+        # Rendered /leaderboard list and show embeds. Keys include the version of the
+        # data they were rendered from, so a write makes them unreachable at once
+        # and repeated views cost neither a query nor formatting.
+        self.embed_cache = LRUCache(max_size=1024, ttl=600)
+        self._embed_versions: defaultdict[tuple[str, str] | None, int] = defaultdict(int)
+        bot.leaderboard_db.add_change_listener(self.on_leaderboard_change)
+        bot.jobs.register("leaderboard_submission", self.run_submission_job)
+
+    def on_leaderboard_change(self, change: LeaderboardChange):
+        if change["table"] == "submission":
+            self._embed_versions[(change["name"], change["gpu_type"])] += 1
+        elif change["table"] not in ("job", "github_event"):
+            # Leaderboards were created, edited or deleted, or anything may have changed
+            self._embed_versions[None] += 1
+
+    async def run_submission_job(self, payload: dict, job: Job):
+        """
+        Handler of leaderboard_submission jobs. The status board and each GPU's run
+        are checkpointed, so a retry edits the same board and only waits for the GPUs
+        that had not finished.
+        """
+        github_cog = self.bot.get_cog("GitHubCog")
+        if github_cog is None:
+            raise RuntimeError("GitHub runs are not enabled")
+
+        thread = self.bot.get_messageable(payload["thread_id"])
+        board = StatusBoard(
+            self.bot.messages,
+            f"Submission `{payload['submission_name']}` to leaderboard "
+            f"'{payload['leaderboard_name']}' by {payload['user_mention']}",
+            payload["gpus"],
+        )
+        for gpu, row in job.state.get("rows", {}).items():
+            board.rows[gpu] = GPUStatus(gpu, **row)
+
+        if "board_message_id" in job.state:
+            board.attach(thread.get_partial_message(job.state["board_message_id"]))
+        else:
+            await board.post(thread)
+            job.state["board_message_id"] = board.message.id
+            await job.checkpoint()
+
+        tasks = [
+            async_submit_github_job(self.bot, github_cog, board, thread, job, gpu)
+            for gpu, row in board.rows.items()
+            if row.status in ("queued", "running")
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            await board.close()
+
     async def get_leaderboards(self, interaction: discord.Interaction):
         """Display all leaderboards in a table format"""
         await interaction.response.defer()
 
-        with self.bot.leaderboard_db as db:
-            leaderboards = db.get_leaderboards()
+        embed = await self.embed_cache.get_or_load(
+            ("list", self._embed_versions[None]), self._render_leaderboards
+        )
 
-        if not leaderboards:
+        if embed is None:
             await send_discord_message(interaction, "No leaderboards found.", ephemeral=True)
             return
 
+        await interaction.followup.send("", embed=embed)
+
+    async def _render_leaderboards(self) -> discord.Embed | None:
+        async with self.bot.leaderboard_db as db:
+            leaderboards = await db.get_leaderboards()
+
+        if not leaderboards:
+            return None
+
         # Create embed
         embed = discord.Embed(title="Active Leaderboards", color=discord.Color.blue())
         padding = " " * 4
@@ -368,8 +610,118 @@ class LeaderboardCog(commands.Cog):
 
         # Add the formatted text to the embed as a code block
         embed.description = f"```\n{header}{divider}\n" + "\n".join(rows) + "\n```"
+        return embed
 
-        await interaction.followup.send("", embed=embed)
+    async def display_lb_submissions(
+        self, interaction: discord.Interaction, leaderboard_name: str, gpu: str
+    ):
+        """
+        Display the best submission of each user on a leaderboard for a particular GPU to
+        discord, one page at a time. Must be used as a follow-up currently.
+        """
+        page = await self.get_submissions_page(interaction.guild, leaderboard_name, gpu, 1)
+
+        if not interaction.response.is_done():
+            await interaction.response.defer()
+
+        if page is None:
+            await send_discord_message(
+                interaction,
+                f'No submissions found for "{leaderboard_name}".',
+                ephemeral=True,
+            )
+            return
+
+        view = LeaderboardPageView(self, interaction.user, leaderboard_name, gpu, page)
+        view.message = await interaction.followup.send(embed=page["embed"], view=view, wait=True)
+
+    async def get_submissions_page(
+        self,
+        guild: discord.Guild | None,
+        leaderboard_name: str,
+        gpu: str,
+        rank: int,
+        after: Optional[tuple[float, int]] = None,
+        before: Optional[tuple[float, int]] = None,
+    ) -> LeaderboardPage | None:
+        """
+        Return the page of the ranking after or before a cursor, or the first page.
+        `rank` is the rank of the first row of the page, or of the `before` row when
+        paging backwards.
+        """
+        # Names are resolved per guild, so are the rendered embeds
+        key = (
+            "show",
+            self._embed_versions[None],
+            self._embed_versions[(leaderboard_name, gpu)],
+            leaderboard_name,
+            gpu,
+            guild.id if guild else None,
+            rank,
+            after,
+            before,
+        )
+        return await self.embed_cache.get_or_load(
+            key,
+            lambda: self._render_submissions(guild, leaderboard_name, gpu, rank, after, before),
+        )
+
+    async def _render_submissions(
+        self,
+        guild: discord.Guild | None,
+        leaderboard_name: str,
+        gpu: str,
+        rank: int,
+        after: Optional[tuple[float, int]],
+        before: Optional[tuple[float, int]],
+    ) -> LeaderboardPage | None:
+        # One extra row tells whether there is another page in that direction
+        async with self.bot.leaderboard_db as db:
+            submissions = await db.get_leaderboard_best_submissions(
+                leaderboard_name, gpu, LEADERBOARD_PAGE_SIZE + 1, after=after, before=before
+            )
+
+        if not submissions:
+            return None
+
+        if before is not None:
+            has_prev, has_next = len(submissions) > LEADERBOARD_PAGE_SIZE, True
+            submissions = submissions[-LEADERBOARD_PAGE_SIZE:]
+            first_rank = rank - len(submissions)
+        else:
+            has_prev, has_next = rank > 1, len(submissions) > LEADERBOARD_PAGE_SIZE
+            submissions = submissions[:LEADERBOARD_PAGE_SIZE]
+            first_rank = rank
+        last_rank = first_rank + len(submissions) - 1
+
+        # Create embed
+        embed = discord.Embed(
+            title=f'Leaderboard Submissions for "{leaderboard_name}" on {gpu}',
+            color=discord.Color.blue(),
+        )
+        embed.set_footer(text=f"Ranks {first_rank}-{last_rank}")
+
+        user_names = await self.bot.user_names.resolve(
+            (submission.user_id for submission in submissions), guild
+        )
+
+        for position, submission in enumerate(submissions, start=first_rank):
+            user_name = user_names[str(submission.user_id)]
+            embed.add_field(
+                name=f"#{position} {user_name}: {submission.submission_name}",
+                value=f"Submission speed: {submission.submission_score}",
+                inline=False,
+            )
+
+        return LeaderboardPage(
+            embed=embed,
+            first=(submissions[0].submission_score, submissions[0].submission_id),
+            last=(submissions[-1].submission_score, submissions[-1].submission_id),
+            first_rank=first_rank,
+            last_rank=last_rank,
+            has_prev=has_prev,
+            has_next=has_next,
+        )
 
     @discord.app_commands.describe(
         leaderboard_name="Name of the leaderboard",
@@ -414,8 +766,8 @@ class LeaderboardCog(commands.Cog):
             # Read the template file
             template_content = await reference_code.read()
 
-            with self.bot.leaderboard_db as db:
-                err = db.create_leaderboard(
+            async with self.bot.leaderboard_db as db:
+                err = await db.create_leaderboard(
                     {
                         "name": leaderboard_name,
                         "deadline": date_value,
@@ -466,11 +818,9 @@ class LeaderboardCog(commands.Cog):
         leaderboard_name: str,
     ):
         try:
-            submissions = {}
-            with self.bot.leaderboard_db as db:
-                # TODO: query that gets leaderboard id given leaderboard name
-                leaderboard_id = db.get_leaderboard(leaderboard_name)["id"]
-                if not leaderboard_id:
+            async with self.bot.leaderboard_db as db:
+                leaderboard_item = await db.get_leaderboard(leaderboard_name)
+                if not leaderboard_item:
                     await send_discord_message(
                         interaction,
                         f'Leaderboard "{leaderboard_name}" not found.',
@@ -478,9 +828,7 @@ class LeaderboardCog(commands.Cog):
                     )
                     return
 
-                gpus = db.get_leaderboard_gpu_types(leaderboard_name)
-                for gpu in gpus:
-                    submissions[gpu] = db.get_leaderboard_submissions(leaderboard_name, gpu)
+                gpus = leaderboard_item["gpu_types"]
 
             if not interaction.response.is_done():
                 await interaction.response.defer()
@@ -497,7 +845,7 @@ class LeaderboardCog(commands.Cog):
             await view.wait()
 
             for gpu in view.selected_gpus:
-                await display_lb_submissions(interaction, self.bot, leaderboard_name, gpu)
+                await self.display_lb_submissions(interaction, leaderboard_name, gpu)
 
         except Exception as e:
             logger.error(str(e))
@@ -15,7 +15,14 @@ class BotManagerCog(commands.Cog):
     @app_commands.command(name="ping")
     async def ping(self, interaction: discord.Interaction):
         """Simple ping command to check if the bot is responsive"""
-        await send_discord_message(interaction, "pong")
+        stats = self.bot.messages.stats
+        await send_discord_message(
+            interaction,
+            f"pong\nOutbound messages: {stats['depth']} queued in {stats['channels']} "
+            f"channels (at most {stats['max_depth']} in one), {stats['sent']} sent, "
+            f"{stats['coalesced']} merged, {stats['replaced']} replaced, "
+            f"{stats['throttled']} rate limit waits",
+        )
 
     @app_commands.command(name="resync")
     async def resync(self, interaction: discord.Interaction):
@@ -27,6 +34,9 @@ class BotManagerCog(commands.Cog):
                 self.bot.tree.clear_commands(guild=interaction.guild)
                 await self.bot.tree.sync(guild=interaction.guild)
                 commands = await self.bot.tree.fetch_commands(guild=interaction.guild)
+                # Whatever was synced at startup is gone, make the next startup sync again
+                async with self.bot.leaderboard_db as db:
+                    await db.set_command_tree_hash(str(interaction.guild.id), None)
                 send_discord_message(
                     interaction,
                     "Resynced commands:\n" + "\n".join([f"- /{cmd.name}" for cmd in commands]),
@@ -1,9 +1,11 @@
+import asyncio
 import time
 
 import discord
-import modal
 from discord import app_commands
 from discord.ext import commands
+from job_queue import Job
+from message_scheduler import MessagePriority
 from utils import send_discord_message, setup_logging
 
 logger = setup_logging()
@@ -16,6 +18,7 @@ class ModalCog(commands.Cog):
         self.run_modal = bot.run_group.command(
             name="modal", description="Run a script using Modal"
         )(self.run_modal)
+        bot.jobs.register("modal_run", self.run_modal_job)
 
     @app_commands.describe(
         script="The Python script file to run", gpu_type="Choose the GPU type for Modal"
@@ -31,54 +34,81 @@ class ModalCog(commands.Cog):
         script: discord.Attachment,
         gpu_type: app_commands.Choice[str],
     ) -> discord.Thread:
-        thread = None
+        if not script.filename.endswith(".py") and not script.filename.endswith(".cu"):
+            await send_discord_message(
+                interaction, "Please provide a Python (.py) or CUDA (.cu) file"
+            )
+            return None
+
+        thread = await self.bot.create_thread(interaction, gpu_type.name, "Modal Job")
+        message = f"Created thread {thread.mention} for your Modal job"
+
+        await send_discord_message(interaction, message)
+
+        self.bot.messages.send(
+            thread, f"**Processing `{script.filename}` with {gpu_type.name}...**"
+        )
+
+        await self.bot.jobs.submit(
+            "modal_run",
+            {
+                "thread_id": thread.id,
+                "script_filename": script.filename,
+                "script_content": (await script.read()).decode("utf-8"),
+                # Wall clock, the job may run in another process
+                "queued_at": time.time(),
+            },
+        )
+        return thread
+
+    async def run_modal_job(self, payload: dict, job: Job):
+        """Handler of modal_run jobs"""
+        thread = self.bot.get_messageable(payload["thread_id"])
+        status_msg = None
         try:
-            if not script.filename.endswith(".py") and not script.filename.endswith(".cu"):
-                await send_discord_message("Please provide a Python (.py) or CUDA (.cu) file")
-                return None
-
-            thread = await self.bot.create_thread(interaction, gpu_type.name, "Modal Job")
-            queue_start_time = time.perf_counter()
-            message = f"Created thread {thread.mention} for your Modal job"
-
-            await send_discord_message(interaction, message)
-
-            await thread.send(f"**Processing `{script.filename}` with {gpu_type.name}...**")
-
-            script_content = (await script.read()).decode("utf-8")
-            status_msg = await thread.send(
-                "**Running on Modal...**\n> ⏳ Waiting for available GPU..."
+            script_content = payload["script_content"]
+            status_msg = await self.bot.messages.send(
+                thread,
+                "**Running on Modal...**\n> ⏳ Waiting for available GPU...",
+                coalesce=False,
             )
 
             result, execution_time_ms = await self.trigger_modal_run(
-                script_content, script.filename
+                script_content, payload["script_filename"]
             )
 
             # Update status message to show completion
             await status_msg.edit(content="**Running on Modal...**\n> ✅ Job completed!")
 
-            queue_end_time = time.perf_counter()
-            queue_time_ms = (queue_end_time - queue_start_time) * 1000
-
-            # Send metrics and results
-            await thread.send(f"\n**Script size:** {len(script_content)} bytes")
-            await thread.send(f"**Queue time:** {queue_time_ms:.3f} ms")
-            await thread.send(f"**Execution time:** {execution_time_ms:.3f} ms\n")
-            await thread.send(f"**Modal execution result:**\n```\n{result}\n```")
-
-            return thread
+            queue_time_ms = (time.time() - payload["queued_at"]) * 1000
+
+            # Send metrics and results, queued together so they go out as one message
+            # when they fit
+            await asyncio.gather(
+                *(
+                    self.bot.messages.send(thread, content, MessagePriority.RESULT)
+                    for content in (
+                        f"\n**Script size:** {len(script_content)} bytes",
+                        f"**Queue time:** {queue_time_ms:.3f} ms",
+                        f"**Execution time:** {execution_time_ms:.3f} ms\n",
+                        f"**Modal execution result:**\n```\n{result}\n```",
+                    )
+                )
+            )
 
         except Exception as e:
             logger.error(f"Error processing request: {str(e)}", exc_info=True)
-            if thread:
+            if status_msg:
                 # Update status message to show error
                 await status_msg.edit(content="**Running on Modal...**\n> ❌ Job failed!")
-                await thread.send(f"**Error:** {str(e)}")
+            await self.bot.messages.send(thread, f"**Error:** {str(e)}", MessagePriority.RESULT)
             raise
 
     async def trigger_modal_run(self, script_content: str, filename: str) -> tuple[str, float]:
         logger.info("Attempting to trigger Modal run")
 
+        # Imported on first use, modal is slow to import and only needed here
+        import modal
         from modal_runner import modal_app
 
         try:
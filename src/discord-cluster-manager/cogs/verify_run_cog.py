@@ -1,19 +1,23 @@
 import asyncio
 import re
-from unittest.mock import AsyncMock
+from typing import TYPE_CHECKING
 
 import discord
-from cogs.github_cog import GitHubCog
-from cogs.modal_cog import ModalCog
 from discord import app_commands
 from discord.ext import commands
 from utils import send_discord_message, setup_logging
 
+if TYPE_CHECKING:
+    from cogs.github_cog import GitHubCog
+    from cogs.modal_cog import ModalCog
+
 logger = setup_logging()
 
 
 def create_mock_attachment():
     "Create an AsyncMock to simulate discord.Attachment"
+    # unittest.mock is only needed once a verification actually runs
+    from unittest.mock import AsyncMock
 
     mock_attachment = AsyncMock(spec=discord.Attachment)
     mock_attachment.filename = "test_script.py"
@@ -22,9 +26,6 @@ def create_mock_attachment():
     return mock_attachment
 
 
-script_file = create_mock_attachment()
-
-
 class VerifyRunCog(commands.Cog):
     """
     A Discord cog for verifying the success of training runs.
@@ -40,12 +41,14 @@ class VerifyRunCog(commands.Cog):
 
     async def verify_github_run(
         self,
-        github_cog: GitHubCog,
+        github_cog: "GitHubCog",
         choice: app_commands.Choice,
         interaction: discord.Interaction,
     ) -> bool:
         github_command = github_cog.run_github
-        github_thread = await github_command.callback(github_cog, interaction, script_file, choice)
+        github_thread = await github_command.callback(
+            github_cog, interaction, create_mock_attachment(), choice
+        )
 
         message_contents = [msg.content async for msg in github_thread.history(limit=None)]
 
@@ -82,11 +85,15 @@ class VerifyRunCog(commands.Cog):
             )
             return False
 
-    async def verify_modal_run(self, modal_cog: ModalCog, interaction: discord.Interaction) -> bool:
+    async def verify_modal_run(
+        self, modal_cog: "ModalCog", interaction: discord.Interaction
+    ) -> bool:
         t4 = app_commands.Choice(name="NVIDIA T4", value="t4")
         modal_command = modal_cog.run_modal
 
-        modal_thread = await modal_command.callback(modal_cog, interaction, script_file, t4)
+        modal_thread = await modal_command.callback(
+            modal_cog, interaction, create_mock_attachment(), t4
+        )
 
         message_contents = [msg.content async for msg in modal_thread.history(limit=None)]
 
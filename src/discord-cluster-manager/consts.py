@@ -1,4 +1,5 @@
 import os
+from datetime import timedelta
 from enum import Enum
 
 from dotenv import load_dotenv
@@ -37,7 +38,9 @@ class ModalGPU(Enum):
     H100 = "H100"
 
 
-init_environment()
+# Read .env before the constants below, validation waits for init_environment()
+load_dotenv()
+
 # Discord-specific constants
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 DISCORD_DEBUG_TOKEN = os.getenv("DISCORD_DEBUG_TOKEN")
@@ -47,6 +50,27 @@ DISCORD_DEBUG_CLUSTER_STAGING_ID = os.getenv("DISCORD_DEBUG_CLUSTER_STAGING_ID")
 # GitHub-specific constants
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
 GITHUB_REPO = os.getenv("GITHUB_REPO")
+# Points the bot at another API server, e.g. scripts/fake_github.py
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+# Webhook endpoint for workflow_run/workflow_job events, served on this port if set
+GITHUB_WEBHOOK_PORT = (
+    int(os.getenv("GITHUB_WEBHOOK_PORT")) if os.getenv("GITHUB_WEBHOOK_PORT") else None
+)
+GITHUB_WEBHOOK_SECRET = os.getenv("GITHUB_WEBHOOK_SECRET")
+# Bounds of the interval at which runs are polled, as a fallback for webhooks
+WORKFLOW_POLL_MIN_INTERVAL = float(os.getenv("WORKFLOW_POLL_MIN_INTERVAL", "5"))
+WORKFLOW_POLL_MAX_INTERVAL = float(os.getenv("WORKFLOW_POLL_MAX_INTERVAL", "60"))
+# Seconds between checks of the steps of a running job, 0 to not show its progress
+RUN_PROGRESS_INTERVAL = float(os.getenv("RUN_PROGRESS_INTERVAL", "3"))
+# Runs dispatched at once per GPU type, e.g. "NVIDIA:4,AMD:2", more wait in the bot
+GPU_RUNNER_CAPACITY = {
+    gpu.strip(): int(capacity)
+    for gpu, capacity in (
+        entry.split(":") for entry in os.getenv("GPU_RUNNER_CAPACITY", "NVIDIA:4,AMD:2").split(",")
+    )
+}
+# Runs for leaderboards ending within this many hours go first
+DEADLINE_PRIORITY_WINDOW = timedelta(hours=float(os.getenv("DEADLINE_PRIORITY_HOURS", "24")))
 
 # PostgreSQL-specific constants
 POSTGRES_HOST = os.getenv("POSTGRES_HOST")
@@ -55,3 +79,55 @@ POSTGRES_USER = os.getenv("POSTGRES_USER")
 POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD")
 POSTGRES_PORT = os.getenv("POSTGRES_PORT")
 DATABASE_URL = os.getenv("DATABASE_URL")
+
+# Connection pool settings for LeaderboardDB
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "10000"))
+DB_HEALTH_CHECK_INTERVAL = float(os.getenv("DB_HEALTH_CHECK_INTERVAL", "30"))
+
+# Write-behind submission ingestion
+SUBMISSION_QUEUE_SIZE = int(os.getenv("SUBMISSION_QUEUE_SIZE", "1000"))
+SUBMISSION_BATCH_SIZE = int(os.getenv("SUBMISSION_BATCH_SIZE", "100"))
+SUBMISSION_RETRIES = int(os.getenv("SUBMISSION_RETRIES", "3"))
+# Shared by the bot processes of a host, it must be on storage that survives restarts
+SUBMISSION_SPILL_PATH = os.getenv("SUBMISSION_SPILL_PATH", "submission_spill.jsonl")
+
+# Logs longer than this many characters are sent as a file with a preview, rather
+# than split over messages. Files above the compression threshold (bytes) are gzipped.
+LOG_ATTACHMENT_THRESHOLD = int(os.getenv("LOG_ATTACHMENT_THRESHOLD", "6000"))
+LOG_COMPRESSION_THRESHOLD = int(os.getenv("LOG_COMPRESSION_THRESHOLD", str(4 * 2**20)))
+
+# Artifacts are downloaded in memory up to ARTIFACT_SPOOL_SIZE bytes and to a temporary
+# file beyond, up to ARTIFACT_MAX_BYTES. Of longer logs, the first and last
+# LOG_MAX_BYTES / 2 bytes are kept.
+ARTIFACT_SPOOL_SIZE = int(os.getenv("ARTIFACT_SPOOL_SIZE", str(8 * 2**20)))
+ARTIFACT_MAX_BYTES = int(os.getenv("ARTIFACT_MAX_BYTES", str(512 * 2**20)))
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(4 * 2**20)))
+
+# Schedulers whose cogs and backend libraries are loaded, e.g. "github" for a bot
+# without Modal
+ENABLED_SCHEDULERS = {
+    SchedulerType(name.strip())
+    for name in os.getenv("ENABLED_SCHEDULERS", "github,modal").split(",")
+    if name.strip()
+}
+
+# Sharding of the gateway connection. Without a shard count, Discord's recommended
+# one is used. DISCORD_SHARD_IDS picks the shards of this process, e.g. "0,1", to
+# spread them over several gateway processes.
+DISCORD_SHARD_COUNT = (
+    int(os.getenv("DISCORD_SHARD_COUNT")) if os.getenv("DISCORD_SHARD_COUNT") else None
+)
+DISCORD_SHARD_IDS = (
+    [int(shard) for shard in os.getenv("DISCORD_SHARD_IDS").split(",")]
+    if os.getenv("DISCORD_SHARD_IDS")
+    else None
+)
+
+# Job queue shared by gateway and worker processes (bot.py --role)
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "10"))
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "30"))
+# Seconds without heartbeat after which a running job is taken over by another worker
+JOB_STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
@@ -0,0 +1,226 @@
+from typing import Any, BinaryIO, Optional, TypedDict
+
+import aiohttp
+from consts import GITHUB_API_URL
+from utils import LRUCache
+
+
+class GitHubError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"GitHub API error {status}: {message}")
+        self.status = status
+
+
+class WorkflowRun(TypedDict):
+    id: int
+    name: str
+    status: str  # queued, in_progress, completed, ...
+    conclusion: Optional[str]
+    html_url: str
+    created_at: str
+    event: str
+    head_branch: str
+
+
+class WorkflowStep(TypedDict):
+    number: int
+    name: str
+    status: str  # queued, in_progress, completed
+    conclusion: Optional[str]
+    started_at: Optional[str]
+    completed_at: Optional[str]
+
+
+class WorkflowJob(TypedDict):
+    id: int
+    run_id: int
+    name: str
+    status: str
+    conclusion: Optional[str]
+    html_url: str
+    steps: list[WorkflowStep]
+
+
+class Artifact(TypedDict):
+    id: int
+    name: str
+    size_in_bytes: int
+    archive_download_url: str
+
+
+class GitHubClientStats(TypedDict):
+    requests: int
+    not_modified: int
+    rate_limit_remaining: Optional[int]
+
+
+class GitHubClient:
+    """
+    Asynchronous client for the few GitHub REST endpoints the bot uses.
+
+    One aiohttp session is shared by every call, so connections are kept alive and
+    reused. Lookups that don't change (workflow IDs) are cached, and polled GETs
+    send the ETag of the last response: an unchanged resource is answered with a
+    304, which does not count against the rate limit.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        repo: str,
+        api_url: str = GITHUB_API_URL,
+        max_connections: int = 20,
+        timeout: float = 30.0,
+    ):
+        self.token = token
+        self.repo = repo
+        self.api_url = api_url.rstrip("/")
+        self.max_connections = max_connections
+        self.timeout = timeout
+        # Downloads of large artifacts may take longer than `timeout` as a whole,
+        # they only fail when no data arrives for that long
+        self.blob_timeout = aiohttp.ClientTimeout(
+            total=None, sock_connect=timeout, sock_read=timeout
+        )
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._workflows = LRUCache(max_size=64)
+        # URL -> (ETag, JSON body) of the last 200 response to a conditional GET
+        self._etags = LRUCache(max_size=1024, ttl=3600)
+
+        self.requests = 0
+        self.not_modified = 0
+        self.rate_limit_remaining: Optional[int] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # Created on first use, a session must be created inside the event loop
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={
+                    "Authorization": f"Bearer {self.token}",
+                    "Accept": "application/vnd.github+json",
+                    "X-GitHub-Api-Version": "2022-11-28",
+                },
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @property
+    def stats(self) -> GitHubClientStats:
+        return GitHubClientStats(
+            requests=self.requests,
+            not_modified=self.not_modified,
+            rate_limit_remaining=self.rate_limit_remaining,
+        )
+
+    def _url(self, path: str) -> str:
+        return f"{self.api_url}/repos/{self.repo}/{path}"
+
+    async def _request(self, method: str, path: str, **kwargs) -> Any:
+        """Send a request, returns the decoded JSON body or None if there is none"""
+        async with self.session.request(method, self._url(path), **kwargs) as response:
+            self._record(response)
+            if response.status >= 400:
+                raise GitHubError(response.status, await response.text())
+            if response.status == 204 or response.content_length == 0:
+                return None
+            return await response.json()
+
+    async def _get_conditional(self, path: str, params: Optional[dict] = None) -> Any:
+        """GET with If-None-Match, answered from the last response if it is unchanged"""
+        url = self._url(path)
+        key = (url, tuple(sorted((params or {}).items())))
+        cached = self._etags.get(key)
+        headers = {"If-None-Match": cached[0]} if cached else {}
+
+        async with self.session.get(url, params=params, headers=headers) as response:
+            self._record(response)
+            if response.status == 304 and cached:
+                self.not_modified += 1
+                return cached[1]
+            if response.status >= 400:
+                raise GitHubError(response.status, await response.text())
+            body = await response.json()
+            if "ETag" in response.headers:
+                self._etags.set(key, (response.headers["ETag"], body))
+            return body
+
+    def _record(self, response: aiohttp.ClientResponse):
+        self.requests += 1
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        if remaining is not None:
+            self.rate_limit_remaining = int(remaining)
+
+    async def get_workflow_id(self, workflow_file: str) -> int:
+        async def load():
+            workflow = await self._request("GET", f"actions/workflows/{workflow_file}")
+            return workflow["id"]
+
+        return await self._workflows.get_or_load(workflow_file, load)
+
+    async def dispatch_workflow(self, workflow_file: str, ref: str, inputs: dict[str, str]):
+        workflow_id = await self.get_workflow_id(workflow_file)
+        await self._request(
+            "POST",
+            f"actions/workflows/{workflow_id}/dispatches",
+            json={"ref": ref, "inputs": inputs},
+        )
+
+    async def list_workflow_runs(self, workflow_file: str, **filters) -> list[WorkflowRun]:
+        """Runs of a workflow, newest first. `filters` are query parameters of the
+        endpoint, e.g. event, branch, created or per_page."""
+        workflow_id = await self.get_workflow_id(workflow_file)
+        body = await self._get_conditional(f"actions/workflows/{workflow_id}/runs", filters)
+        return body["workflow_runs"]
+
+    async def list_repository_runs(self, **filters) -> list[WorkflowRun]:
+        """Runs of all workflows of the repository, newest first"""
+        body = await self._get_conditional("actions/runs", filters)
+        return body["workflow_runs"]
+
+    async def get_workflow_run(self, run_id: int) -> WorkflowRun:
+        return await self._get_conditional(f"actions/runs/{run_id}")
+
+    async def cancel_workflow_run(self, run_id: int):
+        await self._request("POST", f"actions/runs/{run_id}/cancel")
+
+    async def list_run_jobs(self, run_id: int) -> list[WorkflowJob]:
+        """The jobs of a run with the status of their steps, which GitHub updates live
+        unlike job logs, only served once a job is completed"""
+        body = await self._get_conditional(f"actions/runs/{run_id}/jobs")
+        return body["jobs"]
+
+    async def list_artifacts(self, run_id: int) -> list[Artifact]:
+        body = await self._request("GET", f"actions/runs/{run_id}/artifacts")
+        return body["artifacts"]
+
+    async def download_artifact(
+        self, artifact: Artifact, destination: BinaryIO, max_bytes: Optional[int] = None
+    ):
+        """
+        Stream the zip archive of an artifact into `destination`, raises ValueError
+        if it is larger than `max_bytes`.
+        """
+        if max_bytes is not None and artifact["size_in_bytes"] > max_bytes:
+            raise ValueError(f"Artifact of {artifact['size_in_bytes']} bytes is too large")
+
+        # GitHub redirects to blob storage, aiohttp drops the token on that redirect
+        async with self.session.get(
+            artifact["archive_download_url"], timeout=self.blob_timeout
+        ) as response:
+            self._record(response)
+            if response.status >= 400:
+                raise GitHubError(response.status, await response.text())
+            size = 0
+            async for chunk in response.content.iter_chunked(2**16):
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise ValueError(f"Artifact is larger than {max_bytes} bytes")
+                destination.write(chunk)
@@ -0,0 +1,194 @@
+import asyncio
+import os
+import socket
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Optional
+
+from consts import (
+    JOB_HEARTBEAT_INTERVAL,
+    JOB_MAX_ATTEMPTS,
+    JOB_STALE_AFTER,
+    JOB_WORKER_CONCURRENCY,
+)
+from leaderboard_db import LeaderboardDB
+from utils import LeaderboardChange, setup_logging
+
+logger = setup_logging()
+
+
+@dataclass
+class Job:
+    """
+    A unit of work handed to a job handler. `state` is the job's own progress, kept
+    by checkpoint() so that a retry after a crash can carry on instead of starting over.
+    """
+
+    id: Optional[int]
+    kind: str
+    payload: dict
+    state: dict
+    attempts: int
+    queue: "LocalJobQueue"
+    _lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+    async def checkpoint(self):
+        # Serialized so that an older snapshot never overwrites a newer one
+        async with self._lock:
+            await self.queue.checkpoint(self)
+
+
+JobHandler = Callable[[dict, Job], Awaitable[Any]]
+
+
+class LocalJobQueue:
+    """
+    Runs jobs in the submitting task, for a bot that is gateway and worker at once.
+    submit() returns once the job is done and raises what the handler raised.
+    """
+
+    def __init__(self):
+        self._handlers: dict[str, JobHandler] = {}
+
+    def register(self, kind: str, handler: JobHandler):
+        """Run `handler(payload, job)` for jobs of this kind"""
+        self._handlers[kind] = handler
+
+    async def submit(self, kind: str, payload: dict) -> Optional[int]:
+        job = Job(id=None, kind=kind, payload=payload, state={}, attempts=1, queue=self)
+        await self._handlers[kind](payload, job)
+        return None
+
+    async def checkpoint(self, job: Job):
+        pass
+
+
+class PostgresJobQueue(LocalJobQueue):
+    """
+    Jobs in the leaderboard.job table, so that the gateway process only answers
+    interactions and any number of worker processes run what they submit.
+
+    Workers claim jobs with FOR UPDATE SKIP LOCKED, wake up on the insert
+    notification and poll as a fallback. A running job is kept alive by heartbeats;
+    once they stop, e.g. because its worker was restarted, another worker takes it
+    over with its last checkpointed state, up to `max_attempts` times. A worker
+    that finds a job taken over that way cancels its own run of it.
+    """
+
+    def __init__(
+        self,
+        db: LeaderboardDB,
+        concurrency: int = JOB_WORKER_CONCURRENCY,
+        heartbeat_interval: float = JOB_HEARTBEAT_INTERVAL,
+        stale_after: float = JOB_STALE_AFTER,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+    ):
+        super().__init__()
+        self.db = db
+        self.concurrency = concurrency
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        self.worker = f"{socket.gethostname()}-{os.getpid()}"
+
+        self._running: dict[int, asyncio.Task] = {}
+        self._wakeup = asyncio.Event()
+
+    async def submit(self, kind: str, payload: dict) -> Optional[int]:
+        if kind not in self._handlers:
+            raise ValueError(f"No handler for {kind} jobs")
+        async with self.db as db:
+            return await db.enqueue_job(kind, payload)
+
+    async def checkpoint(self, job: Job):
+        async with self.db as db:
+            held = await db.checkpoint_job(job.id, self.worker, job.state)
+        if not held:
+            self._lost(job.id)
+
+    def _lost(self, job_id: int):
+        """
+        Stop a job another worker took over, e.g. after our heartbeats were late, so
+        that only one of them runs it and records its result
+        """
+        task = self._running.get(job_id)
+        if task is not None:
+            logger.warning(f"Lost job {job_id} to another worker, cancelling it")
+            task.cancel()
+
+    def _on_change(self, change: LeaderboardChange):
+        if change["table"] in ("job", None):
+            self._wakeup.set()
+
+    async def run_worker(self):
+        """Claim and run jobs until cancelled"""
+        logger.info(f"Job worker {self.worker} started, {self.concurrency} slots")
+        self.db.add_change_listener(self._on_change)
+        slots = asyncio.Semaphore(self.concurrency)
+        heartbeat_task = asyncio.create_task(self._heartbeat())
+        try:
+            while True:
+                await slots.acquire()
+                # Cleared before claiming, so an insert during the claim still wakes us
+                self._wakeup.clear()
+                try:
+                    async with self.db as db:
+                        item = await db.claim_job(self.worker, self.stale_after, self.max_attempts)
+                except Exception as e:
+                    logger.warning(f"Could not claim a job: {e}")
+                    item = None
+
+                if item is None:
+                    slots.release()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), self.heartbeat_interval)
+                    except TimeoutError:
+                        pass
+                    continue
+
+                job = Job(queue=self, **item)
+                task = asyncio.create_task(self._execute(job))
+                self._running[job.id] = task
+                task.add_done_callback(lambda _: slots.release())
+        finally:
+            heartbeat_task.cancel()
+            # Left unfinished in the table, another worker retries them once stale
+            for task in self._running.values():
+                task.cancel()
+
+    async def _execute(self, job: Job):
+        if job.attempts > 1:
+            logger.info(f"Resuming {job.kind} job {job.id}, attempt {job.attempts}")
+        error = None
+        try:
+            handler = self._handlers.get(job.kind)
+            if handler is None:
+                raise ValueError(f"No handler for {job.kind} jobs")
+            await handler(job.payload, job)
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.kind}) failed: {e}", exc_info=True)
+            error = str(e) or type(e).__name__
+        finally:
+            del self._running[job.id]
+
+        try:
+            async with self.db as db:
+                if not await db.finish_job(job.id, self.worker, error):
+                    logger.warning(f"Job {job.id} was taken over by another worker")
+        except Exception as e:
+            logger.error(f"Could not record the end of job {job.id}: {e}")
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            if not self._running:
+                continue
+            job_ids = list(self._running)
+            try:
+                async with self.db as db:
+                    held = set(await db.heartbeat_jobs(self.worker, job_ids))
+            except Exception as e:
+                logger.warning(f"Could not send job heartbeats: {e}")
+                continue
+            for job_id in job_ids:
+                if job_id not in held:
+                    self._lost(job_id)
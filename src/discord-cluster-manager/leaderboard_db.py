@@ -1,9 +1,18 @@
-from typing import List, Optional
+import asyncio
+import hashlib
+import json
+import time
+from typing import Any, Callable, Optional
 
 import discord
 import psycopg2
+import zstandard
 from consts import (
     DATABASE_URL,
+    DB_HEALTH_CHECK_INTERVAL,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_MIN_SIZE,
+    DB_STATEMENT_TIMEOUT_MS,
     POSTGRES_DATABASE,
     POSTGRES_HOST,
     POSTGRES_PASSWORD,
@@ -11,9 +20,78 @@ from consts import (
     POSTGRES_USER,
 )
 from psycopg2 import Error
-from utils import LeaderboardItem, LRUCache, SubmissionItem
+from psycopg2.extras import Json, execute_values
+from psycopg2.pool import ThreadedConnectionPool
+from utils import (
+    JobItem,
+    LeaderboardChange,
+    LeaderboardItem,
+    NameIndex,
+    SubmissionItem,
+    SubmissionPayloads,
+    SubmissionSummary,
+    setup_logging,
+)
+
+logger = setup_logging()
+
+# Leaderboard names for autocomplete, loaded on first use and then kept up to
+# date from change notifications
+leaderboard_name_index = NameIndex()
+_leaderboard_name_index_lock = asyncio.Lock()
+
+# Channel the database triggers publish LeaderboardChange payloads on
+CHANGES_CHANNEL = "leaderboard_changes"
+# Sent to change listeners when notifications may have been missed, e.g. after
+# reconnecting, so that they drop everything they cached
+RESYNC_CHANGE = LeaderboardChange(table=None, op="RESYNC")
+
+# Payloads checked per transaction when deleting unreferenced blobs, which blocks
+# submissions that add blobs for its duration
+BLOB_GC_BATCH_SIZE = 500
+
+# Leaderboards with their GPU types aggregated into an array, so any number of
+# leaderboards is read in one round trip
+LEADERBOARD_QUERY = """
+    SELECT l.id, l.name, l.deadline, l.reference_code,
+        COALESCE(
+            array_agg(g.gpu_type) FILTER (WHERE g.gpu_type IS NOT NULL), '{{}}'
+        ) AS gpu_types
+    FROM leaderboard.leaderboard l
+    LEFT JOIN leaderboard.gpu_type g ON g.leaderboard_id = l.id
+    {where}
+    GROUP BY l.id
+"""
+
+# Columns of a SubmissionSummary, with leaderboard.submission aliased as s. Listings
+# never select code or outputs, which can be megabytes per submission.
+SUMMARY_COLUMNS = "s.id, s.name, s.user_id, s.submission_time, s.score"
+
+
+def compress_blob(content: str) -> tuple[bytes, int, bytes]:
+    """Return the (hash, size, zstd data) row under which `content` is stored in leaderboard.blob"""
+    data = content.encode("utf-8")
+    # Compressor objects are not thread-safe, and this runs on pool worker threads
+    return hashlib.sha256(data).digest(), len(data), zstandard.ZstdCompressor().compress(data)
 
-leaderboard_name_cache = LRUCache(max_size=512)
+
+def decompress_blob(compression: str, data: bytes) -> str:
+    if compression != "zstd":
+        raise ValueError(f"Unknown blob compression {compression}")
+    return zstandard.ZstdDecompressor().decompress(bytes(data)).decode("utf-8")
+
+
+def update_leaderboard_name_index(change: LeaderboardChange):
+    if change["table"] != "leaderboard" or change["op"] not in ("INSERT", "DELETE"):
+        if change["table"] in (None, "leaderboard"):
+            # A resync, or a rename that can't be applied incrementally
+            leaderboard_name_index.invalidate()
+        return
+
+    if change["op"] == "INSERT":
+        leaderboard_name_index.add(change["name"])
+    else:
+        leaderboard_name_index.remove(change["name"])
 
 
 async def leaderboard_name_autocomplete(
@@ -21,23 +99,44 @@ async def leaderboard_name_autocomplete(
     current: str,
 ) -> list[discord.app_commands.Choice[str]]:
     """Return leaderboard names that match the current typed name"""
-    cached_value = leaderboard_name_cache[current]
-    if cached_value is not None:
-        return cached_value
-
-    bot = interaction.client
-    with bot.leaderboard_db as db:
-        leaderboards = db.get_leaderboards()
-    filtered = [lb["name"] for lb in leaderboards if current.lower() in lb["name"].lower()]
-    leaderboard_name_cache[current] = [
-        discord.app_commands.Choice(name=name, value=name) for name in filtered[:25]
+    if leaderboard_name_index.stale:
+        async with _leaderboard_name_index_lock:
+            if leaderboard_name_index.stale:
+                generation = leaderboard_name_index.generation
+                async with interaction.client.leaderboard_db as db:
+                    names = await db.get_leaderboard_names()
+                # Changes that arrived while loading may be missing from `names`, then
+                # the index stays stale and the next call loads it again
+                if generation == leaderboard_name_index.generation:
+                    leaderboard_name_index.rebuild(names)
+
+    return [
+        discord.app_commands.Choice(name=name, value=name)
+        for name in leaderboard_name_index.search(current)
     ]
-    return leaderboard_name_cache[current]
 
 
 class LeaderboardDB:
-    def __init__(self, host: str, database: str, user: str, password: str, port: str = "5432"):
-        """Initialize database connection parameters"""
+    def __init__(
+        self,
+        host: str,
+        database: str,
+        user: str,
+        password: str,
+        port: str = "5432",
+        min_size: int = DB_POOL_MIN_SIZE,
+        max_size: int = DB_POOL_MAX_SIZE,
+        statement_timeout_ms: int = DB_STATEMENT_TIMEOUT_MS,
+        health_check_interval: float = DB_HEALTH_CHECK_INTERVAL,
+    ):
+        """Initialize database connection parameters
+
+        Connections are kept in a pool of `min_size` to `max_size` connections and
+        every query runs in a worker thread, so a slow query never blocks the event
+        loop. Connections that were idle for longer than `health_check_interval`
+        seconds are pinged before reuse, and every statement is cancelled by the
+        server after `statement_timeout_ms` milliseconds.
+        """
         self.connection_params = {
             "host": host,
             "database": database,
@@ -45,42 +144,188 @@ class LeaderboardDB:
             "password": password,
             "port": port,
         }
-        self.connection: Optional[psycopg2.extensions.connection] = None
-        self.cursor: Optional[psycopg2.extensions.cursor] = None
+        self.min_size = min_size
+        self.max_size = max_size
+        self.statement_timeout_ms = statement_timeout_ms
+        self.health_check_interval = health_check_interval
+
+        self.pool: Optional[ThreadedConnectionPool] = None
+        self._last_used: dict[int, float] = {}
+        # The pool raises instead of waiting when it is exhausted, so callers queue here
+        self._slots = asyncio.Semaphore(max_size)
+        self._connect_lock = asyncio.Lock()
+
+        self._change_listeners: list[Callable[[LeaderboardChange], None]] = [
+            update_leaderboard_name_index
+        ]
 
     def connect(self) -> bool:
-        """Establish connection to the database"""
+        """Create the connection pool"""
+        if self.pool is not None:
+            return True
+
+        options = f"-c statement_timeout={self.statement_timeout_ms}"
         try:
-            self.connection = (
-                psycopg2.connect(DATABASE_URL, sslmode="require")
+            self.pool = (
+                ThreadedConnectionPool(
+                    self.min_size,
+                    self.max_size,
+                    DATABASE_URL,
+                    sslmode="require",
+                    options=options,
+                )
                 if DATABASE_URL
-                else psycopg2.connect(**self.connection_params)
+                else ThreadedConnectionPool(
+                    self.min_size, self.max_size, options=options, **self.connection_params
+                )
             )
-            self.cursor = self.connection.cursor()
             return True
         except Error as e:
             print(f"Error connecting to PostgreSQL: {e}")
             return False
 
     def disconnect(self):
-        """Close database connection and cursor"""
-        if self.cursor:
-            self.cursor.close()
-        if self.connection:
-            self.connection.close()
-
-    def __enter__(self):
-        """Context manager entry"""
-        self.connect()
+        """Close all pooled connections"""
+        if self.pool:
+            self.pool.closeall()
+            self.pool = None
+        self._last_used.clear()
+
+    async def __aenter__(self):
+        """Context manager entry, lazily creates the pool"""
+        if self.pool is None:
+            async with self._connect_lock:
+                if self.pool is None and not await asyncio.to_thread(self.connect):
+                    raise ConnectionError("Could not connect to PostgreSQL")
         return self
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        """Context manager exit"""
-        self.disconnect()
-
-    def create_leaderboard(self, leaderboard: LeaderboardItem) -> Optional[None]:
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        """Context manager exit, connections stay in the pool for the next caller"""
+        pass
+
+    def add_change_listener(self, listener: Callable[[LeaderboardChange], None]):
+        """Call `listener` for every change published on CHANGES_CHANNEL, see listen()"""
+        self._change_listeners.append(listener)
+
+    def _notify_change_listeners(self, change: LeaderboardChange):
+        for listener in self._change_listeners:
+            try:
+                listener(change)
+            except Exception as e:
+                logger.error(f"Error in leaderboard change listener: {e}", exc_info=True)
+
+    async def publish_github_event(self, event: str, payload: dict):
+        """Pass a GitHub webhook event on to the change listeners of every bot process"""
+        await self._run(self._publish_github_event, event, payload)
+
+    def _publish_github_event(self, connection, cursor, event: str, payload: dict):
+        change = LeaderboardChange(table="github_event", op=event, event=payload)
+        cursor.execute("SELECT pg_notify(%s, %s)", (CHANGES_CHANNEL, json.dumps(change)))
+        connection.commit()
+
+    def _connect_listener(self) -> psycopg2.extensions.connection:
+        # Keepalives make a silently dropped connection fail instead of hanging forever
+        keepalives = {"keepalives": 1, "keepalives_idle": 30, "keepalives_interval": 10}
+        connection = (
+            psycopg2.connect(DATABASE_URL, sslmode="require", **keepalives)
+            if DATABASE_URL
+            else psycopg2.connect(**self.connection_params, **keepalives)
+        )
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANGES_CHANNEL}")
+        return connection
+
+    async def listen(self):
+        """Dispatch database change notifications to the change listeners, forever
+
+        Runs on a dedicated connection outside the pool and reconnects with backoff
+        when it is lost. Listeners receive RESYNC_CHANGE on every (re)connect, since
+        changes made while disconnected were not delivered.
+        """
+        delay = 1
+        while True:
+            try:
+                connection = await asyncio.to_thread(self._connect_listener)
+            except Error as e:
+                logger.warning(f"Could not listen for leaderboard changes, retrying: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+                continue
+
+            delay = 1
+            self._notify_change_listeners(RESYNC_CHANGE)
+            try:
+                await self._dispatch_notifications(connection)
+            except Error as e:
+                logger.warning(f"Lost leaderboard change notifications, reconnecting: {e}")
+            finally:
+                connection.close()
+
+    async def _dispatch_notifications(self, connection: psycopg2.extensions.connection):
+        loop = asyncio.get_running_loop()
+        notifications: asyncio.Queue = asyncio.Queue()
+
+        def on_readable():
+            try:
+                connection.poll()
+            except Error as e:
+                notifications.put_nowait(e)
+                return
+            while connection.notifies:
+                notifications.put_nowait(connection.notifies.pop(0))
+
+        loop.add_reader(connection.fileno(), on_readable)
+        try:
+            while True:
+                notification = await notifications.get()
+                if isinstance(notification, Error):
+                    raise notification
+                self._notify_change_listeners(json.loads(notification.payload))
+        finally:
+            loop.remove_reader(connection.fileno())
+
+    def _checkout(self) -> psycopg2.extensions.connection:
+        """Take a connection from the pool, replacing it if it fails its health check"""
+        connection = self.pool.getconn()
+        last_used = self._last_used.get(id(connection), 0.0)
+        if connection.closed or time.monotonic() - last_used > self.health_check_interval:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                connection.rollback()
+            except Error:
+                self.pool.putconn(connection, close=True)
+                connection = self.pool.getconn()
+        return connection
+
+    def _run_sync(self, fn: Callable, *args) -> Any:
+        connection = self._checkout()
         try:
-            self.cursor.execute(
+            with connection.cursor() as cursor:
+                return fn(connection, cursor, *args)
+        finally:
+            # Never hand a connection with an open transaction back to the pool
+            if not connection.closed:
+                connection.rollback()
+            self._last_used[id(connection)] = time.monotonic()
+            self.pool.putconn(connection, close=bool(connection.closed))
+
+    async def _run(self, fn: Callable, *args) -> Any:
+        """Run `fn(connection, cursor, *args)` on a pooled connection in a worker thread"""
+        async with self:
+            async with self._slots:
+                return await asyncio.to_thread(self._run_sync, fn, *args)
+
+    async def create_leaderboard(self, leaderboard: LeaderboardItem) -> Optional[str]:
+        err = await self._run(self._create_leaderboard, leaderboard)
+        if err is None:
+            leaderboard_name_index.add(leaderboard["name"])  # Update autocomplete
+        return err
+
+    def _create_leaderboard(self, connection, cursor, leaderboard: LeaderboardItem):
+        try:
+            cursor.execute(
                 """
                 INSERT INTO leaderboard.leaderboard (name, deadline, reference_code)
                 VALUES (%s, %s, %s)
@@ -93,10 +338,10 @@ class LeaderboardDB:
                 ),
             )
 
-            leaderboard_id = self.cursor.fetchone()[0]
+            leaderboard_id = cursor.fetchone()[0]
 
             for gpu_type in leaderboard["gpu_types"]:
-                self.cursor.execute(
+                cursor.execute(
                     """
                     INSERT INTO leaderboard.gpu_type (leaderboard_id, gpu_type)
                     VALUES (%s, %s)
@@ -104,149 +349,629 @@ class LeaderboardDB:
                     (leaderboard_id, gpu_type),
                 )
 
-            self.connection.commit()
-            leaderboard_name_cache.invalidate()  # Invalidate autocomplete cache
+            connection.commit()
         except psycopg2.Error as e:
-            self.connection.rollback()  # Ensure rollback if error occurs
+            connection.rollback()  # Ensure rollback if error occurs
             return f"Error during leaderboard creation: {e}"
         return None
 
-    def delete_leaderboard(self, leaderboard_name: str) -> Optional[str]:
+    async def delete_leaderboard(self, leaderboard_name: str) -> Optional[str]:
+        err, hashes = await self._run(self._delete_leaderboard, leaderboard_name)
+        if err is None:
+            leaderboard_name_index.remove(leaderboard_name)  # Update autocomplete
+            # Its submissions went with it, and the payloads only they used
+            try:
+                await self.delete_unreferenced_blobs(hashes)
+            except psycopg2.Error as e:
+                logger.warning(f"Could not delete unreferenced blobs: {e}")
+        return err
+
+    async def delete_unreferenced_blobs(self, hashes: list[bytes]) -> int:
+        """
+        Delete those of the given payloads that no submission refers to any more,
+        returns how many were deleted. Each batch is its own short transaction.
+        """
+        deleted = 0
+        for start in range(0, len(hashes), BLOB_GC_BATCH_SIZE):
+            batch = hashes[start : start + BLOB_GC_BATCH_SIZE]
+            deleted += await self._run(self._delete_unreferenced_blobs, batch)
+        return deleted
+
+    def _delete_unreferenced_blobs(self, connection, cursor, hashes: list[bytes]) -> int:
+        try:
+            # Waits for transactions that are inserting blobs, whose submissions
+            # would not be visible yet, and holds off new ones until the delete is done
+            cursor.execute("LOCK TABLE leaderboard.blob IN SHARE ROW EXCLUSIVE MODE")
+            # Each check is a lookup in the index of its hash column
+            cursor.execute(
+                """
+                DELETE FROM leaderboard.blob b
+                WHERE b.hash = ANY(%s)
+                AND NOT EXISTS (SELECT 1 FROM leaderboard.submission WHERE code_hash = b.hash)
+                AND NOT EXISTS (SELECT 1 FROM leaderboard.submission WHERE stdout_hash = b.hash)
+                AND NOT EXISTS (
+                    SELECT 1 FROM leaderboard.submission WHERE profiler_output_hash = b.hash
+                )
+                """,
+                (hashes,),
+            )
+            deleted = cursor.rowcount
+            connection.commit()
+        except psycopg2.Error:
+            connection.rollback()
+            raise
+        return deleted
+
+    def _delete_leaderboard(
+        self, connection, cursor, leaderboard_name: str
+    ) -> tuple[Optional[str], list[bytes]]:
+        """Returns an error message or None, and the payloads of the deleted submissions"""
         try:
-            # TODO: wait for cascade to be implemented
-            self.cursor.execute(
+            # Submissions are deleted first rather than by the cascade, for their payloads
+            cursor.execute(
+                """
+                WITH deleted AS (
+                    DELETE FROM leaderboard.submission s
+                    USING leaderboard.leaderboard l
+                    WHERE s.leaderboard_id = l.id AND l.name = %s
+                    RETURNING s.code_hash, s.stdout_hash, s.profiler_output_hash
+                )
+                SELECT DISTINCT hash FROM deleted,
+                LATERAL (VALUES (code_hash), (stdout_hash), (profiler_output_hash)) v (hash)
+                WHERE hash IS NOT NULL
+                """,
+                (leaderboard_name,),
+            )
+            hashes = [bytes(row[0]) for row in cursor.fetchall()]
+            cursor.execute(
                 """
                 DELETE FROM leaderboard.leaderboard WHERE name = %s
                 """,
                 (leaderboard_name,),
             )
-            self.connection.commit()
-            leaderboard_name_cache.invalidate()  # Invalidate autocomplete cache
+            connection.commit()
         except psycopg2.Error as e:
-            self.connection.rollback()
-            return f"Error during leaderboard deletion: {e}"
-        return None
+            connection.rollback()
+            return f"Error during leaderboard deletion: {e}", []
+        return None, hashes
+
+    async def create_submission(self, submission: SubmissionItem):
+        return await self._run(self._create_submission, submission)
 
-    def create_submission(self, submission: SubmissionItem):
+    def _create_submission(self, connection, cursor, submission: SubmissionItem):
         try:
-            self.cursor.execute(
+            self._create_submissions(connection, cursor, [submission])
+        except psycopg2.Error as e:
+            print(f"Error during leaderboard submission: {e}")
+            connection.rollback()  # Ensure rollback if error occurs
+
+    async def create_submissions(self, submissions: list[SubmissionItem]) -> int:
+        """Insert a batch of submissions in a single statement and transaction
+
+        Unlike create_submission, database errors are raised so that the caller can
+        retry the batch. Returns the number of inserted rows, submissions to unknown
+        leaderboards are skipped.
+        """
+        return await self._run(self._create_submissions, submissions)
+
+    def _create_submissions(self, connection, cursor, submissions: list[SubmissionItem]) -> int:
+        # Payloads are stored once per distinct content, submissions only keep the hashes
+        blobs = {}
+        hashes = []
+        for submission in submissions:
+            row_hashes = []
+            for payload in ("code", "stdout", "profiler_output"):
+                content = submission.get(payload)
+                if content is None:
+                    row_hashes.append(None)
+                    continue
+                digest, size, data = compress_blob(content)
+                blobs[digest] = (digest, size, data)
+                row_hashes.append(digest)
+            hashes.append(row_hashes)
+
+        if blobs:
+            execute_values(
+                cursor,
                 """
-                INSERT INTO leaderboard.submission (leaderboard_id, name,
-                    user_id, code, submission_time, score, gpu_type, stdout,
-                    profiler_output)
-                VALUES (
-                    (SELECT id FROM leaderboard.leaderboard WHERE name = %s),
-                    %s, %s, %s, %s, %s, %s, %s, %s)
+                INSERT INTO leaderboard.blob (hash, size, data, compression)
+                VALUES %s
+                ON CONFLICT (hash) DO NOTHING
                 """,
+                list(blobs.values()),
+                template="(%s, %s, %s, 'zstd')",
+                page_size=len(blobs),
+            )
+
+        # The best_submission_update trigger records new bests
+        rows = execute_values(
+            cursor,
+            """
+            WITH batch (leaderboard_name, name, user_id, submission_time, score,
+                gpu_type, code_hash, stdout_hash, profiler_output_hash) AS (
+                VALUES %s
+            ),
+            new_submission AS (
+                INSERT INTO leaderboard.submission (leaderboard_id, name,
+                    user_id, submission_time, score, gpu_type, code_hash,
+                    stdout_hash, profiler_output_hash)
+                SELECT l.id, b.name, b.user_id, b.submission_time, b.score,
+                    b.gpu_type, b.code_hash, b.stdout_hash, b.profiler_output_hash
+                FROM batch b
+                JOIN leaderboard.leaderboard l ON l.name = b.leaderboard_name
+                RETURNING id
+            )
+            SELECT count(*) FROM new_submission
+            """,
+            [
                 (
                     submission["leaderboard_name"],
                     submission["submission_name"],
                     submission["user_id"],
-                    submission["code"],
                     submission["submission_time"],
                     submission["submission_score"],
                     submission["gpu_type"],
-                    submission.get("stdout", None),
-                    submission.get("profiler_output", None),
-                ),
-            )
-            self.connection.commit()
-        except psycopg2.Error as e:
-            print(f"Error during leaderboard submission: {e}")
-            self.connection.rollback()  # Ensure rollback if error occurs
-
-    def get_leaderboards(self) -> list[LeaderboardItem]:
-        self.cursor.execute(
-            """
-            SELECT id, name, deadline, reference_code
-            FROM leaderboard.leaderboard
+                    *row_hashes,
+                )
+                for submission, row_hashes in zip(submissions, hashes, strict=True)
+            ],
+            template="(%s, %s, %s::text, %s::timestamptz, %s::numeric, %s, %s::bytea, "
+            "%s::bytea, %s::bytea)",
+            page_size=len(submissions),
+            fetch=True,
+        )
+        connection.commit()
+        return rows[0][0]
+
+    async def get_submission_payloads(self, submission_id: int) -> SubmissionPayloads | None:
+        """Fetch and decompress the code, stdout and profiler output of a submission"""
+        return await self._run(self._get_submission_payloads, submission_id)
+
+    def _get_submission_payloads(
+        self, connection, cursor, submission_id: int
+    ) -> SubmissionPayloads | None:
+        # Rows written before the blob migration may still have their payloads inline
+        cursor.execute(
             """
+            SELECT s.code, c.compression, c.data,
+                s.stdout, o.compression, o.data,
+                s.profiler_output, p.compression, p.data
+            FROM leaderboard.submission s
+            LEFT JOIN leaderboard.blob c ON c.hash = s.code_hash
+            LEFT JOIN leaderboard.blob o ON o.hash = s.stdout_hash
+            LEFT JOIN leaderboard.blob p ON p.hash = s.profiler_output_hash
+            WHERE s.id = %s
+            """,
+            (submission_id,),
         )
 
-        lbs = self.cursor.fetchall()
-        leaderboards = []
+        res = cursor.fetchone()
+        if res is None:
+            return None
 
-        for lb in lbs:
-            self.cursor.execute(
-                "SELECT * from leaderboard.gpu_type where leaderboard_id = %s", [lb[0]]
-            )
-            gpu_types = [x[1] for x in self.cursor.fetchall()]
+        payloads = [
+            inline if data is None else decompress_blob(compression, data)
+            for inline, compression, data in (res[0:3], res[3:6], res[6:9])
+        ]
+        return SubmissionPayloads(code=payloads[0], stdout=payloads[1], profiler_output=payloads[2])
 
-            leaderboards.append(
-                LeaderboardItem(
-                    id=lb[0], name=lb[1], deadline=lb[2], reference_code=lb[3], gpu_types=gpu_types
-                )
-            )
+    async def get_leaderboards(self) -> list[LeaderboardItem]:
+        return await self._run(self._get_leaderboards)
 
-        return leaderboards
+    def _get_leaderboards(self, connection, cursor) -> list[LeaderboardItem]:
+        cursor.execute(LEADERBOARD_QUERY.format(where=""))
+        return [self._leaderboard_from_row(row) for row in cursor.fetchall()]
 
-    def get_leaderboard_gpu_types(self, leaderboard_name: str) -> List[str] | None:
-        self.cursor.execute(
-            """
-            SELECT *
-            FROM leaderboard.gpu_type
-            WHERE leaderboard_id = (
-                SELECT id
-                FROM leaderboard.leaderboard
-                WHERE name = %s
-            )
-            """,
-            (leaderboard_name,),
-        )
+    async def get_leaderboard_names(self) -> list[str]:
+        return await self._run(self._get_leaderboard_names)
 
-        gpu_types = [x[1] for x in self.cursor.fetchall()]
+    def _get_leaderboard_names(self, connection, cursor) -> list[str]:
+        cursor.execute("SELECT name FROM leaderboard.leaderboard")
+        return [row[0] for row in cursor.fetchall()]
 
-        if gpu_types:
-            return gpu_types
-        else:
-            return None
+    async def get_leaderboard(self, leaderboard_name: str) -> LeaderboardItem | None:
+        """Look up a leaderboard and its GPU types by name in a single query"""
+        return await self._run(self._get_leaderboard, leaderboard_name)
 
-    def get_leaderboard(self, leaderboard_name: str) -> int | None:
-        self.cursor.execute(
-            """
-            SELECT id, name, deadline, reference_code
-            FROM leaderboard.leaderboard
-            WHERE name = %s
-            """,
-            (leaderboard_name,),
-        )
+    def _get_leaderboard(self, connection, cursor, leaderboard_name: str) -> LeaderboardItem | None:
+        cursor.execute(LEADERBOARD_QUERY.format(where="WHERE l.name = %s"), (leaderboard_name,))
 
-        res = self.cursor.fetchone()
+        res = cursor.fetchone()
 
         if res:
-            return LeaderboardItem(id=res[0], name=res[1], deadline=res[2], reference_code=res[3])
+            return self._leaderboard_from_row(res)
         else:
             return None
 
+    @staticmethod
+    def _leaderboard_from_row(row) -> LeaderboardItem:
+        return LeaderboardItem(
+            id=row[0], name=row[1], deadline=row[2], reference_code=row[3], gpu_types=row[4]
+        )
+
+    @staticmethod
+    def _summaries_from_rows(
+        leaderboard_name: str, gpu_name: str, rows: list[tuple]
+    ) -> list[SubmissionSummary]:
+        return [
+            SubmissionSummary(
+                submission_id=row[0],
+                leaderboard_name=leaderboard_name,
+                submission_name=row[1],
+                user_id=row[2],
+                submission_time=row[3],
+                submission_score=row[4],
+                gpu_type=gpu_name,
+            )
+            for row in rows
+        ]
+
     # TODO: add GPU type
-    def get_leaderboard_submissions(
+    async def get_leaderboard_submissions(
         self, leaderboard_name: str, gpu_name: str
-    ) -> list[SubmissionItem]:
-        self.cursor.execute(
-            """
-            SELECT s.name, s.user_id, s.code, s.submission_time, s.score,
-            s.gpu_type
+    ) -> list[SubmissionSummary]:
+        return await self._run(self._get_leaderboard_submissions, leaderboard_name, gpu_name)
+
+    def _get_leaderboard_submissions(
+        self, connection, cursor, leaderboard_name: str, gpu_name: str
+    ) -> list[SubmissionSummary]:
+        cursor.execute(
+            f"""
+            SELECT {SUMMARY_COLUMNS}
             FROM leaderboard.submission s
             JOIN leaderboard.leaderboard l
             ON s.leaderboard_id = l.id
             WHERE l.name = %s AND s.gpu_type = %s
-            ORDER BY s.score ASC
+            ORDER BY s.score ASC, s.id ASC
             """,
             (leaderboard_name, gpu_name),
         )
 
-        return [
-            SubmissionItem(
-                leaderboard_name=leaderboard_name,
-                submission_name=submission[0],
-                user_id=submission[1],
-                code=submission[2],
-                submission_time=submission[3],
-                submission_score=submission[4],
-                gpu_type=gpu_name,
+        return self._summaries_from_rows(leaderboard_name, gpu_name, cursor.fetchall())
+
+    async def get_leaderboard_submissions_page(
+        self,
+        leaderboard_name: str,
+        gpu_name: str,
+        limit: int = 25,
+        after: Optional[tuple[float, int]] = None,
+    ) -> list[SubmissionSummary]:
+        """Return the `limit` best submissions, or the ones ranked after the `after` cursor
+
+        The cursor is the (submission_score, submission_id) of the last row of the
+        previous page. Code is not loaded, so a page stays cheap however large the
+        submissions are.
+        """
+        return await self._run(
+            self._get_leaderboard_submissions_page, leaderboard_name, gpu_name, limit, after
+        )
+
+    def _get_leaderboard_submissions_page(
+        self,
+        connection,
+        cursor,
+        leaderboard_name: str,
+        gpu_name: str,
+        limit: int,
+        after: Optional[tuple[float, int]],
+    ) -> list[SubmissionSummary]:
+        # Seeks on submission_leaderboard_gpu_score_idx, so the cost of a page does
+        # not depend on its position or on the size of the leaderboard
+        after_filter = "AND (s.score, s.id) > (%s, %s)" if after is not None else ""
+        cursor.execute(
+            f"""
+            SELECT {SUMMARY_COLUMNS}
+            FROM leaderboard.submission s
+            WHERE s.leaderboard_id = (
+                SELECT id FROM leaderboard.leaderboard WHERE name = %s
             )
-            for submission in self.cursor.fetchall()
-        ]
+            AND s.gpu_type = %s
+            {after_filter}
+            ORDER BY s.score ASC, s.id ASC
+            LIMIT %s
+            """,
+            (leaderboard_name, gpu_name, *(after or ()), limit),
+        )
+
+        return self._summaries_from_rows(leaderboard_name, gpu_name, cursor.fetchall())
+
+    async def get_leaderboard_best_submissions(
+        self,
+        leaderboard_name: str,
+        gpu_name: str,
+        limit: int = 25,
+        after: Optional[tuple[float, int]] = None,
+        before: Optional[tuple[float, int]] = None,
+    ) -> list[SubmissionSummary]:
+        """Return the ranking of a leaderboard, with the best submission of each user
+
+        Paginated like get_leaderboard_submissions_page, with the cursor taken from
+        the (submission_score, submission_id) of the last row of the previous page.
+        Pass the first row of the current page as `before` to page backwards instead.
+        """
+        return await self._run(
+            self._get_leaderboard_best_submissions,
+            leaderboard_name,
+            gpu_name,
+            limit,
+            after,
+            before,
+        )
+
+    def _get_leaderboard_best_submissions(
+        self,
+        connection,
+        cursor,
+        leaderboard_name: str,
+        gpu_name: str,
+        limit: int,
+        after: Optional[tuple[float, int]],
+        before: Optional[tuple[float, int]],
+    ) -> list[SubmissionSummary]:
+        keyset_filter, order, keyset = "", "ASC", ()
+        if before is not None:
+            # Walk the index backwards from the cursor, rows are put back in order below
+            keyset_filter = "AND (b.score, b.submission_id) < (%s, %s)"
+            order, keyset = "DESC", before
+        elif after is not None:
+            keyset_filter = "AND (b.score, b.submission_id) > (%s, %s)"
+            keyset = after
+        cursor.execute(
+            f"""
+            SELECT {SUMMARY_COLUMNS}
+            FROM leaderboard.best_submission b
+            JOIN leaderboard.submission s ON s.id = b.submission_id
+            WHERE b.leaderboard_id = (
+                SELECT id FROM leaderboard.leaderboard WHERE name = %s
+            )
+            AND b.gpu_type = %s
+            {keyset_filter}
+            ORDER BY b.score {order}, b.submission_id {order}
+            LIMIT %s
+            """,
+            (leaderboard_name, gpu_name, *keyset, limit),
+        )
+
+        rows = cursor.fetchall()
+        if before is not None:
+            rows.reverse()
+
+        return self._summaries_from_rows(leaderboard_name, gpu_name, rows)
+
+    async def get_leaderboard_user_rank(
+        self, leaderboard_name: str, gpu_name: str, user_id: int
+    ) -> Optional[tuple[int, float, int]]:
+        """
+        Return the (rank, submission_score, submission_id) of a user's best submission,
+        or None if they have not submitted. Rank starts at 1 and the score and id form
+        the cursor of that row for get_leaderboard_best_submissions.
+
+        The rank is counted, not stored: an index-only scan over the rows ahead of the
+        user's in best_submission_ranking_idx, so it costs O(rank), about 60 ms at
+        rank 200,000 on a laptop. Keeping a rank column up to date would instead make
+        every improved score rewrite the rank of every row behind it.
+        """
+        return await self._run(self._get_leaderboard_user_rank, leaderboard_name, gpu_name, user_id)
+
+    def _get_leaderboard_user_rank(
+        self, connection, cursor, leaderboard_name: str, gpu_name: str, user_id: int
+    ) -> Optional[tuple[int, float, int]]:
+        cursor.execute(
+            """
+            SELECT
+                (
+                    SELECT COUNT(*) + 1 FROM leaderboard.best_submission r
+                    WHERE r.leaderboard_id = b.leaderboard_id
+                    AND r.gpu_type = b.gpu_type
+                    AND (r.score, r.submission_id) < (b.score, b.submission_id)
+                ),
+                b.score,
+                b.submission_id
+            FROM leaderboard.best_submission b
+            WHERE b.leaderboard_id = (
+                SELECT id FROM leaderboard.leaderboard WHERE name = %s
+            )
+            AND b.gpu_type = %s
+            AND b.user_id = %s
+            """,
+            (leaderboard_name, gpu_name, str(user_id)),
+        )
+        return cursor.fetchone()
+
+    async def get_command_tree_hash(self, guild_id: str) -> Optional[str]:
+        """Return the hash of the command tree last synced to a guild"""
+        return await self._run(self._get_command_tree_hash, guild_id)
+
+    def _get_command_tree_hash(self, connection, cursor, guild_id: str) -> Optional[str]:
+        cursor.execute(
+            "SELECT tree_hash FROM leaderboard.command_sync WHERE guild_id = %s", (guild_id,)
+        )
+        res = cursor.fetchone()
+        return res[0] if res else None
+
+    async def set_command_tree_hash(self, guild_id: str, tree_hash: Optional[str]):
+        """Record a sync of the command tree to a guild, None forces the next one"""
+        await self._run(self._set_command_tree_hash, guild_id, tree_hash)
+
+    def _set_command_tree_hash(self, connection, cursor, guild_id: str, tree_hash: Optional[str]):
+        if tree_hash is None:
+            cursor.execute("DELETE FROM leaderboard.command_sync WHERE guild_id = %s", (guild_id,))
+        else:
+            cursor.execute(
+                """
+                INSERT INTO leaderboard.command_sync (guild_id, tree_hash)
+                VALUES (%s, %s)
+                ON CONFLICT (guild_id) DO UPDATE
+                SET tree_hash = EXCLUDED.tree_hash, synced_at = now()
+                """,
+                (guild_id, tree_hash),
+            )
+        connection.commit()
+
+    async def enqueue_job(self, kind: str, payload: dict) -> int:
+        return await self._run(self._enqueue_job, kind, payload)
+
+    def _enqueue_job(self, connection, cursor, kind: str, payload: dict) -> int:
+        cursor.execute(
+            "INSERT INTO leaderboard.job (kind, payload) VALUES (%s, %s) RETURNING id",
+            (kind, Json(payload)),
+        )
+        connection.commit()
+        return cursor.fetchone()[0]
+
+    async def claim_job(
+        self, worker: str, stale_after: float, max_attempts: int
+    ) -> Optional[JobItem]:
+        """
+        Take the oldest queued job, or a running one whose worker stopped sending
+        heartbeats for `stale_after` seconds. Jobs abandoned `max_attempts` times are
+        marked as failed instead.
+        """
+        return await self._run(self._claim_job, worker, stale_after, max_attempts)
+
+    def _claim_job(
+        self, connection, cursor, worker: str, stale_after: float, max_attempts: int
+    ) -> Optional[JobItem]:
+        cursor.execute(
+            """
+            UPDATE leaderboard.job
+            SET status = 'failed', error = 'Abandoned by its workers', finished_at = now()
+            WHERE status = 'running'
+            AND heartbeat_at < now() - make_interval(secs => %s)
+            AND attempts >= %s
+            """,
+            (stale_after, max_attempts),
+        )
+        cursor.execute(
+            """
+            UPDATE leaderboard.job
+            SET status = 'running', worker = %s, attempts = attempts + 1,
+                started_at = now(), heartbeat_at = now()
+            WHERE id = (
+                SELECT id FROM leaderboard.job
+                WHERE status = 'queued'
+                OR (status = 'running' AND heartbeat_at < now() - make_interval(secs => %s))
+                ORDER BY id
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING id, kind, payload, state, attempts
+            """,
+            (worker, stale_after),
+        )
+        res = cursor.fetchone()
+        connection.commit()
+        if res is None:
+            return None
+        return JobItem(id=res[0], kind=res[1], payload=res[2], state=res[3], attempts=res[4])
+
+    async def heartbeat_jobs(self, worker: str, job_ids: list[int]) -> list[int]:
+        """Keep the given jobs claimed by `worker`, returns those it still holds"""
+        return await self._run(self._heartbeat_jobs, worker, job_ids)
+
+    def _heartbeat_jobs(self, connection, cursor, worker: str, job_ids: list[int]) -> list[int]:
+        cursor.execute(
+            """
+            UPDATE leaderboard.job SET heartbeat_at = now()
+            WHERE id = ANY(%s) AND worker = %s AND status = 'running'
+            RETURNING id
+            """,
+            (job_ids, worker),
+        )
+        held = [row[0] for row in cursor.fetchall()]
+        connection.commit()
+        return held
+
+    async def checkpoint_job(self, job_id: int, worker: str, state: dict) -> bool:
+        """
+        Save the progress of a job, handed back to it if it is retried. Returns False,
+        saving nothing, if `worker` no longer holds the job.
+        """
+        return await self._run(self._checkpoint_job, job_id, worker, state)
+
+    def _checkpoint_job(self, connection, cursor, job_id: int, worker: str, state: dict) -> bool:
+        cursor.execute(
+            """
+            UPDATE leaderboard.job SET state = %s
+            WHERE id = %s AND worker = %s AND status = 'running'
+            """,
+            (Json(state), job_id, worker),
+        )
+        held = cursor.rowcount > 0
+        connection.commit()
+        return held
+
+    async def finish_job(self, job_id: int, worker: str, error: Optional[str] = None) -> bool:
+        """
+        Mark a job as done, or failed with `error`. Returns False, changing nothing, if
+        `worker` no longer holds the job.
+        """
+        return await self._run(self._finish_job, job_id, worker, error)
+
+    def _finish_job(
+        self, connection, cursor, job_id: int, worker: str, error: Optional[str]
+    ) -> bool:
+        cursor.execute(
+            """
+            UPDATE leaderboard.job
+            SET status = %s, error = %s, finished_at = now()
+            WHERE id = %s AND worker = %s AND status = 'running'
+            """,
+            ("failed" if error else "done", error, job_id, worker),
+        )
+        held = cursor.rowcount > 0
+        connection.commit()
+        return held
+
+    async def acquire_runner(self, gpu_type: str, job_id: int, capacity: int) -> bool:
+        """
+        Lease a runner of `gpu_type` for a job, returns False if jobs hold `capacity`
+        of them already. A job's lease counts while the job is running.
+        """
+        return await self._run(self._acquire_runner, gpu_type, job_id, capacity)
+
+    def _acquire_runner(
+        self, connection, cursor, gpu_type: str, job_id: int, capacity: int
+    ) -> bool:
+        # Serializes the count and insert of concurrent acquisitions of a GPU type
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"runner:{gpu_type}",))
+        cursor.execute(
+            """
+            SELECT count(*) FROM leaderboard.runner_lease l
+            JOIN leaderboard.job j ON j.id = l.job_id
+            WHERE l.gpu_type = %s AND j.status = 'running' AND l.job_id <> %s
+            """,
+            (gpu_type, job_id),
+        )
+        if cursor.fetchone()[0] >= capacity:
+            connection.commit()
+            return False
+        self._take_runner(connection, cursor, gpu_type, job_id)
+        return True
+
+    async def take_runner(self, gpu_type: str, job_id: int):
+        """Lease a runner whatever the capacity, for a job whose run was dispatched before"""
+        await self._run(self._take_runner, gpu_type, job_id)
+
+    def _take_runner(self, connection, cursor, gpu_type: str, job_id: int):
+        cursor.execute(
+            """
+            INSERT INTO leaderboard.runner_lease (job_id, gpu_type) VALUES (%s, %s)
+            ON CONFLICT DO NOTHING
+            """,
+            (job_id, gpu_type),
+        )
+        connection.commit()
+
+    async def release_runner(self, gpu_type: str, job_id: int):
+        await self._run(self._release_runner, gpu_type, job_id)
+
+    def _release_runner(self, connection, cursor, gpu_type: str, job_id: int):
+        cursor.execute(
+            "DELETE FROM leaderboard.runner_lease WHERE job_id = %s AND gpu_type = %s",
+            (job_id, gpu_type),
+        )
+        connection.commit()
 
 
 if __name__ == "__main__":
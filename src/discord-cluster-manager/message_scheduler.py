@@ -0,0 +1,248 @@
+import asyncio
+import itertools
+import time
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Optional, TypedDict
+
+import discord
+from utils import setup_logging
+
+logger = setup_logging()
+
+# Discord allows 5 messages per 5 seconds in a channel and 50 requests per second
+# overall. Staying under these avoids 429s and the library's retries after them.
+CHANNEL_RATE = 1.0
+CHANNEL_BURST = 5
+GLOBAL_RATE = 50.0
+GLOBAL_BURST = 50
+
+MAX_MESSAGE_LENGTH = 2000
+
+# Pending messages in one channel above which the backlog is logged
+BACKLOG_WARNING_DEPTH = 20
+
+
+class MessageDroppedError(Exception):
+    """A queued message was dropped without being sent, e.g. at shutdown"""
+
+
+class MessagePriority(IntEnum):
+    # Lower values are sent first
+    RESULT = 0
+    PROGRESS = 1
+
+
+class MessageSchedulerStats(TypedDict):
+    channels: int
+    depth: int
+    max_depth: int
+    sent: int
+    coalesced: int
+    replaced: int
+    throttled: int
+
+
+class TokenBucket:
+    """Allows `burst` acquisitions at once, refilled at `rate` per second"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self) -> float:
+        """Seconds until a token is available"""
+        self._refill()
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self._tokens -= 1
+
+    @property
+    def full(self) -> bool:
+        self._refill()
+        return self._tokens >= self.burst
+
+
+@dataclass(order=True)
+class _PendingMessage:
+    priority: int
+    sequence: int
+    content: Optional[str] = field(compare=False)
+    kwargs: dict[str, Any] = field(compare=False)
+    key: Optional[str] = field(compare=False)
+    futures: list[asyncio.Future] = field(compare=False, default_factory=list)
+    coalesce: bool = field(compare=False, default=True)
+
+    @property
+    def mergeable(self) -> bool:
+        # Embeds, files and views are sent as they are, and so are messages that will
+        # be edited, which would overwrite whatever was merged into them
+        return self.coalesce and not self.kwargs and self.content is not None
+
+
+@dataclass
+class _ChannelQueue:
+    channel: discord.abc.Messageable
+    pending: list[_PendingMessage] = field(default_factory=list)
+    task: Optional[asyncio.Task] = None
+
+
+class MessageScheduler:
+    """
+    Outbound message queue, one per bot, with a worker task per channel.
+
+    Messages wait for per-channel and global rate limit tokens instead of running
+    into 429s. When a channel is backed up, queued results are sent before progress
+    messages, adjacent plain-text messages of the same priority are merged into one,
+    and a message queued with a `key` replaces the unsent one with the same key.
+    """
+
+    def __init__(self):
+        self._channels: dict[int, _ChannelQueue] = {}
+        # Outlive the queues, which end whenever a channel has nothing pending, so
+        # that messages sent one at a time are paced too
+        self._buckets: dict[int, TokenBucket] = {}
+        self._global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+        self._sequence = itertools.count()
+        self._sent = self._coalesced = self._replaced = self._throttled = 0
+
+    def send(
+        self,
+        channel: discord.abc.Messageable,
+        content: Optional[str] = None,
+        priority: MessagePriority = MessagePriority.PROGRESS,
+        key: Optional[str] = None,
+        coalesce: bool = True,
+        **kwargs,
+    ) -> asyncio.Future:
+        """
+        Queue a message, returns a future of the discord.Message it ended up in, or
+        None if it was replaced before being sent. There is no need to await it,
+        unless the caller needs the message or to know it was sent. Pass
+        `coalesce=False` for a message that is edited later, so that it holds only
+        its own content.
+        """
+        queue = self._channels.get(channel.id)
+        if queue is None:
+            queue = _ChannelQueue(channel)
+            self._channels[channel.id] = queue
+        if channel.id not in self._buckets:
+            self._buckets[channel.id] = TokenBucket(CHANNEL_RATE, CHANNEL_BURST)
+
+        future = asyncio.get_running_loop().create_future()
+        # Failures are logged by the worker, don't warn about futures nobody awaited
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+        if key is not None:
+            for message in queue.pending:
+                if message.key == key:
+                    queue.pending.remove(message)
+                    for replaced in message.futures:
+                        replaced.set_result(None)
+                    self._replaced += 1
+                    break
+
+        queue.pending.append(
+            _PendingMessage(
+                priority, next(self._sequence), content, kwargs, key, [future], coalesce
+            )
+        )
+        if len(queue.pending) == BACKLOG_WARNING_DEPTH:
+            logger.warning(f"{len(queue.pending)} messages queued for channel {channel.id}")
+
+        if queue.task is None:
+            queue.task = asyncio.create_task(self._run(channel.id, queue))
+        return future
+
+    def depth(self, channel: discord.abc.Messageable) -> int:
+        queue = self._channels.get(channel.id)
+        return len(queue.pending) if queue else 0
+
+    @property
+    def stats(self) -> MessageSchedulerStats:
+        depths = [len(queue.pending) for queue in self._channels.values()]
+        return MessageSchedulerStats(
+            channels=len(depths),
+            depth=sum(depths),
+            max_depth=max(depths, default=0),
+            sent=self._sent,
+            coalesced=self._coalesced,
+            replaced=self._replaced,
+            throttled=self._throttled,
+        )
+
+    async def close(self, timeout: float = 10.0):
+        """Give queued messages up to `timeout` seconds to go out, then drop the rest"""
+        logger.info(f"Closing message scheduler: {self.stats}")
+        tasks = [queue.task for queue in self._channels.values() if queue.task]
+        if tasks:
+            _, unfinished = await asyncio.wait(tasks, timeout=timeout)
+            for task in unfinished:
+                task.cancel()
+
+    async def _run(self, channel_id: int, queue: _ChannelQueue):
+        try:
+            while queue.pending:
+                await self._acquire(self._buckets[channel_id])
+                message = self._next_message(queue)
+                try:
+                    sent = await queue.channel.send(message.content, **message.kwargs)
+                    self._sent += 1
+                    for future in message.futures:
+                        if not future.done():
+                            future.set_result(sent)
+                except Exception as e:
+                    logger.error(f"Error sending message to channel {channel_id}: {e}")
+                    for future in message.futures:
+                        if not future.done():
+                            future.set_exception(e)
+        finally:
+            self._end_queue(channel_id, queue)
+
+    def _end_queue(self, channel_id: int, queue: _ChannelQueue):
+        for message in queue.pending:
+            for future in message.futures:
+                if not future.done():
+                    future.set_exception(MessageDroppedError("Message scheduler closed"))
+        del self._channels[channel_id]
+
+        # A full bucket is what a new one would be, idle channels don't need theirs
+        for idle_id in [
+            idle_id
+            for idle_id, bucket in self._buckets.items()
+            if idle_id not in self._channels and bucket.full
+        ]:
+            del self._buckets[idle_id]
+
+    async def _acquire(self, bucket: TokenBucket):
+        while (delay := max(bucket.delay(), self._global_bucket.delay())) > 0:
+            self._throttled += 1
+            await asyncio.sleep(delay)
+        bucket.take()
+        self._global_bucket.take()
+
+    def _next_message(self, queue: _ChannelQueue) -> _PendingMessage:
+        """Pop the most urgent message, merged with the ones of the same priority that follow"""
+        queue.pending.sort()
+        message = queue.pending.pop(0)
+        while (
+            message.mergeable
+            and queue.pending
+            and queue.pending[0].mergeable
+            and queue.pending[0].priority == message.priority
+            and len(message.content) + 1 + len(queue.pending[0].content) <= MAX_MESSAGE_LENGTH
+        ):
+            following = queue.pending.pop(0)
+            message.content += "\n" + following.content
+            message.futures += following.futures
+            self._coalesced += 1
+        return message
@@ -0,0 +1,22 @@
+"""
+This migration adds a composite index on submission for ranked leaderboard
+reads. The trailing id column makes (score, id) a unique sort key, which is what
+keyset pagination in LeaderboardDB.get_leaderboard_submissions_page seeks on.
+The index is built concurrently so that submissions aren't blocked while it is
+created on a large table.
+"""
+
+from yoyo import step
+
+__depends__ = {"20241226_01_ZQSOK-add_gpu_type_to_submission"}
+__transactional__ = False
+
+steps = [
+    step(
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS submission_leaderboard_gpu_score_idx
+        ON leaderboard.submission (leaderboard_id, gpu_type, score, id)
+        """,
+        "DROP INDEX CONCURRENTLY IF EXISTS leaderboard.submission_leaderboard_gpu_score_idx",
+    ),
+]
@@ -0,0 +1,44 @@
+"""
+This migration adds leaderboard.best_submission, which holds the best
+submission of every user per leaderboard and GPU type, and backfills it from
+leaderboard.submission. A trigger keeps it up to date (see 20261018_09), so
+ranking a leaderboard reads one row per competitor instead of every submission.
+"""
+
+from yoyo import step
+
+__depends__ = {"20261018_01_kR3xT-submission-score-index"}
+
+steps = [
+    step(
+        """
+        CREATE TABLE leaderboard.best_submission (
+            leaderboard_id INTEGER NOT NULL
+                REFERENCES leaderboard.leaderboard(id) ON DELETE CASCADE,
+            gpu_type TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            submission_id INTEGER NOT NULL
+                REFERENCES leaderboard.submission(id) ON DELETE CASCADE,
+            score NUMERIC NOT NULL,
+            PRIMARY KEY (leaderboard_id, gpu_type, user_id)
+        )
+        """,
+        "DROP TABLE leaderboard.best_submission",
+    ),
+    step(
+        """
+        CREATE INDEX best_submission_ranking_idx
+        ON leaderboard.best_submission (leaderboard_id, gpu_type, score, submission_id)
+        """
+    ),
+    step(
+        """
+        INSERT INTO leaderboard.best_submission
+            (leaderboard_id, gpu_type, user_id, submission_id, score)
+        SELECT DISTINCT ON (leaderboard_id, gpu_type, user_id)
+            leaderboard_id, gpu_type, user_id, id, score
+        FROM leaderboard.submission
+        ORDER BY leaderboard_id, gpu_type, user_id, score ASC, id ASC
+        """
+    ),
+]
@@ -0,0 +1,149 @@
+"""
+This migration moves submission code, stdout and profiler output out of
+leaderboard.submission into leaderboard.blob, a table of zstd-compressed
+payloads keyed by the SHA-256 of their content, so identical payloads are stored
+once. Submissions reference their payloads through the new *_hash columns.
+
+The payloads are moved, not copied: code becomes nullable and the inline code,
+stdout and profiler_output columns are set to NULL for every existing row, and
+new submissions only fill the *_hash columns. The columns themselves remain, to
+be dropped by a later migration. Versions of the bot from before this migration
+read the inline columns only, so they show empty payloads for every submission.
+To go back to such a version, roll this migration back first, which copies the
+payloads back inline. Run VACUUM FULL leaderboard.submission afterwards to
+return the freed space.
+"""
+
+import hashlib
+
+import zstandard
+from yoyo import step
+
+__depends__ = {"20261018_02_Vb7Qe-best-submission"}
+
+BATCH_SIZE = 1000
+
+
+def move_payloads_to_blobs(conn):
+    compressor = zstandard.ZstdCompressor()
+    cursor = conn.cursor()
+    last_id = 0
+
+    while True:
+        cursor.execute(
+            """
+            SELECT id, code, stdout, profiler_output FROM leaderboard.submission
+            WHERE id > %s
+            AND (code IS NOT NULL OR stdout IS NOT NULL OR profiler_output IS NOT NULL)
+            ORDER BY id
+            LIMIT %s
+            """,
+            (last_id, BATCH_SIZE),
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+
+        for submission_id, *payloads in rows:
+            hashes = []
+            for payload in payloads:
+                if payload is None:
+                    hashes.append(None)
+                    continue
+                data = payload.encode("utf-8")
+                digest = hashlib.sha256(data).digest()
+                cursor.execute(
+                    """
+                    INSERT INTO leaderboard.blob (hash, compression, size, data)
+                    VALUES (%s, 'zstd', %s, %s)
+                    ON CONFLICT (hash) DO NOTHING
+                    """,
+                    (digest, len(data), compressor.compress(data)),
+                )
+                hashes.append(digest)
+
+            cursor.execute(
+                """
+                UPDATE leaderboard.submission
+                SET code_hash = %s, stdout_hash = %s, profiler_output_hash = %s,
+                    code = NULL, stdout = NULL, profiler_output = NULL
+                WHERE id = %s
+                """,
+                (*hashes, submission_id),
+            )
+
+
+def move_payloads_inline(conn):
+    decompressor = zstandard.ZstdDecompressor()
+    cursor = conn.cursor()
+    last_id = 0
+
+    while True:
+        cursor.execute(
+            """
+            SELECT s.id, c.data, o.data, p.data
+            FROM leaderboard.submission s
+            LEFT JOIN leaderboard.blob c ON c.hash = s.code_hash
+            LEFT JOIN leaderboard.blob o ON o.hash = s.stdout_hash
+            LEFT JOIN leaderboard.blob p ON p.hash = s.profiler_output_hash
+            WHERE s.id > %s
+            ORDER BY s.id
+            LIMIT %s
+            """,
+            (last_id, BATCH_SIZE),
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+
+        for submission_id, *blobs in rows:
+            payloads = [
+                None if data is None else decompressor.decompress(bytes(data)).decode("utf-8")
+                for data in blobs
+            ]
+            cursor.execute(
+                """
+                UPDATE leaderboard.submission
+                SET code = COALESCE(%s, code, ''),
+                    stdout = COALESCE(%s, stdout),
+                    profiler_output = COALESCE(%s, profiler_output)
+                WHERE id = %s
+                """,
+                (*payloads, submission_id),
+            )
+
+
+steps = [
+    step(
+        """
+        CREATE TABLE leaderboard.blob (
+            hash BYTEA PRIMARY KEY,
+            compression TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            data BYTEA NOT NULL
+        )
+        """,
+        "DROP TABLE leaderboard.blob",
+    ),
+    step(
+        """
+        ALTER TABLE leaderboard.submission
+        ADD COLUMN code_hash BYTEA REFERENCES leaderboard.blob(hash),
+        ADD COLUMN stdout_hash BYTEA REFERENCES leaderboard.blob(hash),
+        ADD COLUMN profiler_output_hash BYTEA REFERENCES leaderboard.blob(hash)
+        """,
+        """
+        ALTER TABLE leaderboard.submission
+        DROP COLUMN code_hash,
+        DROP COLUMN stdout_hash,
+        DROP COLUMN profiler_output_hash
+        """,
+    ),
+    step(
+        "ALTER TABLE leaderboard.submission ALTER COLUMN code DROP NOT NULL",
+        "ALTER TABLE leaderboard.submission ALTER COLUMN code SET NOT NULL",
+    ),
+    step(move_payloads_to_blobs, move_payloads_inline),
+]
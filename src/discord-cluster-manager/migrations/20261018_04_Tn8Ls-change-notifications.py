@@ -0,0 +1,94 @@
+"""
+This migration adds triggers that publish changes to leaderboards, their GPU
+types and their submissions on the 'leaderboard_changes' notification channel,
+so that every bot process can invalidate its caches whoever wrote to the
+database. Payloads are JSON objects with the table, the operation, the
+leaderboard id and name and, for submissions, the GPU type.
+"""
+
+from yoyo import step
+
+__depends__ = {"20261018_03_Hq2Wd-submission-blobs"}
+
+steps = [
+    step(
+        """
+        CREATE FUNCTION leaderboard.notify_leaderboard_change() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP <> 'INSERT' THEN
+                PERFORM pg_notify('leaderboard_changes', json_build_object(
+                    'table', TG_TABLE_NAME, 'op', TG_OP,
+                    'leaderboard_id', OLD.id, 'name', OLD.name)::text);
+            END IF;
+            IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.name <> OLD.name) THEN
+                PERFORM pg_notify('leaderboard_changes', json_build_object(
+                    'table', TG_TABLE_NAME, 'op', TG_OP,
+                    'leaderboard_id', NEW.id, 'name', NEW.name)::text);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP FUNCTION leaderboard.notify_leaderboard_change()",
+    ),
+    step(
+        """
+        CREATE TRIGGER leaderboard_change_notify
+        AFTER INSERT OR UPDATE OR DELETE ON leaderboard.leaderboard
+        FOR EACH ROW EXECUTE FUNCTION leaderboard.notify_leaderboard_change()
+        """,
+        "DROP TRIGGER leaderboard_change_notify ON leaderboard.leaderboard",
+    ),
+    step(
+        """
+        CREATE FUNCTION leaderboard.notify_gpu_type_change() RETURNS trigger AS $$
+        DECLARE
+            changed_id INTEGER := CASE WHEN TG_OP = 'DELETE'
+                THEN OLD.leaderboard_id ELSE NEW.leaderboard_id END;
+        BEGIN
+            PERFORM pg_notify('leaderboard_changes', json_build_object(
+                'table', TG_TABLE_NAME, 'op', TG_OP, 'leaderboard_id', changed_id,
+                'name', (SELECT name FROM leaderboard.leaderboard WHERE id = changed_id)
+            )::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP FUNCTION leaderboard.notify_gpu_type_change()",
+    ),
+    step(
+        """
+        CREATE TRIGGER gpu_type_change_notify
+        AFTER INSERT OR UPDATE OR DELETE ON leaderboard.gpu_type
+        FOR EACH ROW EXECUTE FUNCTION leaderboard.notify_gpu_type_change()
+        """,
+        "DROP TRIGGER gpu_type_change_notify ON leaderboard.gpu_type",
+    ),
+    # Submissions are written in batches, so notify once per statement and
+    # leaderboard rather than once per row
+    step(
+        """
+        CREATE FUNCTION leaderboard.notify_submission_change() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('leaderboard_changes', json_build_object(
+                'table', TG_TABLE_NAME, 'op', TG_OP, 'leaderboard_id', l.id,
+                'name', l.name, 'gpu_type', changed.gpu_type
+            )::text)
+            FROM (SELECT DISTINCT leaderboard_id, gpu_type FROM new_rows) changed
+            JOIN leaderboard.leaderboard l ON l.id = changed.leaderboard_id;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP FUNCTION leaderboard.notify_submission_change()",
+    ),
+    step(
+        """
+        CREATE TRIGGER submission_change_notify
+        AFTER INSERT ON leaderboard.submission
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION leaderboard.notify_submission_change()
+        """,
+        "DROP TRIGGER submission_change_notify ON leaderboard.submission",
+    ),
+]
@@ -0,0 +1,22 @@
+"""
+This migration adds leaderboard.command_sync, which records the hash of the
+slash command tree last synced to each guild, so that restarts with unchanged
+commands skip the rate-limited sync.
+"""
+
+from yoyo import step
+
+__depends__ = {"20261018_04_Tn8Ls-change-notifications"}
+
+steps = [
+    step(
+        """
+        CREATE TABLE leaderboard.command_sync (
+            guild_id TEXT PRIMARY KEY,
+            tree_hash TEXT NOT NULL,
+            synced_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+        )
+        """,
+        "DROP TABLE leaderboard.command_sync",
+    ),
+]
@@ -0,0 +1,64 @@
+"""
+This migration adds leaderboard.job, the queue through which gateway processes
+hand runs to worker processes. Workers claim queued jobs with FOR UPDATE SKIP
+LOCKED and heartbeat the ones they run, so the jobs of a worker that died are
+claimed again by another one. `state` holds what a job checkpointed, e.g. the
+id of the workflow run it started, so a retry resumes instead of starting over.
+
+Inserts are announced on the 'leaderboard_changes' channel with table 'job', so
+idle workers wake up without polling.
+"""
+
+from yoyo import step
+
+__depends__ = {"20261018_05_Rc6Jm-command-sync"}
+
+steps = [
+    step(
+        """
+        CREATE TABLE leaderboard.job (
+            id SERIAL PRIMARY KEY,
+            kind TEXT NOT NULL,
+            payload JSONB NOT NULL,
+            state JSONB NOT NULL DEFAULT '{}',
+            status TEXT NOT NULL DEFAULT 'queued',
+            worker TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            started_at TIMESTAMP WITH TIME ZONE,
+            heartbeat_at TIMESTAMP WITH TIME ZONE,
+            finished_at TIMESTAMP WITH TIME ZONE
+        )
+        """,
+        "DROP TABLE leaderboard.job",
+    ),
+    # Finished jobs are kept for inspection, only the unfinished ones are scanned
+    step(
+        """
+        CREATE INDEX job_unfinished_idx ON leaderboard.job (id)
+        WHERE status IN ('queued', 'running')
+        """,
+        "DROP INDEX leaderboard.job_unfinished_idx",
+    ),
+    step(
+        """
+        CREATE FUNCTION leaderboard.notify_job_change() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('leaderboard_changes', json_build_object(
+                'table', TG_TABLE_NAME, 'op', TG_OP)::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP FUNCTION leaderboard.notify_job_change()",
+    ),
+    step(
+        """
+        CREATE TRIGGER job_change_notify
+        AFTER INSERT ON leaderboard.job
+        FOR EACH STATEMENT EXECUTE FUNCTION leaderboard.notify_job_change()
+        """,
+        "DROP TRIGGER job_change_notify ON leaderboard.job",
+    ),
+]
@@ -0,0 +1,22 @@
+"""
+This migration indexes the blob hash columns of leaderboard.submission. Deleting
+a blob checks the foreign keys referencing it, which without these indexes scans
+the submission table once per deleted blob. They are built concurrently so that
+submissions aren't blocked while they are created.
+"""
+
+from yoyo import step
+
+__depends__ = {"20261018_06_Jw5Pz-jobs"}
+__transactional__ = False
+
+steps = [
+    step(
+        f"""
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS submission_{column}_idx
+        ON leaderboard.submission ({column})
+        """,
+        f"DROP INDEX CONCURRENTLY IF EXISTS leaderboard.submission_{column}_idx",
+    )
+    for column in ("code_hash", "stdout_hash", "profiler_output_hash")
+]
@@ -0,0 +1,25 @@
+"""
+This migration adds leaderboard.runner_lease, the GitHub runners held by jobs.
+Worker processes take a lease before dispatching a run, so that all of them
+together stay within the runner capacity of each GPU type. A lease belongs to
+its job: it carries over to the worker that takes over the job, and stops
+counting once the job is no longer running.
+"""
+
+from yoyo import step
+
+__depends__ = {"20261018_07_Gb4Xc-blob-reference-indexes"}
+
+steps = [
+    step(
+        """
+        CREATE TABLE leaderboard.runner_lease (
+            job_id INTEGER NOT NULL REFERENCES leaderboard.job(id) ON DELETE CASCADE,
+            gpu_type TEXT NOT NULL,
+            acquired_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            PRIMARY KEY (job_id, gpu_type)
+        )
+        """,
+        "DROP TABLE leaderboard.runner_lease",
+    ),
+]
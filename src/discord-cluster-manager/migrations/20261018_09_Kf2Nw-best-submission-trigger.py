@@ -0,0 +1,57 @@
+"""
+This migration keeps leaderboard.best_submission up to date with a trigger on
+leaderboard.submission, so that every insert counts, whichever code wrote it.
+Until now only LeaderboardDB.create_submissions updated it, which missed rows
+written by versions from before the table existed. Those are caught up here.
+"""
+
+from yoyo import step
+
+__depends__ = {"20261018_08_Pm3Rv-runner-leases"}
+
+steps = [
+    # A submission replaces the user's best one only if it is strictly faster.
+    # Submissions are written in batches, so the trigger runs once per statement
+    # and DISTINCT ON keeps the upsert to one row per user if the batch has several.
+    step(
+        """
+        CREATE FUNCTION leaderboard.update_best_submission() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO leaderboard.best_submission AS b
+                (leaderboard_id, gpu_type, user_id, submission_id, score)
+            SELECT DISTINCT ON (leaderboard_id, gpu_type, user_id)
+                leaderboard_id, gpu_type, user_id, id, score
+            FROM new_rows
+            ORDER BY leaderboard_id, gpu_type, user_id, score ASC, id ASC
+            ON CONFLICT (leaderboard_id, gpu_type, user_id) DO UPDATE
+            SET submission_id = EXCLUDED.submission_id, score = EXCLUDED.score
+            WHERE EXCLUDED.score < b.score;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP FUNCTION leaderboard.update_best_submission()",
+    ),
+    step(
+        """
+        CREATE TRIGGER best_submission_update
+        AFTER INSERT ON leaderboard.submission
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION leaderboard.update_best_submission()
+        """,
+        "DROP TRIGGER best_submission_update ON leaderboard.submission",
+    ),
+    step(
+        """
+        INSERT INTO leaderboard.best_submission AS b
+            (leaderboard_id, gpu_type, user_id, submission_id, score)
+        SELECT DISTINCT ON (leaderboard_id, gpu_type, user_id)
+            leaderboard_id, gpu_type, user_id, id, score
+        FROM leaderboard.submission
+        ORDER BY leaderboard_id, gpu_type, user_id, score ASC, id ASC
+        ON CONFLICT (leaderboard_id, gpu_type, user_id) DO UPDATE
+        SET submission_id = EXCLUDED.submission_id, score = EXCLUDED.score
+        WHERE EXCLUDED.score < b.score
+        """
+    ),
+]
@@ -0,0 +1,236 @@
+import asyncio
+import itertools
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from consts import DEADLINE_PRIORITY_WINDOW, GPU_RUNNER_CAPACITY
+from leaderboard_db import LeaderboardDB
+from utils import setup_logging
+
+logger = setup_logging()
+
+# Seconds between attempts to lease a runner that other processes hold, a release
+# in this process wakes its waiters at once
+LEASE_RETRY_INTERVAL = 5
+
+
+@dataclass
+class _Request:
+    user_id: int
+    deadline: Optional[datetime]
+    sequence: int
+    future: asyncio.Future
+    on_position: Optional[Callable[[int], None]]
+    position: Optional[int] = None
+
+    def urgent(self, now: datetime) -> bool:
+        return self.deadline is not None and now <= self.deadline < now + DEADLINE_PRIORITY_WINDOW
+
+    @property
+    def order(self) -> tuple:
+        # A user's own requests go by deadline, then first come first served
+        return (self.deadline is None, self.deadline or datetime.max, self.sequence)
+
+
+@dataclass
+class _Pool:
+    capacity: int
+    running: int = 0
+    # Waiting requests of each user, in their order
+    queues: dict[int, list[_Request]] = field(default_factory=dict)
+    # Users with waiting requests, the next one to be served first
+    rotation: deque[int] = field(default_factory=deque)
+    # Set and replaced whenever this process gives a runner lease back
+    lease_freed: asyncio.Event = field(default_factory=asyncio.Event)
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+
+class RunnerScheduler:
+    """
+    Limits the runs in flight on each GPU type to the capacity of its runners, and
+    decides which of the waiting runs goes next.
+
+    Each user has a queue of their own, and users take turns (round robin), so a
+    user submitting many runs waits for their own runs rather than delaying
+    everyone else's. Runs for leaderboards whose deadline is less than
+    DEADLINE_PRIORITY_WINDOW away go before all others, taking turns the same way.
+    Waiting runs are told their position in the queue whenever it changes.
+
+    With `db`, runs of jobs also lease their runner in Postgres once it is their
+    turn, so that any number of worker processes together stay within capacity.
+    Turns are taken among the runs waiting in the same process.
+    """
+
+    def __init__(
+        self,
+        capacity: dict[str, int] = GPU_RUNNER_CAPACITY,
+        default_capacity: int = 1,
+        db: Optional[LeaderboardDB] = None,
+    ):
+        self.capacity = capacity
+        self.default_capacity = default_capacity
+        self.db = db
+        self._pools: dict[str, _Pool] = {}
+        self._sequence = itertools.count()
+
+    def _pool(self, gpu: str) -> _Pool:
+        if gpu not in self._pools:
+            self._pools[gpu] = _Pool(self.capacity.get(gpu, self.default_capacity))
+        return self._pools[gpu]
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        gpu: str,
+        user_id: int,
+        deadline: Optional[datetime] = None,
+        on_position: Optional[Callable[[int], None]] = None,
+        wait: bool = True,
+        job_id: Optional[int] = None,
+    ):
+        """
+        Hold a runner of `gpu` for the duration of the block, waiting for one if all
+        are busy. `on_position` is called with the position in the queue while
+        waiting, 1 being next. Without `wait`, e.g. for a run that was dispatched
+        before, the slot is taken even if that goes over capacity. The runner is
+        leased for job `job_id`, if given, when the scheduler has a database.
+        """
+        if wait:
+            await self.acquire(gpu, user_id, deadline, on_position)
+        else:
+            self._pool(gpu).running += 1
+        leased = False
+        try:
+            if self.db is not None and job_id is not None:
+                await self._lease(gpu, job_id, wait)
+                leased = True
+            yield
+        finally:
+            self.release(gpu)
+            if leased:
+                await self._unlease(gpu, job_id)
+
+    async def _lease(self, gpu: str, job_id: int, wait: bool):
+        pool = self._pool(gpu)
+        async with self.db as db:
+            if not wait:
+                await db.take_runner(gpu, job_id)
+                return
+            while True:
+                freed = pool.lease_freed
+                if await db.acquire_runner(gpu, job_id, pool.capacity):
+                    return
+                try:
+                    await asyncio.wait_for(freed.wait(), LEASE_RETRY_INTERVAL)
+                except TimeoutError:
+                    pass
+
+    async def _unlease(self, gpu: str, job_id: int):
+        try:
+            async with self.db as db:
+                await db.release_runner(gpu, job_id)
+        except Exception as e:
+            # It stops counting anyway once the job is no longer running
+            logger.warning(f"Could not release the {gpu} runner of job {job_id}: {e}")
+        pool = self._pool(gpu)
+        pool.lease_freed.set()
+        pool.lease_freed = asyncio.Event()
+
+    async def acquire(
+        self,
+        gpu: str,
+        user_id: int,
+        deadline: Optional[datetime] = None,
+        on_position: Optional[Callable[[int], None]] = None,
+    ):
+        pool = self._pool(gpu)
+        if pool.running < pool.capacity and not pool.queues:
+            pool.running += 1
+            return
+
+        request = _Request(
+            user_id,
+            deadline,
+            next(self._sequence),
+            asyncio.get_running_loop().create_future(),
+            on_position,
+        )
+        queue = pool.queues.setdefault(user_id, [])
+        if not queue:
+            pool.rotation.append(user_id)
+        queue.append(request)
+        queue.sort(key=lambda request: request.order)
+        self._report_positions(pool)
+
+        try:
+            await request.future
+        except asyncio.CancelledError:
+            if request.future.done() and not request.future.cancelled():
+                # Granted just as it was cancelled
+                self.release(gpu)
+            else:
+                self._remove(pool, request)
+                self._report_positions(pool)
+            raise
+
+    def release(self, gpu: str):
+        pool = self._pool(gpu)
+        pool.running -= 1
+        while pool.running < pool.capacity and pool.queues:
+            request = self._next(pool)
+            pool.running += 1
+            request.future.set_result(None)
+        self._report_positions(pool)
+
+    def _next(self, pool: _Pool) -> _Request:
+        """Pop the request to run next and move its user to the end of the rotation"""
+        now = datetime.now(timezone.utc)
+        urgent = any(queue[0].urgent(now) for queue in pool.queues.values())
+        for _ in range(len(pool.rotation)):
+            user_id = pool.rotation[0]
+            pool.rotation.rotate(-1)
+            request = pool.queues[user_id][0]
+            if request.urgent(now) or not urgent:
+                self._remove(pool, request)
+                return request
+        raise RuntimeError("No waiting request")
+
+    def _remove(self, pool: _Pool, request: _Request):
+        queue = pool.queues[request.user_id]
+        queue.remove(request)
+        if not queue:
+            del pool.queues[request.user_id]
+            pool.rotation.remove(request.user_id)
+
+    def _order(self, pool: _Pool) -> list[_Request]:
+        """The waiting requests in the order _next would return them"""
+        copy = _Pool(
+            pool.capacity,
+            queues={user_id: list(queue) for user_id, queue in pool.queues.items()},
+            rotation=deque(pool.rotation),
+        )
+        return [self._next(copy) for _ in range(copy.waiting)]
+
+    def _report_positions(self, pool: _Pool):
+        for position, request in enumerate(self._order(pool), start=1):
+            if position == request.position or request.on_position is None:
+                continue
+            request.position = position
+            try:
+                request.on_position(position)
+            except Exception as e:
+                logger.error(f"Error in queue position callback: {e}", exc_info=True)
+
+
+def parse_deadline(deadline: Optional[str]) -> Optional[datetime]:
+    """A leaderboard deadline as passed in job payloads, naive times are UTC"""
+    if deadline is None:
+        return None
+    value = datetime.fromisoformat(deadline)
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
@@ -0,0 +1,188 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import discord
+from message_scheduler import MessagePriority, MessageScheduler
+from utils import setup_logging
+
+logger = setup_logging()
+
+# Characters of a live log shown, leaving room for the title in a message
+LIVE_LOG_CHARS = 1900
+
+STATUS_ICONS = {
+    "queued": "⏳",
+    "running": "🏃",
+    "success": "✅",
+    "failure": "❌",
+    "cancelled": "🚫",
+    "error": "❌",
+}
+
+
+@dataclass
+class GPUStatus:
+    gpu: str
+    status: str = "queued"
+    started: Optional[float] = None  # Unix time
+    finished: Optional[float] = None
+    score: Optional[float] = None
+    url: Optional[str] = None
+    # In the bot's queue for a runner, see runner_scheduler
+    position: Optional[int] = None
+
+    def render(self) -> str:
+        line = f"{STATUS_ICONS.get(self.status, '•')} `{self.gpu}` {self.status}"
+        if self.status == "queued" and self.position is not None:
+            line += f" · #{self.position} in line"
+        if self.started is not None and self.finished is None:
+            # Rendered relative by the client, so elapsed time needs no edits
+            line += f" since <t:{int(self.started)}:R>"
+        elif self.started is not None:
+            line += f" in {self.finished - self.started:.1f}s"
+        if self.score is not None:
+            line += f" · score {self.score:.9f}"
+        if self.url:
+            line += f" · [run](<{self.url}>)"
+        return line
+
+
+class DebouncedMessage:
+    """
+    A message showing render(), kept up to date as its state changes.
+
+    Changes only mark the message as changed; it is edited at most once every
+    `debounce` seconds with whatever changed in between, so the number of API calls
+    doesn't grow with the number of changes.
+    """
+
+    def __init__(self, messages: MessageScheduler, debounce: float = 2.0):
+        self.messages = messages
+        self.debounce = debounce
+
+        self.message: Optional[discord.Message | discord.PartialMessage] = None
+        self._rendered: Optional[str] = None
+        self._dirty = False
+        self._edit_task: Optional[asyncio.Task] = None
+
+    def render(self) -> str:
+        raise NotImplementedError
+
+    async def post(self, channel: discord.abc.Messageable):
+        self._rendered = self.render()
+        self.message = await self.messages.send(
+            channel, self._rendered, MessagePriority.RESULT, coalesce=False
+        )
+
+    def attach(self, message: discord.PartialMessage):
+        """Take over a message posted before, e.g. by an earlier attempt of the same job"""
+        self.message = message
+        # Unknown content, so the next edit goes through
+        self._rendered = None
+
+    async def close(self):
+        """Apply pending changes right away"""
+        if self._edit_task is not None:
+            self._edit_task.cancel()
+        await self._edit()
+
+    def _changed(self):
+        self._dirty = True
+        if self._edit_task is None or self._edit_task.done():
+            self._edit_task = asyncio.create_task(self._edit_later())
+
+    async def _edit_later(self):
+        while self._dirty:
+            await asyncio.sleep(self.debounce)
+            await self._edit()
+
+    async def _edit(self):
+        self._dirty = False
+        content = self.render()
+        if self.message is None or content == self._rendered:
+            return
+        try:
+            await self.message.edit(content=content)
+            self._rendered = content
+        except discord.HTTPException as e:
+            logger.warning(f"Could not update {type(self).__name__}: {e}")
+
+
+class StatusBoard(DebouncedMessage):
+    """A single message showing the state of a submission on each of its GPUs"""
+
+    def __init__(
+        self, messages: MessageScheduler, title: str, gpus: list[str], debounce: float = 2.0
+    ):
+        super().__init__(messages, debounce)
+        self.title = title
+        self.rows = {gpu: GPUStatus(gpu) for gpu in gpus}
+
+    def render(self) -> str:
+        return "\n".join([f"**{self.title}**", *(row.render() for row in self.rows.values())])
+
+    def update(self, gpu: str, **changes):
+        row = self.rows[gpu]
+        if changes.get("status") == "running" and row.started is None:
+            row.started = time.time()
+        for name, value in changes.items():
+            setattr(row, name, value)
+        if row.status not in ("queued", "running") and row.finished is None:
+            row.finished = time.time()
+        self._changed()
+
+
+class LiveLog(DebouncedMessage):
+    """
+    The last lines of a running log in a single message, posted to `channel` with
+    the first lines and edited as more arrive.
+    """
+
+    def __init__(
+        self,
+        messages: MessageScheduler,
+        channel: discord.abc.Messageable,
+        title: str = "Live log",
+        max_chars: int = LIVE_LOG_CHARS,
+        debounce: float = 2.0,
+    ):
+        super().__init__(messages, debounce)
+        self.channel = channel
+        self.title = title
+        self.max_chars = max_chars
+        self._text = ""
+        self._posting: Optional[asyncio.Future] = None
+
+    def render(self) -> str:
+        return f"```\n{self.title}:\n{self._text}\n```"
+
+    def append(self, text: str):
+        # Fences in the log would end the block early
+        text = text.replace("```", "`\u200b``")
+        text = f"{self._text}\n{text}" if self._text else text
+        if len(text) > self.max_chars:
+            # Starting at a line if there is one
+            text = text[-self.max_chars :]
+            text = text.partition("\n")[2] or text
+        self._text = text
+        self._changed()
+
+    async def _edit(self):
+        if self.message is None and self._text:
+            if self._posting is None:
+                self._rendered = self.render()
+                self._posting = self.messages.send(
+                    self.channel,
+                    self._rendered,
+                    coalesce=False,
+                    allowed_mentions=discord.AllowedMentions.none(),
+                )
+            try:
+                # Shielded so that close() can wait for the same message
+                self.message = await asyncio.shield(self._posting)
+            except discord.HTTPException as e:
+                logger.warning(f"Could not post live log: {e}")
+                return
+        await super()._edit()
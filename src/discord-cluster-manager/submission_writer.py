@@ -0,0 +1,254 @@
+import asyncio
+import fcntl
+import json
+import os
+import shutil
+from datetime import datetime
+from typing import Optional, TextIO
+
+import psycopg2
+from consts import (
+    SUBMISSION_BATCH_SIZE,
+    SUBMISSION_QUEUE_SIZE,
+    SUBMISSION_RETRIES,
+    SUBMISSION_SPILL_PATH,
+)
+from leaderboard_db import LeaderboardDB
+from utils import SubmissionItem, setup_logging
+
+logger = setup_logging()
+
+# Errors after which the database may come back, as opposed to errors in the data itself
+TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, ConnectionError)
+
+
+class SubmissionWriter:
+    """
+    Write-behind queue for leaderboard submissions.
+
+    Submissions are buffered in a bounded queue and written by a single background
+    task. Whatever accumulates while a write is in flight goes into the next batch
+    (group commit), so one transaction covers many submissions under load. If the
+    database is unreachable, a batch is retried with backoff and then appended to an
+    on-disk spill file, which is replayed once writes succeed again. close() flushes
+    the queue before shutdown.
+
+    Processes on one host may share the spill file: appends are serialized with a
+    lock, and a replay first moves the spilled submissions to a replay file that
+    only one process at a time works through.
+    """
+
+    def __init__(
+        self,
+        db: LeaderboardDB,
+        max_queue_size: int = SUBMISSION_QUEUE_SIZE,
+        batch_size: int = SUBMISSION_BATCH_SIZE,
+        retries: int = SUBMISSION_RETRIES,
+        spill_path: str = SUBMISSION_SPILL_PATH,
+        retry_delay: float = 0.5,
+    ):
+        self.db = db
+        self.batch_size = batch_size
+        self.retries = retries
+        self.spill_path = spill_path
+        self.retry_delay = retry_delay
+
+        self._queue: asyncio.Queue[SubmissionItem] = asyncio.Queue(maxsize=max_queue_size)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def submit(self, submission: SubmissionItem):
+        """Queue a submission for writing, waits only while the buffer is full"""
+        await self._queue.put(submission)
+
+    async def flush(self):
+        """Wait until every queued submission is written or spilled"""
+        await self._queue.join()
+
+    async def close(self):
+        """Flush the queue and stop the writer task"""
+        if self._task is None:
+            return
+        await self.flush()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        await self._replay_spill()
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            try:
+                try:
+                    written = await self._write(batch)
+                except Exception as e:
+                    logger.error(f"Unexpected error writing submissions: {e}", exc_info=True)
+                    written = False
+                # Only a batch that wasn't written is spilled, or a replay would insert it twice
+                if written:
+                    await self._replay_spill()
+                else:
+                    self._spill(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _write(self, batch: list[SubmissionItem]) -> bool:
+        """Write a batch, returns False if the database stayed unreachable"""
+        for attempt in range(self.retries + 1):
+            try:
+                inserted = await self.db.create_submissions(batch)
+                if inserted != len(batch):
+                    logger.warning(
+                        f"Skipped {len(batch) - inserted} submissions to unknown leaderboards"
+                    )
+                return True
+            except TRANSIENT_ERRORS as e:
+                logger.warning(
+                    f"Database unavailable writing {len(batch)} submissions "
+                    f"(attempt {attempt + 1}/{self.retries + 1}): {e}"
+                )
+                if attempt < self.retries:
+                    await asyncio.sleep(self.retry_delay * 2**attempt)
+            except psycopg2.Error as e:
+                if len(batch) == 1:
+                    logger.error(f"Dropping invalid submission {_describe(batch[0])}: {e}")
+                    return True
+                # Retry one by one so that a single bad row doesn't reject the batch
+                for submission in batch:
+                    if not await self._write([submission]):
+                        self._spill([submission])
+                return True
+        return False
+
+    def _spill(self, batch: list[SubmissionItem]):
+        """Append a batch to the spill file. Never raises, the writer task must go on."""
+        logger.error(f"Spilling {len(batch)} submissions to {self.spill_path}")
+        lines = []
+        for submission in batch:
+            try:
+                lines.append(json.dumps(submission, default=_to_json) + "\n")
+            except (TypeError, ValueError) as e:
+                logger.error(f"Dropping unserializable submission {_describe(submission)}: {e}")
+        try:
+            with _lock(f"{self.spill_path}.lock"), open(self.spill_path, "a") as f:
+                f.writelines(lines)
+        except OSError as e:
+            logger.error(f"Could not spill, lost {len(lines)} submissions: {e}")
+
+    async def _replay_spill(self):
+        """Write the spilled submissions. Never raises, what isn't written stays spilled."""
+        replay_path = f"{self.spill_path}.replay"
+        try:
+            replay_lock = _lock(f"{replay_path}.lock", blocking=False)
+        except OSError as e:
+            logger.error(f"Could not lock {replay_path}: {e}")
+            return
+        if replay_lock is None:
+            # Another process is replaying
+            return
+        with replay_lock:
+            await self._replay(replay_path)
+
+    async def _replay(self, replay_path: str):
+        try:
+            self._claim_spill(replay_path)
+            if not os.path.exists(replay_path):
+                return
+            with open(replay_path) as f:
+                lines = [line for line in f if line.strip()]
+        except OSError as e:
+            logger.error(f"Could not read {self.spill_path}: {e}")
+            return
+
+        pending = []
+        for number, line in enumerate(lines, start=1):
+            try:
+                pending.append(_from_json(json.loads(line)))
+            except (ValueError, TypeError, KeyError) as e:
+                logger.error(f"Skipping corrupt line {number} of {replay_path}: {e}")
+        logger.info(f"Replaying {len(pending)} spilled submissions from {replay_path}")
+
+        while pending:
+            batch = pending[: self.batch_size]
+            try:
+                written = await self._write(batch)
+            except Exception as e:
+                logger.error(f"Unexpected error replaying submissions: {e}", exc_info=True)
+                written = False
+            if not written:
+                # Keep only what is left, so replayed rows are not inserted twice
+                _rewrite(replay_path, pending)
+                return
+            pending = pending[self.batch_size :]
+
+        try:
+            os.remove(replay_path)
+        except OSError as e:
+            logger.error(f"Could not remove {replay_path}: {e}")
+
+    def _claim_spill(self, replay_path: str):
+        """Move the spilled submissions to the replay file, new spills start a new file"""
+        with _lock(f"{self.spill_path}.lock"):
+            if not os.path.exists(self.spill_path):
+                return
+            if not os.path.exists(replay_path):
+                os.replace(self.spill_path, replay_path)
+                return
+            # The rest of an earlier replay that didn't get through
+            with open(self.spill_path) as spilled, open(replay_path, "a") as f:
+                shutil.copyfileobj(spilled, f)
+            os.remove(self.spill_path)
+
+
+def _lock(path: str, blocking: bool = True) -> Optional[TextIO]:
+    """
+    Open and lock `path` against other processes until the returned file is closed,
+    returns None if another process holds the lock and not `blocking`
+    """
+    f = open(path, "a")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return None
+    return f
+
+
+def _rewrite(path: str, pending: list[SubmissionItem]):
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            for submission in pending:
+                f.write(json.dumps(submission, default=_to_json) + "\n")
+        os.replace(tmp_path, path)
+    except OSError as e:
+        # The old file stays, its written rows are replayed again later
+        logger.error(f"Could not rewrite {path}: {e}")
+
+
+def _describe(submission: SubmissionItem) -> str:
+    return (
+        f"'{submission['submission_name']}' by {submission['user_id']} "
+        f"on {submission['leaderboard_name']} ({submission['gpu_type']})"
+    )
+
+
+def _to_json(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def _from_json(submission: dict) -> SubmissionItem:
+    submission["submission_time"] = datetime.fromisoformat(submission["submission_time"])
+    return SubmissionItem(**submission)
@@ -1,8 +1,25 @@
+import asyncio
+import bisect
 import datetime
+import heapq
 import logging
 import re
 import subprocess
-from typing import Any, List, NotRequired, TypedDict
+import sys
+import time
+from collections import OrderedDict, deque
+from typing import (
+    Any,
+    Awaitable,
+    BinaryIO,
+    Callable,
+    Iterable,
+    List,
+    NamedTuple,
+    NotRequired,
+    Optional,
+    TypedDict,
+)
 
 import discord
 
@@ -27,6 +44,9 @@ def setup_logging():
     return logger
 
 
+logger = setup_logging()
+
+
 def get_github_branch_name():
     try:
         result = subprocess.run(
@@ -40,24 +60,74 @@ def get_github_branch_name():
         return "main"
 
 
-async def get_user_from_id(id, interaction, bot):
-    # This currently doesn't work.
-    if interaction.guild:
-        # In a guild, try to get the member by ID
-        member = await interaction.guild.fetch_member(id)
-        if member:
-            username = member.global_name if member.nick is None else member.nick
-            return username
-        else:
-            return id
-    else:
-        # If the interaction is in DMs, we can get the user directly
-        user = await bot.fetch_user(id)
-        if user:
-            username = user.global_name if member.nick is None else member.nick
-            return username
-        else:
-            return id
+class UserNameResolver:
+    def __init__(
+        self,
+        bot: discord.Client,
+        ttl: float = 600,
+        max_size: int = 4096,
+        max_concurrent_fetches: int = 5,
+    ):
+        """Resolves user IDs to display names, with as few requests to Discord as possible
+        Names are served from a TTL cache, then from the member cache of the client,
+        and the rest of a guild's members are requested in one gateway member chunk
+        request per 100 IDs. Only users that are not guild members are fetched one by
+        one over REST, at most `max_concurrent_fetches` at a time. IDs that can't be
+        resolved are returned as is.
+        """
+        self.bot = bot
+        self._names = LRUCache(max_size=max_size, ttl=ttl)
+        self._fetch_slots = asyncio.Semaphore(max_concurrent_fetches)
+        # Unknown users are retried sooner, they may e.g. have just joined
+        self._unresolved_ttl = min(ttl, 60)
+
+    async def resolve(
+        self, user_ids: Iterable[int | str], guild: Optional[discord.Guild] = None
+    ) -> dict[str, str]:
+        """Return a mapping of str(user_id) to display name for all `user_ids`"""
+        names = {}
+        missing = []
+        for user_id in dict.fromkeys(str(user_id) for user_id in user_ids):
+            name = self._names.get(user_id)
+            if name is not None:
+                names[user_id] = name
+            elif guild and (member := guild.get_member(int(user_id))) is not None:
+                names[user_id] = self._cache(user_id, member.display_name)
+            else:
+                missing.append(user_id)
+
+        if guild and missing:
+            for i in range(0, len(missing), 100):
+                chunk = [int(user_id) for user_id in missing[i : i + 100]]
+                try:
+                    members = await guild.query_members(user_ids=chunk, limit=len(chunk))
+                except (asyncio.TimeoutError, discord.ClientException) as e:
+                    logger.warning(f"Could not query members of {guild.name}: {e}")
+                    break
+                for member in members:
+                    names[str(member.id)] = self._cache(str(member.id), member.display_name)
+            missing = [user_id for user_id in missing if user_id not in names]
+
+        if missing:
+            fetched = await asyncio.gather(*(self._fetch_user(user_id) for user_id in missing))
+            names.update(zip(missing, fetched, strict=True))
+
+        return names
+
+    async def _fetch_user(self, user_id: str) -> str:
+        user = self.bot.get_user(int(user_id))
+        if user is None:
+            async with self._fetch_slots:
+                try:
+                    user = await self.bot.fetch_user(int(user_id))
+                except discord.HTTPException as e:
+                    logger.warning(f"Could not fetch user {user_id}: {e}")
+                    return self._cache(user_id, user_id, self._unresolved_ttl)
+        return self._cache(user_id, user.display_name)
+
+    def _cache(self, user_id: str, name: str, ttl: Optional[float] = None) -> str:
+        self._names.set(user_id, name, ttl)
+        return name
 
 
 async def send_discord_message(interaction: discord.Interaction, msg: str, **kwargs) -> None:
@@ -82,91 +152,321 @@ def extract_score(score_str: str) -> float:
         return None
 
 
-async def display_lb_submissions(interaction, bot, leaderboard_name: str, gpu: str):
+def split_message(content: str, max_length: int = 1900) -> list[str]:
     """
-    Display leaderboard submissions for a particular GPU to discord.
-    Must be used as a follow-up currently.
+    Split text into chunks of at most `max_length` characters, at line breaks where
+    possible. A ``` block cut by a chunk boundary is closed at the end of the chunk
+    and reopened, with its language, at the start of the next one.
     """
-    with bot.leaderboard_db as db:
-        submissions = db.get_leaderboard_submissions(leaderboard_name, gpu)
+    chunks = []
+    current, fence = "", None  # `fence` is the opening line of the block left open
+
+    for line in content.splitlines(keepends=True):
+        # Lines longer than a chunk are hard-wrapped, leaving room for the fences
+        step = max_length - 64
+        for piece in (line[i : i + step] for i in range(0, len(line), step)):
+            if piece.lstrip().startswith("```"):
+                next_fence = None if fence else piece.strip()
+            else:
+                next_fence = fence
+            closing = "\n```" if next_fence else ""
+            if current and len(current) + len(piece) + len(closing) > max_length:
+                chunks.append(current.rstrip("\n") + ("\n```" if fence else ""))
+                current = f"{fence}\n" if fence else ""
+            current += piece
+            fence = next_fence
+
+    if current.strip():
+        chunks.append(current.rstrip("\n") + ("\n```" if fence else ""))
+    return chunks
+
+
+def log_preview(content: str, lines: int = 10, max_length: int = 1500) -> str:
+    """The first and last `lines` lines of a log, within `max_length` characters"""
+    all_lines = content.splitlines()
+    if len(all_lines) > 2 * lines:
+        omitted = len(all_lines) - 2 * lines
+        all_lines = all_lines[:lines] + [f"[... {omitted} lines omitted ...]"] + all_lines[-lines:]
+
+    # Very long lines still have to fit in the message
+    line_length = max(40, max_length // len(all_lines)) if all_lines else max_length
+    preview = "\n".join(
+        line if len(line) <= line_length else line[: line_length - 3] + "..." for line in all_lines
+    )
+    return preview.replace("```", "`\u200b``")
 
-    if not interaction.response.is_done():
-        await interaction.response.defer()
 
-    if not submissions:
-        await send_discord_message(
-            interaction,
-            f'No submissions found for "{leaderboard_name}".',
-            ephemeral=True,
-        )
-        return
-
-    # Create embed
-    embed = discord.Embed(
-        title=f'Leaderboard Submissions for "{leaderboard_name}" on {gpu}',
-        color=discord.Color.blue(),
+def read_head_tail(stream: BinaryIO, max_bytes: int, chunk_size: int = 2**16) -> str:
+    """
+    Read a text stream, keeping its first and last `max_bytes // 2` bytes if it is
+    longer than `max_bytes`. Memory stays within `max_bytes` however long it is.
+    """
+    head = stream.read(max_bytes // 2)
+    tail_size = max_bytes - len(head)
+    tail: deque[bytes] = deque()
+    tail_length = omitted = 0
+    while chunk := stream.read(chunk_size):
+        tail.append(chunk)
+        tail_length += len(chunk)
+        # Whole chunks are dropped, the last one is cut below
+        while tail_length - len(tail[0]) >= tail_size:
+            omitted += len(tail[0])
+            tail_length -= len(tail.popleft())
+
+    tail_bytes = b"".join(tail)
+    if tail_length > tail_size:
+        omitted += tail_length - tail_size
+        tail_bytes = tail_bytes[-tail_size:]
+
+    if not omitted:
+        return (head + tail_bytes).decode("utf-8", errors="replace")
+    return (
+        head.decode("utf-8", errors="replace")
+        + f"\n[... {omitted} bytes omitted ...]\n"
+        + tail_bytes.decode("utf-8", errors="replace")
     )
 
-    for submission in submissions:
-        user_id = await get_user_from_id(submission["user_id"], interaction, bot)
 
-        embed.add_field(
-            name=f"{user_id}: {submission['submission_name']}",
-            value=f"Submission speed: {submission['submission_score']}",
-            inline=False,
-        )
+_MISSING = object()
+
 
-    await interaction.followup.send(embed=embed)
+class CacheStats(TypedDict):
+    hits: int
+    misses: int
+    evictions: int
+    size: int
+    bytes: int
 
 
 class LRUCache:
-    def __init__(self, max_size: int):
+    def __init__(
+        self,
+        max_size: int,
+        ttl: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+        size_of: Callable[[Any], int] = sys.getsizeof,
+    ):
         """LRU Cache implementation, as functools.lru doesn't work in async code
-        Note: Implementation uses list for convenience because cache is small, so
-        runtime complexity does not matter here.
+        All operations are O(1). Entries expire `ttl` seconds after they were set,
+        unless a per-entry ttl is given to set(). If `max_bytes` is given, entries are
+        also evicted once their total `size_of` exceeds it (sys.getsizeof is shallow,
+        pass a better estimate for nested values).
         Args:
             max_size (int): Maximum size of the cache
         """
-        self._cache = {}
+        self._cache: OrderedDict[Any, tuple[Any, Optional[float], int]] = OrderedDict()
         self._max_size = max_size
-        self._q = []
-
-    def __getitem__(self, key: Any, default: Any = None) -> Any | None:
-        if key not in self._cache:
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        self._size_of = size_of
+        self._bytes = 0
+        # In-flight loads of get_or_load, so that concurrent misses share one loader
+        self._loading: dict[Any, asyncio.Future] = {}
+        # Bumped by invalidate(), loads started before that must not be stored
+        self._generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Any, default: Any = None) -> Any | None:
+        entry = self._cache.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            self._remove(key)
+            entry = None
+
+        if entry is None:
+            self.misses += 1
             return default
 
-        self._q.remove(key)
-        self._q.append(key)
-        return self._cache[key]
+        self.hits += 1
+        self._cache.move_to_end(key)
+        return entry[0]
 
-    def __setitem__(self, key: Any, value: Any) -> None:
+    def set(self, key: Any, value: Any, ttl: Optional[float] = None) -> None:
         if key in self._cache:
-            self._q.remove(key)
-            self._q.append(key)
-            self._cache[key] = value
-            return
+            self._remove(key)
+
+        ttl = ttl if ttl is not None else self._ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+        size = self._size_of(value) if self._max_bytes is not None else 0
+        self._cache[key] = (value, expires, size)
+        self._bytes += size
+
+        while len(self._cache) > self._max_size or (
+            self._max_bytes is not None and self._bytes > self._max_bytes and self._cache
+        ):
+            self._remove(next(iter(self._cache)))
+            self.evictions += 1
+
+    async def get_or_load(
+        self, key: Any, loader: Callable[[], Awaitable[Any]], ttl: Optional[float] = None
+    ) -> Any:
+        """Return the cached value, or load and cache it with `loader` on a miss.
+        Concurrent misses on the same key wait for a single call to `loader`.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        # In a task of its own, so that a caller that is cancelled doesn't cancel the
+        # load for the others waiting on it
+        if key not in self._loading:
+            task = asyncio.ensure_future(self._load(key, loader, ttl))
+            # Nobody may be left to retrieve a failure
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._loading[key] = task
+        return await asyncio.shield(self._loading[key])
+
+    async def _load(
+        self, key: Any, loader: Callable[[], Awaitable[Any]], ttl: Optional[float]
+    ) -> Any:
+        generation = self._generation
+        try:
+            value = await loader()
+            if generation == self._generation:
+                self.set(key, value, ttl)
+            return value
+        finally:
+            del self._loading[key]
+
+    def pop(self, key: Any, default: Any = None) -> Any | None:
+        if key not in self._cache:
+            return default
+        return self._remove(key)
 
-        if len(self._cache) >= self._max_size:
-            self._cache.pop(self._q.pop(0))
+    def _remove(self, key: Any) -> Any:
+        value, _, size = self._cache.pop(key)
+        self._bytes -= size
+        return value
 
-        self._cache[key] = value
-        self._q.append(key)
+    def __getitem__(self, key: Any, default: Any = None) -> Any | None:
+        return self.get(key, default)
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        self.set(key, value)
 
     def __contains__(self, key: Any) -> bool:
-        return key in self._cache
+        entry = self._cache.get(key)
+        return entry is not None and (entry[1] is None or entry[1] > time.monotonic())
 
     def __len__(self) -> int:
         return len(self._cache)
 
+    @property
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            size=len(self._cache),
+            bytes=self._bytes,
+        )
+
     def invalidate(self):
         """Invalidate the cache, clearing all entries, should be called when updating the underlying
         data in db
         """
         self._cache.clear()
-        self._q.clear()
+        self._bytes = 0
+        self._generation += 1
+
+
+class NameIndex:
+    def __init__(self, ngram_size: int = 3):
+        """Case-insensitive prefix and substring search over a set of names
+        Every name is indexed under all of its substrings of up to `ngram_size`
+        characters. Short queries are answered straight from that table, longer ones
+        intersect the postings of their n-grams and verify the few candidates left.
+        Prefix matches come from a sorted list via bisect, so they can be ranked first
+        without looking at other names.
+        """
+        self._ngram_size = ngram_size
+        self._names: dict[str, str] = {}  # lowercased -> original
+        self._sorted: list[str] = []  # lowercased, for prefix search
+        self._postings: dict[str, set[str]] = {}
+        # Set when the index may be out of date and must be rebuilt
+        self.stale = True
+        # Bumped by every change, a rebuild from names loaded before one is out of date
+        self.generation = 0
+
+    def _ngrams(self, name: str) -> set[str]:
+        return {
+            name[i : i + n]
+            for n in range(1, self._ngram_size + 1)
+            for i in range(len(name) - n + 1)
+        }
+
+    def add(self, name: str):
+        self.generation += 1
+        self._add(name)
+
+    def _add(self, name: str):
+        key = name.lower()
+        if key in self._names:
+            return
+        self._names[key] = name
+        bisect.insort(self._sorted, key)
+        for ngram in self._ngrams(key):
+            self._postings.setdefault(ngram, set()).add(key)
+
+    def remove(self, name: str):
+        self.generation += 1
+        key = name.lower()
+        if self._names.pop(key, None) is None:
+            return
+        del self._sorted[bisect.bisect_left(self._sorted, key)]
+        for ngram in self._ngrams(key):
+            postings = self._postings[ngram]
+            postings.discard(key)
+            if not postings:
+                del self._postings[ngram]
+
+    def rebuild(self, names: list[str]):
+        self._names.clear()
+        self._sorted.clear()
+        self._postings.clear()
+        for name in names:
+            self._add(name)
+        self.stale = False
+
+    def invalidate(self):
+        """Mark the index for a rebuild, e.g. because changes may have been missed"""
+        self.stale = True
+        self.generation += 1
+
+    def search(self, query: str, limit: int = 25) -> list[str]:
+        """Names containing `query`, names starting with it first, each group sorted"""
+        query = query.lower()
+
+        matches = []
+        i = bisect.bisect_left(self._sorted, query)
+        while i < len(self._sorted) and len(matches) < limit:
+            if not self._sorted[i].startswith(query):
+                break
+            matches.append(self._sorted[i])
+            i += 1
+
+        if len(matches) < limit:
+            if len(query) <= self._ngram_size:
+                candidates = self._postings.get(query, set()) if query else set()
+            else:
+                postings = sorted(
+                    (self._postings.get(ngram, set()) for ngram in self._ngrams(query)), key=len
+                )
+                candidates = set.intersection(*postings) if postings[0] else set()
+            # Names that start with the query were already taken above
+            others = (key for key in candidates if query in key and not key.startswith(query))
+            matches += heapq.nsmallest(limit - len(matches), others)
+
+        return [self._names[key] for key in matches]
+
+    def __len__(self) -> int:
+        return len(self._names)
 
 
 class LeaderboardItem(TypedDict):
+    id: NotRequired[int]
     name: str
     deadline: datetime.datetime
     reference_code: str
@@ -183,3 +483,43 @@ class SubmissionItem(TypedDict):
     gpu_type: str
     stdout: NotRequired[str]
     profiler_output: NotRequired[str]
+
+
+class SubmissionSummary(NamedTuple):
+    """
+    A submission as listed in rankings. Code, stdout and profiler output are left
+    out, fetch them with LeaderboardDB.get_submission_payloads when needed.
+    """
+
+    submission_id: int
+    leaderboard_name: str
+    submission_name: str
+    user_id: str
+    submission_time: datetime.datetime
+    submission_score: float
+    gpu_type: str
+
+
+class SubmissionPayloads(TypedDict):
+    code: str
+    stdout: str | None
+    profiler_output: str | None
+
+
+class JobItem(TypedDict):
+    id: int
+    kind: str
+    payload: dict
+    state: dict
+    attempts: int
+
+
+class LeaderboardChange(TypedDict):
+    # None for RESYNC, i.e. anything may have changed
+    table: str | None
+    op: str
+    leaderboard_id: NotRequired[int]
+    name: NotRequired[str]
+    gpu_type: NotRequired[str]
+    # github_event changes: the compacted webhook delivery, op is the event name
+    event: NotRequired[dict]
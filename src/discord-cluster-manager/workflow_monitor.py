@@ -0,0 +1,279 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+
+from aiohttp import web
+from consts import RUN_PROGRESS_INTERVAL, WORKFLOW_POLL_MAX_INTERVAL, WORKFLOW_POLL_MIN_INTERVAL
+from github_client import GitHubClient, WorkflowJob, WorkflowRun, WorkflowStep
+from utils import setup_logging
+
+logger = setup_logging()
+
+# Without webhook events for this long, the poller stops assuming they arrive
+WEBHOOK_SILENCE = 600
+
+
+@dataclass
+class _Waiter:
+    future: asyncio.Future
+    on_update: Optional[Callable[[WorkflowRun], None]]
+    status: Optional[str] = None
+
+
+class WorkflowMonitor:
+    """
+    Waits for workflow runs to complete, for all runs of the bot at once.
+
+    Runs are resolved by GitHub's workflow_run/workflow_job webhooks (see
+    webhook_app) as soon as they are delivered. A single poller covers runs without
+    webhooks: it lists the repository's recent runs in one conditional request
+    (a 304 when nothing changed), fetches in-flight runs missing from that page
+    individually, and backs off from `min_interval` to `max_interval` while nothing
+    changes. While webhooks are arriving it only polls every `max_interval`, as a
+    safety net for lost deliveries.
+    """
+
+    def __init__(
+        self,
+        github: GitHubClient,
+        min_interval: float = WORKFLOW_POLL_MIN_INTERVAL,
+        max_interval: float = WORKFLOW_POLL_MAX_INTERVAL,
+    ):
+        self.github = github
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+        self._waiters: dict[int, list[_Waiter]] = {}
+        self._interval = min_interval
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._last_webhook: Optional[float] = None
+
+        self.polls = 0
+        self.webhook_events = 0
+
+    async def wait(
+        self,
+        run_id: int,
+        on_update: Optional[Callable[[WorkflowRun], None]] = None,
+        timeout: Optional[float] = None,
+    ) -> WorkflowRun:
+        """
+        Wait until run `run_id` is completed and return it. `on_update` is called
+        whenever the status of the run changes before that. Raises TimeoutError
+        after `timeout` seconds.
+        """
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), on_update)
+        self._waiters.setdefault(run_id, []).append(waiter)
+
+        # Check the new run right away, then keep an eye on it closely for a while
+        self._interval = self.min_interval
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._poll())
+
+        try:
+            return await asyncio.wait_for(waiter.future, timeout)
+        finally:
+            waiters = self._waiters.get(run_id, [])
+            if waiter in waiters:
+                waiters.remove(waiter)
+            if not waiters:
+                self._waiters.pop(run_id, None)
+
+    async def follow_steps(
+        self,
+        run_id: int,
+        on_progress: Callable[[str], None],
+        interval: float = RUN_PROGRESS_INTERVAL,
+    ):
+        """
+        Call `on_progress` with a line for each step of the jobs of a run that started
+        or finished, checking every `interval` seconds until cancelled. GitHub only
+        serves the log of a job once it is completed, the status of its steps is
+        updated as it runs. Listing the jobs of a run that didn't change is a 304.
+        """
+        progress = StepProgress()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                lines = progress.feed(await self.github.list_run_jobs(run_id))
+            except Exception as e:
+                logger.warning(f"Could not read the steps of run {run_id}: {e}")
+                continue
+            if lines:
+                on_progress("\n".join(lines))
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    @property
+    def webhooks_active(self) -> bool:
+        return (
+            self._last_webhook is not None
+            and time.monotonic() - self._last_webhook < WEBHOOK_SILENCE
+        )
+
+    def handle_event(self, event: str, payload: dict):
+        """Apply a workflow_run or workflow_job webhook event"""
+        self.webhook_events += 1
+        self._last_webhook = time.monotonic()
+
+        if event == "workflow_run":
+            self._update(payload["workflow_run"])
+        elif event == "workflow_job":
+            job = payload["workflow_job"]
+            run_id = job["run_id"]
+            if run_id not in self._waiters:
+                return
+            if job["status"] == "in_progress":
+                # The run is in progress as soon as one of its jobs is
+                self._update(
+                    {"id": run_id, "status": "in_progress", "html_url": job["html_url"]},
+                    only_status=True,
+                )
+            elif job["status"] == "completed":
+                # The workflow_run event follows, check in case it gets lost
+                self._wakeup.set()
+
+    def _update(self, run: WorkflowRun, only_status: bool = False) -> bool:
+        """Resolve or notify the waiters of a run, returns whether its status changed"""
+        changed = False
+        for waiter in list(self._waiters.get(run["id"], [])):
+            if waiter.future.done():
+                continue
+            if run["status"] == "completed" and not only_status:
+                waiter.future.set_result(run)
+                changed = True
+            elif run["status"] != waiter.status and run["status"] != "completed":
+                waiter.status = run["status"]
+                changed = True
+                if waiter.on_update is not None:
+                    try:
+                        waiter.on_update(run)
+                    except Exception as e:
+                        logger.error(f"Error in workflow update callback: {e}", exc_info=True)
+        return changed
+
+    async def _poll(self):
+        while self._waiters:
+            interval = self.max_interval if self.webhooks_active else self._interval
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), interval)
+            except TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                changed = await self._poll_once()
+            except Exception as e:
+                logger.warning(f"Could not poll workflow runs: {e}")
+                changed = False
+            self._interval = (
+                self.min_interval if changed else min(self._interval * 1.5, self.max_interval)
+            )
+
+    async def _poll_once(self) -> bool:
+        self.polls += 1
+        changed = False
+        pending = set(self._waiters)
+        for run in await self.github.list_repository_runs(per_page=100):
+            if run["id"] in pending:
+                pending.discard(run["id"])
+                changed |= self._update(run)
+
+        # Older than the first page, each is its own (conditional) request
+        for run_id in pending:
+            changed |= self._update(await self.github.get_workflow_run(run_id))
+        return changed
+
+
+class StepProgress:
+    """Lines for the steps of a run's jobs that started or finished since the last feed"""
+
+    def __init__(self):
+        # (job ID, step number) -> status last reported
+        self._reported: dict[tuple[int, int], str] = {}
+
+    def feed(self, jobs: list[WorkflowJob]) -> list[str]:
+        lines = []
+        for job in jobs:
+            for step in job.get("steps") or []:
+                key = (job["id"], step["number"])
+                if step["status"] in ("queued", self._reported.get(key)):
+                    continue
+                self._reported[key] = step["status"]
+                lines.append(f"{job['name']} › {step['name']}{_step_outcome(step)}")
+        return lines
+
+
+def _step_outcome(step: WorkflowStep) -> str:
+    if step["status"] != "completed":
+        return "..."
+    outcome = f": {step['conclusion']}"
+    if step["started_at"] and step["completed_at"]:
+        seconds = (
+            datetime.fromisoformat(step["completed_at"])
+            - datetime.fromisoformat(step["started_at"])
+        ).total_seconds()
+        outcome += f" ({seconds:.0f} s)"
+    return outcome
+
+
+def verify_signature(secret: str, body: bytes, signature: Optional[str]) -> bool:
+    """Check the X-Hub-Signature-256 header of a webhook delivery"""
+    if not signature:
+        return False
+    expected = "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def compact_event(event: str, payload: dict) -> Optional[dict]:
+    """
+    The parts of a webhook delivery that handle_event uses, or None for events it
+    ignores. Small enough to pass on in a NOTIFY, whose payloads are limited to 8000
+    bytes, where deliveries are tens of kilobytes.
+    """
+    if event == "workflow_run":
+        run = payload["workflow_run"]
+        return {"workflow_run": {key: run.get(key) for key in WorkflowRun.__annotations__}}
+    if event == "workflow_job":
+        job = payload["workflow_job"]
+        return {"workflow_job": {key: job.get(key) for key in ("run_id", "status", "html_url")}}
+    return None
+
+
+def webhook_app(on_event: Callable[[str, dict], Awaitable[None]], secret: str) -> web.Application:
+    """
+    An aiohttp app that passes signed GitHub webhook deliveries to `on_event`, as
+    compacted by compact_event. Unsigned deliveries are rejected, so that nobody
+    else can complete runs, and there is no app without a secret.
+    """
+    if not secret:
+        raise ValueError("GitHub webhooks need a secret")
+
+    async def receive(request: web.Request) -> web.Response:
+        body = await request.read()
+        if not verify_signature(secret, body, request.headers.get("X-Hub-Signature-256")):
+            return web.Response(status=401, text="Invalid signature")
+
+        event = request.headers.get("X-GitHub-Event", "")
+        compacted = compact_event(event, json.loads(body))
+        if compacted is not None:
+            try:
+                await on_event(event, compacted)
+            except Exception as e:
+                logger.error(f"Could not pass on a {event} webhook: {e}")
+                # GitHub shows the delivery as failed, it can be redelivered from there
+                return web.Response(status=503)
+        return web.Response(status=204)
+
+    app = web.Application()
+    app.add_routes([web.post("/github/webhook", receive)])
+    return app
@@ -0,0 +1,63 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "discord-cluster-manager"))
+
+from message_scheduler import MessageScheduler  # noqa: E402
+
+
+class FakeMessage:
+    def __init__(self, channel: "FakeChannel", content: str):
+        self.channel = channel
+        self.content = content
+
+    async def edit(self, content: str):
+        self.content = content
+
+
+class FakeChannel:
+    id = 1
+
+    def __init__(self):
+        self.messages: list[FakeMessage] = []
+
+    async def send(self, content=None, **kwargs) -> FakeMessage:
+        self.messages.append(FakeMessage(self, content))
+        return self.messages[-1]
+
+
+def contents(channel: FakeChannel) -> list[str]:
+    return [message.content for message in channel.messages]
+
+
+def test_queued_messages_are_merged():
+    async def main():
+        scheduler = MessageScheduler()
+        channel = FakeChannel()
+        sent = await asyncio.gather(*(scheduler.send(channel, text) for text in "abc"))
+        assert contents(channel) == ["a\nb\nc"]
+        assert sent[0] is sent[1] is sent[2]
+
+    asyncio.run(main())
+
+
+def test_edit_after_merge_keeps_neighbours():
+    async def main():
+        scheduler = MessageScheduler()
+        channel = FakeChannel()
+        # As in a Modal run: a progress message queued without waiting, then a status
+        # message that is edited once the run is done
+        scheduler.send(channel, "**Processing `train.py` with T4...**")
+        status = await scheduler.send(channel, "**Running on Modal...**", coalesce=False)
+        scheduler.send(channel, "after")
+        await scheduler.close()
+
+        await status.edit(content="**Running on Modal...**\n> done")
+        assert contents(channel) == [
+            "**Processing `train.py` with T4...**",
+            "**Running on Modal...**\n> done",
+            "after",
+        ]
+
+    asyncio.run(main())